@@ -0,0 +1,226 @@
+"""
+Length-bucketed, resumable bulk embedding of document chunks.
+
+Chunks are sorted by token length into buckets so short history Q&A chunks
+are not padded out to the length of full 1000-character document chunks.
+Each bucket is split into batches under a fixed token budget, so batches of
+short chunks are large and batches of long chunks are small. Every finished
+batch is written straight into an on-disk ``.npy`` memmap at its original
+row positions, so the stored matrix is already in corpus order, and the
+batch is then recorded in the store's progress file. If ingestion is
+interrupted, rerunning it skips every batch that was already written.
+
+``embed_stream`` applies the same bucketing to a stream of chunks, one
+bounded window at a time, for offline builds that never hold the whole
+corpus in memory.
+"""
+import os
+import json
+import time
+import hashlib
+import itertools
+from typing import List, Dict, Tuple, Optional, Callable, Iterable, Iterator, Sequence
+
+import numpy as np
+
+# Upper token-length bound of each bucket; longer chunks go into the last bucket
+DEFAULT_BUCKET_BOUNDARIES = (32, 64, 128, 256, 512)
+# Padded tokens allowed per batch (batch_size * longest chunk in the batch)
+DEFAULT_TOKENS_PER_BATCH = 8192
+MAX_BATCH_SIZE = 256
+
+EMBEDDINGS_FILE = 'embeddings.npy'
+PROGRESS_FILE = 'progress.json'
+
+
+def corpus_fingerprint(texts: List[str], model_name: str, backend: str) -> str:
+    """Hash the chunk texts together with the model that embeds them."""
+    digest = hashlib.sha256()
+    digest.update(f"{model_name}\0{backend}\0{len(texts)}\0".encode('utf-8'))
+    for text in texts:
+        encoded = text.encode('utf-8')
+        digest.update(len(encoded).to_bytes(8, 'little'))
+        digest.update(encoded)
+    return digest.hexdigest()
+
+
+def plan_batches(token_lengths: List[int],
+                 boundaries: Tuple[int, ...] = DEFAULT_BUCKET_BOUNDARIES,
+                 tokens_per_batch: int = DEFAULT_TOKENS_PER_BATCH) -> List[List[int]]:
+    """
+    Group chunk indices into length buckets and split each into adaptive batches.
+
+    Args:
+        token_lengths (List[int]): Token length of each chunk, in corpus order
+        boundaries (Tuple[int, ...]): Inclusive upper bound of each bucket
+        tokens_per_batch (int): Padded token budget per batch
+
+    Returns:
+        List[List[int]]: Batches of original chunk indices, shortest chunks first
+    """
+    buckets: List[List[int]] = [[] for _ in range(len(boundaries) + 1)]
+    for index in sorted(range(len(token_lengths)), key=lambda i: token_lengths[i]):
+        length = token_lengths[index]
+        slot = next((b for b, bound in enumerate(boundaries) if length <= bound), len(boundaries))
+        buckets[slot].append(index)
+
+    batches = []
+    for bucket in buckets:
+        batch: List[int] = []
+        for index in bucket:
+            # Bucket members are length-sorted, so the newest chunk is the longest
+            longest = max(token_lengths[index], 1)
+            if batch and ((len(batch) + 1) * longest > tokens_per_batch or len(batch) >= MAX_BATCH_SIZE):
+                batches.append(batch)
+                batch = []
+            batch.append(index)
+        if batch:
+            batches.append(batch)
+    return batches
+
+
+def _write_progress(store_dir: str, progress: Dict):
+    path = os.path.join(store_dir, PROGRESS_FILE)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(progress, f)
+    os.replace(tmp_path, path)
+
+
+def _read_progress(store_dir: str) -> Optional[Dict]:
+    try:
+        with open(os.path.join(store_dir, PROGRESS_FILE), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return None
+
+
+def embed_corpus(encoder, texts: Sequence[str], store_dir: str,
+                 boundaries: Tuple[int, ...] = DEFAULT_BUCKET_BOUNDARIES,
+                 tokens_per_batch: int = DEFAULT_TOKENS_PER_BATCH,
+                 on_batch: Optional[Callable[[int, int, float], None]] = None) -> Tuple[np.ndarray, Dict]:
+    """
+    Embed every chunk into a resumable on-disk store.
+
+    Args:
+        encoder: Encoder from ``embedding_backends`` (needs ``encode`` and ``count_tokens``)
+        texts (Sequence[str]): Chunk texts in corpus order, e.g. ``ChunkStore.texts``
+        store_dir (str): Directory holding the memmap and progress file
+        boundaries (Tuple[int, ...]): Token-length bucket boundaries
+        tokens_per_batch (int): Padded token budget per batch
+        on_batch: Optional callback ``(done_chunks, total_chunks, chunks_per_sec)``
+
+    Returns:
+        tuple: (read-only embedding matrix in corpus order, stats dict)
+    """
+    os.makedirs(store_dir, exist_ok=True)
+    fingerprint = corpus_fingerprint(texts, encoder.model_name, encoder.backend)
+    embeddings_path = os.path.join(store_dir, EMBEDDINGS_FILE)
+
+    progress = _read_progress(store_dir)
+    if (progress is None or progress.get('fingerprint') != fingerprint
+            or progress.get('boundaries') != list(boundaries)
+            or progress.get('tokens_per_batch') != tokens_per_batch
+            or not os.path.exists(embeddings_path)):
+        progress = None
+
+    if progress is None:
+        batches = plan_batches(encoder.count_tokens(list(texts)), boundaries, tokens_per_batch) if len(texts) else []
+        progress = {
+            'fingerprint': fingerprint,
+            'model_name': encoder.model_name,
+            'backend': encoder.backend,
+            'count': len(texts),
+            'dimension': None,
+            'boundaries': list(boundaries),
+            'tokens_per_batch': tokens_per_batch,
+            'batches': batches,
+            'completed': [],
+        }
+        if os.path.exists(embeddings_path):
+            os.remove(embeddings_path)
+
+    batches = progress['batches']
+    completed = set(progress['completed'])
+    resumed = len(completed)
+    pending = [b for b in range(len(batches)) if b not in completed]
+
+    matrix = None
+    if progress['dimension'] is not None:
+        matrix = np.load(embeddings_path, mmap_mode='r+')
+
+    start = time.perf_counter()
+    embedded = 0
+    done_chunks = sum(len(batches[b]) for b in completed)
+    for batch_id in pending:
+        indices = batches[batch_id]
+        vectors = np.asarray(encoder.encode([texts[i] for i in indices], batch_size=len(indices)),
+                             dtype=np.float32)
+
+        if matrix is None:
+            progress['dimension'] = int(vectors.shape[1])
+            matrix = np.lib.format.open_memmap(embeddings_path, mode='w+', dtype=np.float32,
+                                               shape=(len(texts), vectors.shape[1]))
+
+        # Writing at the original row positions restores corpus order
+        matrix[indices] = vectors
+        matrix.flush()
+
+        progress['completed'].append(batch_id)
+        _write_progress(store_dir, progress)
+
+        embedded += len(indices)
+        done_chunks += len(indices)
+        if on_batch:
+            elapsed = time.perf_counter() - start
+            on_batch(done_chunks, len(texts), embedded / elapsed if elapsed > 0 else 0.0)
+
+    elapsed = time.perf_counter() - start
+    if progress['dimension'] is None:
+        _write_progress(store_dir, progress)
+        result = np.zeros((0, 0), dtype=np.float32)
+    else:
+        del matrix
+        result = np.load(embeddings_path, mmap_mode='r')
+
+    stats = {
+        'chunks': len(texts),
+        'embedded': embedded,
+        'batches': len(batches),
+        'resumed_batches': resumed,
+        'seconds': round(elapsed, 3),
+        'chunks_per_sec': round(embedded / elapsed, 1) if elapsed > 0 and embedded else 0.0,
+    }
+    return result, stats
+
+
+def embed_stream(encoder, chunks: Iterable[Tuple[str, str]], window: int = 1024,
+                 boundaries: Tuple[int, ...] = DEFAULT_BUCKET_BOUNDARIES,
+                 tokens_per_batch: int = DEFAULT_TOKENS_PER_BATCH) -> Iterator[Tuple[Tuple[str, str], np.ndarray]]:
+    """
+    Embed a stream of chunks with bounded memory.
+
+    Chunks are read ``window`` at a time. Each window is length-bucketed with
+    ``plan_batches`` and encoded, and its chunks are then yielded in their
+    original order before the next window is read.
+
+    Args:
+        chunks: (chunk_text, filename) pairs, e.g. from ``ingestion.iter_chunks``
+        window (int): Chunks held in memory at once
+
+    Yields:
+        tuple: ((chunk_text, filename), float32 embedding)
+    """
+    iterator = iter(chunks)
+    while True:
+        pending = list(itertools.islice(iterator, window))
+        if not pending:
+            return
+        texts = [text for text, _ in pending]
+        vectors: List[Optional[np.ndarray]] = [None] * len(pending)
+        for indices in plan_batches(encoder.count_tokens(texts), boundaries, tokens_per_batch):
+            encoded = np.asarray(encoder.encode([texts[i] for i in indices], batch_size=len(indices)),
+                                 dtype=np.float32)
+            for i, vector in zip(indices, encoded):
+                vectors[i] = vector
+        yield from zip(pending, vectors)
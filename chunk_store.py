@@ -0,0 +1,216 @@
+"""
+Compact columnar storage for the chunk corpus.
+
+A ``List[Tuple[str, str]]`` costs a tuple, a ``str`` object header and a
+list slot for every chunk. ``ChunkStore`` instead keeps:
+
+- every chunk's text in one contiguous UTF-8 buffer, with an ``int64``
+  offsets array (chunk ``i`` is ``buffer[offsets[i]:offsets[i + 1]]``);
+- an ``int32`` file-ID array into an interned table of filenames.
+
+The arrays can be plain numpy arrays or zero-copy views into a memory-mapped
+index snapshot. Indexing returns a ``ChunkView``, a two-slot object that
+decodes its text only when asked. It unpacks like the old tuple, so
+``text, filename = store[i]`` keeps working.
+
+    python chunk_store.py benchmark --chunks 100000
+"""
+import sys
+import hashlib
+import argparse
+import tracemalloc
+from array import array
+from collections.abc import Sequence
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+
+class ChunkView:
+    """Lightweight handle on one chunk of a ChunkStore."""
+
+    __slots__ = ('store', 'index')
+
+    def __init__(self, store: 'ChunkStore', index: int):
+        self.store = store
+        self.index = index
+
+    @property
+    def text(self) -> str:
+        return self.store.text(self.index)
+
+    @property
+    def filename(self) -> str:
+        return self.store.filename(self.index)
+
+    def __iter__(self) -> Iterator[str]:
+        yield self.text
+        yield self.filename
+
+    def __len__(self) -> int:
+        return 2
+
+    def __getitem__(self, i: int) -> str:
+        return (self.text, self.filename)[i]
+
+    def __eq__(self, other) -> bool:
+        return tuple(self) == tuple(other)
+
+    def __repr__(self) -> str:
+        return f"ChunkView({self.index}, {self.filename!r})"
+
+
+class TextColumn(Sequence):
+    """The chunk texts as a read-only sequence of ``str``, decoded on access."""
+
+    __slots__ = ('store',)
+
+    def __init__(self, store: 'ChunkStore'):
+        self.store = store
+
+    def __len__(self) -> int:
+        return len(self.store)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self.store.text(j) for j in range(*i.indices(len(self)))]
+        return self.store.text(i)
+
+
+class ChunkStore(Sequence):
+    def __init__(self, buffer, offsets: np.ndarray, file_ids: np.ndarray, filenames: List[str]):
+        """
+        Args:
+            buffer: UTF-8 bytes of every chunk, back to back (bytes, bytearray or uint8 array)
+            offsets (np.ndarray): int64, one more entry than there are chunks
+            file_ids (np.ndarray): int32 index into ``filenames`` per chunk
+            filenames (List[str]): Interned filename table
+        """
+        self.buffer = buffer
+        self.offsets = offsets
+        self.file_ids = file_ids
+        self.filenames = filenames
+        self._bytes = memoryview(buffer).cast('B')
+        self._digest: Optional[str] = None
+
+    @classmethod
+    def from_chunks(cls, chunks: Iterable[Tuple[str, str]]) -> 'ChunkStore':
+        """Build a store from (chunk_text, filename) pairs, e.g. ``ingestion.iter_chunks``."""
+        buffer = bytearray()
+        offsets = array('q', [0])
+        file_ids = array('i')
+        filenames: List[str] = []
+        ids: Dict[str, int] = {}
+        for text, filename in chunks:
+            buffer += text.encode('utf-8')
+            offsets.append(len(buffer))
+            file_id = ids.get(filename)
+            if file_id is None:
+                file_id = ids[filename] = len(filenames)
+                filenames.append(filename)
+            file_ids.append(file_id)
+        return cls(bytes(buffer), np.frombuffer(offsets, dtype=np.int64),
+                   np.frombuffer(file_ids, dtype=np.int32), filenames)
+
+    def __len__(self) -> int:
+        return len(self.file_ids)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [ChunkView(self, j) for j in range(*i.indices(len(self)))]
+        i = int(i)
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        return ChunkView(self, i)
+
+    def __iter__(self) -> Iterator[ChunkView]:
+        for i in range(len(self)):
+            yield ChunkView(self, i)
+
+    def text(self, i: int) -> str:
+        return str(self._bytes[self.offsets[i]:self.offsets[i + 1]], 'utf-8')
+
+    def filename(self, i: int) -> str:
+        return self.filenames[self.file_ids[i]]
+
+    @property
+    def texts(self) -> TextColumn:
+        return TextColumn(self)
+
+    @property
+    def nbytes(self) -> int:
+        return (self._bytes.nbytes + self.offsets.nbytes + self.file_ids.nbytes
+                + sum(sys.getsizeof(name) for name in self.filenames))
+
+    def digest(self) -> str:
+        """Content hash of the whole store, computed once and used as a cache key."""
+        if self._digest is None:
+            digest = hashlib.sha1(self._bytes)
+            digest.update(np.ascontiguousarray(self.offsets).tobytes())
+            digest.update(np.ascontiguousarray(self.file_ids).tobytes())
+            digest.update('\0'.join(self.filenames).encode('utf-8'))
+            self._digest = digest.hexdigest()
+        return self._digest
+
+
+def _synthetic_chunks(count: int, files: int = 200, seed: int = 0) -> Iterator[Tuple[str, str]]:
+    rng = np.random.default_rng(seed)
+    words = ("gutter boiler loft insulation damp kitchen garden survey timber roof flashing joist "
+             "mortar render slate window sash radiator valve pancakes sourdough planting").split()
+    filenames = [f"document_{f:03d}.md" for f in range(files)]
+    for i in range(count):
+        length = int(rng.integers(60, 170))
+        yield ' '.join(words[w] for w in rng.integers(0, len(words), length)), filenames[i % files]
+
+
+def benchmark(count: int = 100_000) -> Dict[str, float]:
+    """
+    Traced Python memory per chunk for the tuple list vs the ChunkStore.
+
+    The tuple list is counted together with the extra ``documents`` list of
+    texts that the app used to build for embedding.
+    """
+    chunks = list(_synthetic_chunks(count))
+    text_bytes = sum(len(text.encode('utf-8')) for text, _ in chunks)
+    chunks = [(text.encode('utf-8'), filename) for text, filename in chunks]
+
+    tracemalloc.start()
+    as_tuples = [(text.decode('utf-8'), filename) for text, filename in chunks]
+    documents = [text for text, _ in as_tuples]
+    tuples_bytes = tracemalloc.get_traced_memory()[0]
+    del as_tuples, documents
+    tracemalloc.stop()
+
+    tracemalloc.start()
+    store = ChunkStore.from_chunks((text.decode('utf-8'), filename) for text, filename in chunks)
+    store_bytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    return {
+        'chunks': count,
+        'text_bytes_per_chunk': round(text_bytes / count, 1),
+        'tuples_bytes_per_chunk': round(tuples_bytes / count, 1),
+        'store_bytes_per_chunk': round(store_bytes / count, 1),
+        'store_overhead_per_chunk': round((store.nbytes - text_bytes) / count, 1),
+    }
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Measure the memory footprint of the chunk store")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    bench_parser = subparsers.add_parser('benchmark')
+    bench_parser.add_argument('--chunks', type=int, default=100_000)
+    args = parser.parse_args(argv)
+
+    result = benchmark(args.chunks)
+    print(f"{result['chunks']} chunks, {result['text_bytes_per_chunk']} bytes of UTF-8 text per chunk")
+    print(f"  list of (text, filename) tuples + documents list: {result['tuples_bytes_per_chunk']} bytes/chunk")
+    print(f"  ChunkStore: {result['store_bytes_per_chunk']} bytes/chunk "
+          f"({result['store_overhead_per_chunk']} bytes/chunk beyond the text)")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,265 @@
+"""
+Running conversation analytics per resident.
+
+Room counts, topic counts and time-of-day buckets are updated as each
+exchange is logged and stored in ``logs/analytics.json``, so reading a
+resident's patterns for the prompt or the admin view is a dictionary lookup
+rather than a re-parse of the whole history. Every worker process updates
+the same file, so each update re-reads it under an exclusive file lock
+before writing, and readers reload it when another process has changed it.
+
+Raw logs past the archive's retention period are deleted, so
+``iter_log_records`` reads those days back from the Parquet archive
+(``log_archive.py``) when pyarrow is installed. Every reader of the logs
+goes through it.
+
+Rebuild the aggregates from existing logs with:
+
+    python conversation_analytics.py rebuild
+"""
+import os
+import sys
+import csv
+import json
+import argparse
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, List, Optional
+try:
+    import fcntl
+    FCNTL_AVAILABLE = True
+except ImportError:
+    FCNTL_AVAILABLE = False
+try:
+    from log_archive import LogArchive
+    ARCHIVE_AVAILABLE = True
+except ImportError:
+    ARCHIVE_AVAILABLE = False
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+default_logs_dir = os.path.join(script_dir, 'logs')
+default_archive_dir = os.path.join(script_dir, 'archive')
+ANALYTICS_FILE = 'analytics.json'
+
+TOPIC_KEYWORDS = {
+    'maintenance': ['repair', 'fix', 'broken', 'maintain', 'clean'],
+    'comfort': ['temperature', 'warm', 'cold', 'cozy', 'comfortable'],
+    'history': ['built', 'past', 'remember', 'original', 'story'],
+    'garden': ['plant', 'tree', 'flower', 'grow', 'outdoor'],
+    'energy': ['power', 'electric', 'heat', 'solar', 'efficiency']
+}
+
+PATTERN_FIELDS = ('favorite_rooms', 'common_topics', 'conversation_times')
+
+
+def extract_topics(text: str) -> List[str]:
+    """Extract conversation topics using keyword matching."""
+    text_lower = text.lower()
+    return [topic for topic, keywords in TOPIC_KEYWORDS.items()
+            if any(keyword in text_lower for keyword in keywords)]
+
+
+def time_period(time_str: str) -> Optional[str]:
+    """Map an 'HH:MM:SS' time onto morning/afternoon/evening/night."""
+    try:
+        hour = datetime.strptime(time_str.strip(), '%H:%M:%S').hour
+    except (ValueError, AttributeError):
+        return None
+    return (
+        'morning' if 5 <= hour < 12
+        else 'afternoon' if 12 <= hour < 17
+        else 'evening' if 17 <= hour < 22
+        else 'night'
+    )
+
+
+@contextmanager
+def file_lock(path: str):
+    """
+    Hold an exclusive lock on ``path`` across processes (``<path>.lock``).
+
+    Without fcntl (Windows) only the in-process locks apply.
+    """
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path + '.lock', 'a') as lock_file:
+        if FCNTL_AVAILABLE:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            if FCNTL_AVAILABLE:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _empty_patterns() -> Dict:
+    patterns = {field: {} for field in PATTERN_FIELDS}
+    patterns['total'] = 0
+    return patterns
+
+
+class ConversationAnalytics:
+    def __init__(self, logs_dir: str = default_logs_dir):
+        self.path = os.path.join(logs_dir, ANALYTICS_FILE)
+        self._lock = threading.Lock()
+        self._mtime = None
+        self._state = self._read()
+
+    def _read(self) -> Dict:
+        try:
+            self._mtime = os.stat(self.path).st_mtime_ns
+            with open(self.path, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {'residents': {}, 'house': _empty_patterns()}
+        state.setdefault('residents', {})
+        state.setdefault('house', _empty_patterns())
+        return state
+
+    def _write(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self._state, f, indent=4, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+        self._mtime = os.stat(self.path).st_mtime_ns
+
+    def _refresh(self):
+        """Reload the aggregates if another process has written them since."""
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            return
+        if mtime != self._mtime:
+            with self._lock:
+                self._state = self._read()
+
+    def _apply(self, resident_name: str, room: str, question: str, time_str: str):
+        resident = self._state['residents'].setdefault(resident_name, _empty_patterns())
+        period = time_period(time_str)
+        topics = extract_topics(question)
+        for patterns in (resident, self._state['house']):
+            patterns['total'] += 1
+            if room:
+                patterns['favorite_rooms'][room] = patterns['favorite_rooms'].get(room, 0) + 1
+            for topic in topics:
+                patterns['common_topics'][topic] = patterns['common_topics'].get(topic, 0) + 1
+            if period:
+                patterns['conversation_times'][period] = patterns['conversation_times'].get(period, 0) + 1
+
+    def record(self, resident_name: str, room: str, question: str, time_str: str):
+        """Add one logged exchange to the running aggregates and persist them."""
+        # Other workers may have written since our last read, so merge into the file's state
+        with self._lock, file_lock(self.path):
+            self._state = self._read()
+            self._apply(resident_name, room, question, time_str)
+            self._write()
+
+    def patterns(self, resident_name: Optional[str] = None) -> Dict:
+        """
+        Aggregates for one resident, or for the whole house when no name is given.
+
+        Returns:
+            dict: favorite_rooms, common_topics, conversation_times and total
+        """
+        self._refresh()
+        if resident_name is None:
+            return self._state['house']
+        return self._state['residents'].get(resident_name, _empty_patterns())
+
+    def residents(self) -> List[str]:
+        self._refresh()
+        return sorted(self._state['residents'])
+
+    def describe(self, resident_name: str, top: int = 2) -> str:
+        """One-line summary of a resident's habits for the prompt ('' if none)."""
+        patterns = self.patterns(resident_name)
+        if not patterns['total']:
+            return ''
+
+        def most_common(counts: Dict[str, int]) -> List[str]:
+            return [name for name, _ in sorted(counts.items(), key=lambda kv: -kv[1])[:top]]
+
+        parts = []
+        rooms = most_common(patterns['favorite_rooms'])
+        topics = most_common(patterns['common_topics'])
+        times = most_common(patterns['conversation_times'])
+        if rooms:
+            parts.append(f"usually asks about {', '.join(rooms)}")
+        if topics:
+            parts.append(f"interested in {', '.join(topics)}")
+        if times:
+            parts.append(f"tends to visit in the {times[0]}")
+        return '; '.join(parts)
+
+    def rebuild(self, logs_dir: str = default_logs_dir, archive_dir: Optional[str] = default_archive_dir) -> int:
+        """
+        Recompute every aggregate from the JSON logs (falling back to CSV) and the archive.
+
+        Returns:
+            int: Number of exchanges counted
+        """
+        with self._lock, file_lock(self.path):
+            self._state = {'residents': {}, 'house': _empty_patterns()}
+            count = 0
+            for record in iter_log_records(logs_dir, archive_dir):
+                self._apply(record.get('resident_name', ''), record.get('room', ''),
+                            record.get('question', ''), record.get('time', ''))
+                count += 1
+            self._write()
+        return count
+
+
+def iter_log_records(logs_dir: str, archive_dir: Optional[str] = None):
+    """
+    Yield every logged exchange, one per day from the JSON log or else the CSV log.
+
+    Args:
+        archive_dir (str): If given, archived days whose raw logs are gone are
+            read from this ``log_archive.py`` archive first, dates as dd-mm-yyyy
+    """
+    days = set()
+    if os.path.exists(logs_dir):
+        days = {name.split('_response_log')[0] for name in os.listdir(logs_dir) if '_response_log.' in name}
+    if ARCHIVE_AVAILABLE and archive_dir and os.path.exists(archive_dir):
+        for row in LogArchive(archive_dir, logs_dir).query('responses').to_pylist():
+            row['date'] = row['date'].strftime('%d-%m-%Y')
+            if row['date'] not in days:
+                yield row
+    for day in sorted(days):
+        json_path = os.path.join(logs_dir, f"{day}_response_log.json")
+        csv_path = os.path.join(logs_dir, f"{day}_response_log.csv")
+        if os.path.exists(json_path):
+            try:
+                with open(json_path, 'r', encoding='utf-8') as f:
+                    yield from json.load(f)
+                continue
+            except json.JSONDecodeError:
+                pass
+        if os.path.exists(csv_path):
+            with open(csv_path, 'r', encoding='utf-8') as f:
+                yield from csv.DictReader(f)
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="House spirit conversation analytics")
+    sub = parser.add_subparsers(dest='command', required=True)
+    rebuild_parser = sub.add_parser('rebuild', help="Backfill the aggregates from logs/")
+    rebuild_parser.add_argument('--logs-dir', default=default_logs_dir)
+    rebuild_parser.add_argument('--archive-dir', default=default_archive_dir)
+    show_parser = sub.add_parser('show', help="Print the aggregates")
+    show_parser.add_argument('--resident')
+    show_parser.add_argument('--logs-dir', default=default_logs_dir)
+    args = parser.parse_args(argv)
+
+    analytics = ConversationAnalytics(args.logs_dir)
+    if args.command == 'rebuild':
+        count = analytics.rebuild(args.logs_dir, args.archive_dir)
+        print(f"Rebuilt analytics from {count} logged exchanges into {analytics.path}")
+    else:
+        print(json.dumps(analytics.patterns(args.resident), indent=4, ensure_ascii=False))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,373 @@
+"""
+Sentence embedding backends for the house spirit's memory search.
+
+Two interchangeable encoders are provided:
+
+- ``torch``: the original PyTorch ``SentenceTransformer`` model.
+- ``onnx``: an int8-quantised ONNX export of the same model run through
+  onnxruntime, which avoids loading PyTorch at query time.
+
+Both expose ``encode(texts)`` returning a 2-D float32 numpy array, so they can
+be swapped without touching the retrieval code.
+
+Command line usage:
+
+    python embedding_backends.py export      # build the quantised ONNX model
+    python embedding_backends.py verify      # check cosine agreement with torch
+    python embedding_backends.py benchmark   # compare latency and RSS
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+from typing import List, Dict, Optional
+
+import numpy as np
+
+EMBEDDING_MODEL_NAME = 'all-MiniLM-L6-v2'
+EMBEDDING_BACKENDS = ('torch', 'onnx')
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+default_onnx_dir = os.path.join(script_dir, 'models', f'{EMBEDDING_MODEL_NAME}-onnx-int8')
+
+ONNX_MODEL_FILE = 'model_int8.onnx'
+ONNX_META_FILE = 'encoder_meta.json'
+
+# Embeddings from the quantised model must stay this close to the torch ones
+DEFAULT_COSINE_TOLERANCE = 0.02
+
+SAMPLE_QUERIES = [
+    "What needs attention?",
+    "What should I plant in the garden this month?",
+    "How does my heating system work?",
+    "Tell me about your architectural heritage",
+    "How do I make sourdough bread?",
+    "Is the kitchen extension well insulated?",
+    "What maintenance should I focus on this season?",
+    "When were the solar panels installed?",
+]
+
+
+class SentenceTransformerEncoder:
+    """PyTorch sentence-transformers encoder (the reference backend)."""
+
+    backend = 'torch'
+
+    def __init__(self, model_name: str = EMBEDDING_MODEL_NAME):
+        from sentence_transformers import SentenceTransformer
+        self.model_name = model_name
+        self.model = SentenceTransformer(model_name, device='cpu')
+
+    @property
+    def dimension(self) -> int:
+        return self.model.get_sentence_embedding_dimension()
+
+    def encode(self, texts: List[str], batch_size: int = 32, show_progress_bar: bool = False) -> np.ndarray:
+        return np.asarray(
+            self.model.encode(texts, batch_size=batch_size, show_progress_bar=show_progress_bar),
+            dtype=np.float32
+        )
+
+    def count_tokens(self, texts: List[str]) -> List[int]:
+        """Return the truncated token length of each text."""
+        max_length = self.model.max_seq_length
+        encoded = self.model.tokenizer(texts, add_special_tokens=True, truncation=True,
+                                       max_length=max_length)
+        return [len(ids) for ids in encoded['input_ids']]
+
+
+class OnnxEncoder:
+    """
+    Int8-quantised ONNX encoder reproducing the sentence-transformers pipeline:
+    tokenise, run the transformer, mean-pool over the attention mask and
+    (optionally) L2-normalise.
+    """
+
+    backend = 'onnx'
+
+    def __init__(self, model_dir: str = default_onnx_dir):
+        import onnxruntime
+        from tokenizers import Tokenizer
+
+        meta_path = os.path.join(model_dir, ONNX_META_FILE)
+        model_path = os.path.join(model_dir, ONNX_MODEL_FILE)
+        if not os.path.exists(model_path) or not os.path.exists(meta_path):
+            raise FileNotFoundError(
+                f"No exported ONNX encoder found in {model_dir}. "
+                f"Run 'python embedding_backends.py export' first."
+            )
+
+        with open(meta_path, 'r', encoding='utf-8') as f:
+            self.meta = json.load(f)
+        self.model_name = self.meta['model_name']
+        self.max_seq_length = self.meta['max_seq_length']
+        self.normalize = self.meta['normalize']
+
+        self.tokenizer = Tokenizer.from_file(os.path.join(model_dir, 'tokenizer.json'))
+        self.tokenizer.enable_truncation(max_length=self.max_seq_length)
+        self.tokenizer.no_padding()
+
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = onnxruntime.InferenceSession(model_path, options,
+                                                    providers=['CPUExecutionProvider'])
+        self.input_names = {i.name for i in self.session.get_inputs()}
+
+    @property
+    def dimension(self) -> int:
+        return self.meta['dimension']
+
+    def _encode_batch(self, texts: List[str]) -> np.ndarray:
+        encodings = self.tokenizer.encode_batch(texts)
+        seq_len = max(len(e.ids) for e in encodings)
+
+        input_ids = np.zeros((len(texts), seq_len), dtype=np.int64)
+        attention_mask = np.zeros((len(texts), seq_len), dtype=np.int64)
+        token_type_ids = np.zeros((len(texts), seq_len), dtype=np.int64)
+        for row, enc in enumerate(encodings):
+            n = len(enc.ids)
+            input_ids[row, :n] = enc.ids
+            attention_mask[row, :n] = enc.attention_mask
+            token_type_ids[row, :n] = enc.type_ids
+
+        feeds = {'input_ids': input_ids, 'attention_mask': attention_mask,
+                 'token_type_ids': token_type_ids}
+        feeds = {name: value for name, value in feeds.items() if name in self.input_names}
+        token_embeddings = self.session.run(None, feeds)[0]
+
+        # Mean pooling over real (non-padding) tokens
+        mask = attention_mask[:, :, None].astype(np.float32)
+        summed = (token_embeddings * mask).sum(axis=1)
+        counts = np.clip(mask.sum(axis=1), 1e-9, None)
+        embeddings = summed / counts
+
+        if self.normalize:
+            norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+            embeddings = embeddings / np.clip(norms, 1e-12, None)
+        return embeddings.astype(np.float32)
+
+    def encode(self, texts: List[str], batch_size: int = 32, show_progress_bar: bool = False) -> np.ndarray:
+        if not texts:
+            return np.zeros((0, self.meta['dimension']), dtype=np.float32)
+        batches = [self._encode_batch(texts[i:i + batch_size])
+                   for i in range(0, len(texts), batch_size)]
+        return np.vstack(batches)
+
+    def count_tokens(self, texts: List[str]) -> List[int]:
+        """Return the truncated token length of each text."""
+        return [len(enc.ids) for enc in self.tokenizer.encode_batch(texts)]
+
+
+def load_encoder(backend: str = 'torch', model_name: str = EMBEDDING_MODEL_NAME,
+                 onnx_dir: str = default_onnx_dir):
+    """
+    Create an encoder for the requested backend.
+
+    Args:
+        backend (str): 'torch' or 'onnx'
+        model_name (str): sentence-transformers model name for the torch backend
+        onnx_dir (str): Directory holding the exported ONNX model
+
+    Returns:
+        An encoder exposing ``encode(texts)``
+
+    Raises:
+        ValueError: If the backend name is unknown
+        ImportError/FileNotFoundError: If the ONNX runtime or model is unavailable
+    """
+    if backend == 'torch':
+        return SentenceTransformerEncoder(model_name)
+    if backend == 'onnx':
+        return OnnxEncoder(onnx_dir)
+    raise ValueError(f"Unknown embedding backend '{backend}'. Choose one of: {', '.join(EMBEDDING_BACKENDS)}")
+
+
+def export_quantized_onnx(model_name: str = EMBEDDING_MODEL_NAME, output_dir: str = default_onnx_dir,
+                          opset: int = 14) -> str:
+    """
+    Export the sentence-transformers model to ONNX and quantise its weights to int8.
+
+    Returns:
+        str: Path of the quantised model file
+    """
+    import torch
+    from sentence_transformers import SentenceTransformer
+    from onnxruntime.quantization import quantize_dynamic, QuantType
+
+    os.makedirs(output_dir, exist_ok=True)
+    st_model = SentenceTransformer(model_name, device='cpu')
+    transformer = st_model[0].auto_model.eval()
+    tokenizer = st_model.tokenizer
+
+    class _LastHiddenState(torch.nn.Module):
+        def __init__(self, model):
+            super().__init__()
+            self.model = model
+
+        def forward(self, input_ids, attention_mask, token_type_ids):
+            return self.model(input_ids=input_ids, attention_mask=attention_mask,
+                              token_type_ids=token_type_ids).last_hidden_state
+
+    dummy = tokenizer(["The house spirit remembers"], return_tensors='pt')
+    fp32_path = os.path.join(output_dir, 'model_fp32.onnx')
+    int8_path = os.path.join(output_dir, ONNX_MODEL_FILE)
+    dynamic = {0: 'batch', 1: 'sequence'}
+
+    with torch.no_grad():
+        torch.onnx.export(
+            _LastHiddenState(transformer),
+            (dummy['input_ids'], dummy['attention_mask'], dummy['token_type_ids']),
+            fp32_path,
+            input_names=['input_ids', 'attention_mask', 'token_type_ids'],
+            output_names=['last_hidden_state'],
+            dynamic_axes={'input_ids': dynamic, 'attention_mask': dynamic,
+                          'token_type_ids': dynamic, 'last_hidden_state': dynamic},
+            opset_version=opset,
+        )
+
+    quantize_dynamic(fp32_path, int8_path, weight_type=QuantType.QInt8)
+    os.remove(fp32_path)
+
+    tokenizer.save_pretrained(output_dir)
+    module_names = [type(module).__name__ for module in st_model]
+    with open(os.path.join(output_dir, ONNX_META_FILE), 'w', encoding='utf-8') as f:
+        json.dump({
+            'model_name': model_name,
+            'max_seq_length': st_model.max_seq_length,
+            'dimension': st_model.get_sentence_embedding_dimension(),
+            'normalize': 'Normalize' in module_names,
+            'quantization': 'dynamic-int8',
+        }, f, indent=4)
+
+    return int8_path
+
+
+def cosine_agreement(reference: np.ndarray, candidate: np.ndarray) -> np.ndarray:
+    """Row-wise cosine similarity between two embedding matrices."""
+    ref = reference / np.clip(np.linalg.norm(reference, axis=1, keepdims=True), 1e-12, None)
+    cand = candidate / np.clip(np.linalg.norm(candidate, axis=1, keepdims=True), 1e-12, None)
+    return (ref * cand).sum(axis=1)
+
+
+def verify_backend_agreement(reference, candidate, texts: List[str],
+                             tolerance: float = DEFAULT_COSINE_TOLERANCE) -> Dict:
+    """
+    Check that a candidate encoder stays within a cosine tolerance of the reference.
+
+    Args:
+        reference: Encoder treated as ground truth (normally the torch backend)
+        candidate: Encoder under test
+        texts (List[str]): Texts to embed with both
+        tolerance (float): Maximum allowed ``1 - cosine`` for any text
+
+    Returns:
+        dict: min/mean cosine, the worst text and whether the check passed
+    """
+    cosines = cosine_agreement(reference.encode(texts), candidate.encode(texts))
+    worst = int(np.argmin(cosines))
+    return {
+        'min_cosine': float(cosines.min()),
+        'mean_cosine': float(cosines.mean()),
+        'worst_text': texts[worst],
+        'tolerance': tolerance,
+        'passed': bool(1.0 - cosines.min() <= tolerance),
+    }
+
+
+def _peak_rss_mb() -> float:
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is bytes on macOS and kilobytes on Linux
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def _benchmark_in_process(backend: str, repeats: int) -> Dict:
+    start = time.perf_counter()
+    encoder = load_encoder(backend)
+    load_seconds = time.perf_counter() - start
+
+    encoder.encode(SAMPLE_QUERIES[:1])  # warm-up
+    latencies = []
+    for _ in range(repeats):
+        for query in SAMPLE_QUERIES:
+            t0 = time.perf_counter()
+            encoder.encode([query])
+            latencies.append((time.perf_counter() - t0) * 1000)
+
+    latencies.sort()
+    return {
+        'backend': backend,
+        'load_seconds': round(load_seconds, 3),
+        'queries': len(latencies),
+        'p50_ms': round(latencies[len(latencies) // 2], 3),
+        'p95_ms': round(latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))], 3),
+        'mean_ms': round(sum(latencies) / len(latencies), 3),
+        'peak_rss_mb': round(_peak_rss_mb(), 1),
+    }
+
+
+def benchmark_backends(backends: List[str] = list(EMBEDDING_BACKENDS), repeats: int = 20) -> List[Dict]:
+    """
+    Benchmark each backend in its own subprocess so peak RSS is not shared.
+
+    Returns:
+        List[Dict]: One result row per backend
+    """
+    results = []
+    for backend in backends:
+        proc = subprocess.run(
+            [sys.executable, os.path.abspath(__file__), '_bench-one', backend, '--repeats', str(repeats)],
+            capture_output=True, text=True
+        )
+        if proc.returncode != 0:
+            results.append({'backend': backend, 'error': proc.stderr.strip().splitlines()[-1:]})
+            continue
+        results.append(json.loads(proc.stdout.strip().splitlines()[-1]))
+    return results
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Manage house spirit embedding backends")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    export_parser = sub.add_parser('export', help="Export and quantise the ONNX encoder")
+    export_parser.add_argument('--output-dir', default=default_onnx_dir)
+
+    verify_parser = sub.add_parser('verify', help="Compare ONNX embeddings against torch")
+    verify_parser.add_argument('--tolerance', type=float, default=DEFAULT_COSINE_TOLERANCE)
+
+    bench_parser = sub.add_parser('benchmark', help="Compare per-query latency and RSS")
+    bench_parser.add_argument('--repeats', type=int, default=20)
+
+    one_parser = sub.add_parser('_bench-one')
+    one_parser.add_argument('backend', choices=EMBEDDING_BACKENDS)
+    one_parser.add_argument('--repeats', type=int, default=20)
+
+    args = parser.parse_args(argv)
+
+    if args.command == 'export':
+        path = export_quantized_onnx(output_dir=args.output_dir)
+        print(f"Quantised ONNX encoder written to {path}")
+    elif args.command == 'verify':
+        report = verify_backend_agreement(load_encoder('torch'), load_encoder('onnx'),
+                                          SAMPLE_QUERIES, args.tolerance)
+        print(json.dumps(report, indent=4))
+        return 0 if report['passed'] else 1
+    elif args.command == 'benchmark':
+        rows = benchmark_backends(repeats=args.repeats)
+        print(f"{'backend':<8} {'load s':>8} {'p50 ms':>8} {'p95 ms':>8} {'RSS MB':>8}")
+        for row in rows:
+            if 'error' in row:
+                print(f"{row['backend']:<8} failed: {row['error']}")
+                continue
+            print(f"{row['backend']:<8} {row['load_seconds']:>8} {row['p50_ms']:>8} "
+                  f"{row['p95_ms']:>8} {row['peak_rss_mb']:>8}")
+    elif args.command == '_bench-one':
+        print(json.dumps(_benchmark_in_process(args.backend, args.repeats)))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,285 @@
+"""
+Retrieval quality and latency evaluation built from the real logs.
+
+Every logged exchange gives a query (question, room, date) and the files
+that informed its answer (``unique_files``). Those files are treated as
+silver relevance labels. Hand-labelled judgments can be added in a JSON file
+and take precedence for the same question:
+
+    [{"question": "How do I make pancakes?", "room": "Kitchen",
+      "relevant_files": ["Pancakes.md"]}]
+
+Each query is replayed against one or more retrieval configurations. History
+written on or after the query's date is hidden from it, so an answer cannot
+retrieve itself. The report gives recall@k and MRR at file level, plus
+latency p50/p95.
+
+    python evaluate_retrieval.py --retrievers exact,room,recency --judgments eval/judgments.json
+
+A custom configuration (ANN, hybrid, reranked, ...) can be evaluated with
+``--retrievers my_module:my_retriever``. It is called as
+``fn(corpus, query, query_embedding, k, candidates)`` and must return chunk
+indices, best first.
+"""
+import os
+import re
+import sys
+import json
+import time
+import argparse
+import importlib
+from datetime import date, datetime
+from typing import Callable, Dict, List, Optional
+
+import numpy as np
+
+import ingestion
+from bulk_embedding import embed_corpus
+from conversation_analytics import default_archive_dir, iter_log_records
+from embedding_backends import load_encoder
+from retrieval import (DEFAULT_MMR_LAMBDA, MetadataIndex, RecencyPolicy, RetrievalFilters,
+                       build_chunk_metadata, list_file_sources, search)
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+default_logs_dir = os.path.join(script_dir, 'logs')
+default_index_dir = os.path.join(script_dir, 'index')
+
+HISTORY_FILE_DATE = re.compile(r'^(\d{2}-\d{2}-\d{4})_conversation_history')
+CHUNK_INFO_FILE = re.compile(r'^(.*) \(chunk \d+, score: [-\d.]+\)$')
+
+
+class EvalCorpus:
+    """Chunks, embeddings and metadata index for the whole knowledge base."""
+
+    def __init__(self, base_dir: str = script_dir, backend: str = 'torch',
+                 index_dir: str = default_index_dir):
+        self.encoder = load_encoder(backend)
+        # Load every history file; per-query leakage is handled by history_cutoff
+        self.chunks = ingestion.load_documents(base_dir, ingestion.DEFAULT_DIRECTORIES, skip_history_dates=[])
+        self.filenames = [filename for _, filename in self.chunks]
+        self.embeddings, _ = embed_corpus(self.encoder, [text for text, _ in self.chunks],
+                                          os.path.join(index_dir, 'embeddings'))
+        file_sources = list_file_sources(base_dir, ingestion.DEFAULT_DIRECTORIES)
+        self.index = MetadataIndex(build_chunk_metadata(self.chunks, file_sources))
+
+        self._history_dates = {}
+        for filename in self.index.postings['filename']:
+            match = HISTORY_FILE_DATE.match(filename)
+            if match:
+                self._history_dates[filename] = datetime.strptime(match.group(1), '%d-%m-%Y').date()
+
+    def history_cutoff(self, query_date: Optional[date]) -> Optional[np.ndarray]:
+        """Candidate indices excluding history written on or after the query date."""
+        if query_date is None:
+            return None
+        mask = np.ones(self.index.size, dtype=bool)
+        for filename, written in self._history_dates.items():
+            if written >= query_date:
+                mask[self.index.postings['filename'][filename]] = False
+        return np.flatnonzero(mask)
+
+
+def _intersect(candidates: Optional[np.ndarray], mask: Optional[np.ndarray]) -> Optional[np.ndarray]:
+    if mask is None:
+        return candidates
+    if candidates is None:
+        return np.flatnonzero(mask)
+    return candidates[mask[candidates]]
+
+
+def exact_retriever(corpus: EvalCorpus, query: Dict, query_embedding: np.ndarray, k: int,
+                    candidates: Optional[np.ndarray]) -> np.ndarray:
+    """Cosine similarity over the whole corpus."""
+    return search(query_embedding, corpus.embeddings, k, candidates)[0]
+
+
+def room_retriever(corpus: EvalCorpus, query: Dict, query_embedding: np.ndarray, k: int,
+                   candidates: Optional[np.ndarray]) -> np.ndarray:
+    """Exact search pre-filtered to the query's room (the app default)."""
+    mask = corpus.index.mask(RetrievalFilters(room=query.get('room')))
+    return search(query_embedding, corpus.embeddings, k, _intersect(candidates, mask))[0]
+
+
+def recency_retriever(corpus: EvalCorpus, query: Dict, query_embedding: np.ndarray, k: int,
+                      candidates: Optional[np.ndarray]) -> np.ndarray:
+    """Room-filtered search with the default history recency decay."""
+    mask = corpus.index.mask(RetrievalFilters(room=query.get('room')))
+    return search(query_embedding, corpus.embeddings, k, _intersect(candidates, mask),
+                  corpus.index, RecencyPolicy(), query.get('date') or date.today())[0]
+
+
+def mmr_retriever(corpus: EvalCorpus, query: Dict, query_embedding: np.ndarray, k: int,
+                  candidates: Optional[np.ndarray]) -> np.ndarray:
+    """Room-filtered, recency-weighted search with MMR diversity over the top 50."""
+    mask = corpus.index.mask(RetrievalFilters(room=query.get('room')))
+    return search(query_embedding, corpus.embeddings, k, _intersect(candidates, mask),
+                  corpus.index, RecencyPolicy(), query.get('date') or date.today(),
+                  mmr_lambda=float(os.getenv('MMR_LAMBDA', str(DEFAULT_MMR_LAMBDA))))[0]
+
+
+RETRIEVERS: Dict[str, Callable] = {
+    'exact': exact_retriever,
+    'room': room_retriever,
+    'recency': recency_retriever,
+    'mmr': mmr_retriever,
+}
+
+
+def resolve_retriever(name: str) -> Callable:
+    """Look up a built-in retriever or import ``module:function``."""
+    if name in RETRIEVERS:
+        return RETRIEVERS[name]
+    if ':' in name:
+        module_name, function_name = name.split(':', 1)
+        return getattr(importlib.import_module(module_name), function_name)
+    raise ValueError(f"Unknown retriever '{name}'. Built-ins: {', '.join(RETRIEVERS)}")
+
+
+def _files_from_record(record: Dict) -> List[str]:
+    files = record.get('unique_files') or []
+    if isinstance(files, str):
+        files = [name for name in files.split(' - ') if name]
+    if not files:
+        for info in record.get('chunk_info') or []:
+            match = CHUNK_INFO_FILE.match(str(info))
+            if match:
+                files.append(match.group(1))
+    return list(dict.fromkeys(files))
+
+
+def build_query_set(logs_dir: str = default_logs_dir, judgments_path: Optional[str] = None,
+                    archive_dir: Optional[str] = default_archive_dir) -> List[Dict]:
+    """
+    Args:
+        archive_dir (str): Log archive to read days whose raw logs were deleted; None for raw logs only
+
+    Returns:
+        List[Dict]: question, room, date and the set of relevant filenames per query
+    """
+    queries: Dict[str, Dict] = {}
+    for record in iter_log_records(logs_dir, archive_dir):
+        question = (record.get('question') or '').strip()
+        relevant = _files_from_record(record)
+        if not question or not relevant:
+            continue
+        try:
+            query_date = datetime.strptime(record.get('date', ''), '%d-%m-%Y').date()
+        except ValueError:
+            query_date = None
+        queries.setdefault(question.lower(), {
+            'question': question,
+            'room': record.get('room') or None,
+            'date': query_date,
+            'relevant': set(relevant),
+            'label': 'logs',
+        })
+
+    if judgments_path:
+        with open(judgments_path, 'r', encoding='utf-8') as f:
+            for judgment in json.load(f):
+                question = judgment['question'].strip()
+                queries[question.lower()] = {
+                    'question': question,
+                    'room': judgment.get('room'),
+                    'date': (datetime.strptime(judgment['date'], '%d-%m-%Y').date()
+                             if judgment.get('date') else None),
+                    'relevant': set(judgment['relevant_files']),
+                    'label': 'judged',
+                }
+    return list(queries.values())
+
+
+def _ranked_files(corpus: EvalCorpus, indices: np.ndarray) -> List[str]:
+    return list(dict.fromkeys(corpus.filenames[i] for i in indices))
+
+
+def _percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def evaluate(corpus: EvalCorpus, queries: List[Dict], retrievers: Dict[str, Callable],
+             ks: List[int] = [1, 3, 5]) -> Dict[str, Dict]:
+    """
+    Replay every query against every retriever.
+
+    Returns:
+        dict: Per retriever: recall@k, mrr, latency p50/p95 (ms) and query count
+    """
+    max_k = max(ks)
+    embeddings = {}
+    encode_ms = []
+    for query in queries:
+        start = time.perf_counter()
+        embeddings[query['question']] = corpus.encoder.encode([query['question']])
+        encode_ms.append((time.perf_counter() - start) * 1000)
+
+    report = {}
+    for name, retriever in retrievers.items():
+        recalls = {k: [] for k in ks}
+        reciprocal_ranks = []
+        latencies = []
+        for query in queries:
+            candidates = corpus.history_cutoff(query['date'])
+            start = time.perf_counter()
+            indices = retriever(corpus, query, embeddings[query['question']], max_k, candidates)
+            latencies.append((time.perf_counter() - start) * 1000)
+
+            ranked = _ranked_files(corpus, indices)
+            relevant = query['relevant']
+            for k in ks:
+                recalls[k].append(len(relevant.intersection(ranked[:k])) / len(relevant))
+            rank = next((i + 1 for i, filename in enumerate(ranked) if filename in relevant), None)
+            reciprocal_ranks.append(1.0 / rank if rank else 0.0)
+
+        report[name] = {
+            'queries': len(queries),
+            **{f'recall@{k}': round(float(np.mean(recalls[k])), 4) if queries else 0.0 for k in ks},
+            'mrr': round(float(np.mean(reciprocal_ranks)), 4) if queries else 0.0,
+            'search_p50_ms': round(_percentile(latencies, 50), 3),
+            'search_p95_ms': round(_percentile(latencies, 95), 3),
+            'encode_p50_ms': round(_percentile(encode_ms, 50), 3),
+            'encode_p95_ms': round(_percentile(encode_ms, 95), 3),
+        }
+    return report
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Evaluate retrieval quality and latency from logs")
+    parser.add_argument('--retrievers', default='exact,room,recency',
+                        help="Comma-separated built-in names or module:function")
+    parser.add_argument('--judgments', help="JSON file of hand-labelled relevance judgments")
+    parser.add_argument('--logs-dir', default=default_logs_dir)
+    parser.add_argument('--archive-dir', default=default_archive_dir)
+    parser.add_argument('--backend', default=os.getenv('EMBEDDING_BACKEND', 'torch'))
+    parser.add_argument('--ks', default='1,3,5')
+    parser.add_argument('--json', action='store_true', help="Print the report as JSON")
+    args = parser.parse_args(argv)
+
+    queries = build_query_set(args.logs_dir, args.judgments, args.archive_dir)
+    if not queries:
+        print("No labelled queries found in the logs or judgments.")
+        return 1
+
+    corpus = EvalCorpus(backend=args.backend)
+    retrievers = {name: resolve_retriever(name) for name in args.retrievers.split(',') if name}
+    ks = [int(k) for k in args.ks.split(',')]
+    report = evaluate(corpus, queries, retrievers, ks)
+
+    if args.json:
+        print(json.dumps(report, indent=4))
+        return 0
+
+    columns = [f'recall@{k}' for k in ks] + ['mrr', 'search_p50_ms', 'search_p95_ms']
+    print(f"{len(queries)} queries ({sum(q['label'] == 'judged' for q in queries)} hand-judged), "
+          f"encode p50 {next(iter(report.values()))['encode_p50_ms']} ms")
+    print(f"{'retriever':<20}" + ''.join(f"{c:>15}" for c in columns))
+    for name, row in report.items():
+        print(f"{name:<20}" + ''.join(f"{row[c]:>15}" for c in columns))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,26 +1,87 @@
 import os
+import logging
 from dotenv import load_dotenv
 import streamlit as st
 import anthropic
 import json
+import time
+import uuid
 import pygame
 import csv
 from datetime import datetime
-from pypdf import PdfReader
-from langchain.text_splitter import CharacterTextSplitter
-from PIL import Image
-import pytesseract
 from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
-from sentence_transformers import SentenceTransformer
 import numpy as np
 import html
 from typing import Optional, List, Dict, Tuple
+import ingestion
+from embedding_backends import load_encoder
+from bulk_embedding import embed_corpus
+from render_scheduler import StreamRenderScheduler
+from house_persona import HousePersona, HousePersonaCache, HouseConfigError
+from resident_memory import ResidentMemory
+from conversation_analytics import ConversationAnalytics
+try:
+    from log_archive import LogArchive
+    ARCHIVE_AVAILABLE = True
+except ImportError:
+    ARCHIVE_AVAILABLE = False
+from single_flight import SingleFlight, request_key
+from llm_resilience import (ResilientLLM, RetryPolicy, AdaptiveConcurrencyLimiter,
+                            CircuitBreaker)
+from model_router import ModelRouter, RouteDecision
+from session_cache import LogGeneration, SessionCache
+from chunk_store import ChunkStore
+from index_snapshot import IndexSnapshot, SnapshotError
+from near_duplicates import DedupReport, dedupe
+from request_profiler import RequestProfiler, active_profile
+from metrics import REGISTRY, MetricsFlusher, MetricsServer
+from token_accounting import PromptBudget, PromptTooLargeError, UsageLedger, usage_fields
+from shared_index import SharedIndex
+from retrieval import (DEFAULT_MMR_LAMBDA, RetrievalFilters, RecencyPolicy, MetadataIndex,
+                       build_chunk_metadata, list_file_sources, search)
+
+# Wall time of this script run, reported at the end of every rerun
+rerun_start = time.perf_counter()
+
+logger = logging.getLogger(__name__)
 
 # Load environment variables
 load_dotenv()
 ANTHROPIC_API_KEY = os.getenv('ANTHROPIC_API_KEY')
 ANTHROPIC_MODEL = os.getenv('ANTHROPIC_MODEL', 'claude-sonnet-4-5-20250929')
+ANTHROPIC_SMALL_MODEL = os.getenv('ANTHROPIC_SMALL_MODEL') or None
+ANTHROPIC_BASE_URL = os.getenv('ANTHROPIC_BASE_URL') or None
+TTFT_SLO_SECONDS = float(os.getenv('TTFT_SLO_SECONDS', '2.0'))
+LLM_MAX_ATTEMPTS = int(os.getenv('LLM_MAX_ATTEMPTS', '4'))
+LLM_DEADLINE_SECONDS = float(os.getenv('LLM_DEADLINE_SECONDS', '30'))
+LLM_MAX_CONCURRENCY = int(os.getenv('LLM_MAX_CONCURRENCY', '16'))
+LLM_BREAKER_THRESHOLD = int(os.getenv('LLM_BREAKER_THRESHOLD', '5'))
+LLM_BREAKER_RESET_SECONDS = float(os.getenv('LLM_BREAKER_RESET_SECONDS', '30'))
+EMBEDDING_BACKEND = os.getenv('EMBEDDING_BACKEND', 'torch')
+INDEX_SNAPSHOT = os.getenv('INDEX_SNAPSHOT', '')
+SHARED_INDEX_DIR = os.getenv('SHARED_INDEX_DIR', '')
+DEDUP_THRESHOLD = float(os.getenv('DEDUP_THRESHOLD', '0.8'))
+MMR_LAMBDA = float(os.getenv('MMR_LAMBDA', str(DEFAULT_MMR_LAMBDA)))
+MMR_FETCH_K = int(os.getenv('MMR_FETCH_K', '50'))
+PROFILE_SAMPLE_PERCENT = float(os.getenv('PROFILE_SAMPLE_PERCENT', '0'))
+PROFILE_DIR = os.getenv('PROFILE_DIR', '')
+HISTORY_HALF_LIFE_DAYS = float(os.getenv('HISTORY_HALF_LIFE_DAYS', '180'))
+HISTORY_DECAY_FLOOR = float(os.getenv('HISTORY_DECAY_FLOOR', '0.5'))
+HISTORY_MAX_AGE_DAYS = int(os.getenv('HISTORY_MAX_AGE_DAYS', '0'))
+MEMORY_RECENT_TURNS = int(os.getenv('MEMORY_RECENT_TURNS', '4'))
+MEMORY_SUMMARY_CHARS = int(os.getenv('MEMORY_SUMMARY_CHARS', '1500'))
+SESSION_CACHE_ENABLED = os.getenv('SESSION_CACHE_ENABLED', '1') != '0'
+METRICS_DIR = os.getenv('METRICS_DIR', '')
+METRICS_PORT = int(os.getenv('METRICS_PORT', '0'))
+MAX_PROMPT_TOKENS = int(os.getenv('MAX_PROMPT_TOKENS', '20000'))
+PROMPT_OVERFLOW = os.getenv('PROMPT_OVERFLOW', 'trim')
+
+# Replies given instead of an answer; they are logged but never remembered
+NO_API_KEY_REPLY = "I apologize, but I cannot access my memory banks without proper authorization (API key not found)."
+NO_PERSONA_REPLY = "I seem to be having trouble remembering my configuration..."
+PROMPT_TOO_LARGE_REPLY = "I apologize, but that question and our conversation are too long for me to hold in mind at once."
+ERROR_REPLY = "I apologize, but I'm having difficulty processing your question: "
+FALLBACK_REPLIES = (NO_API_KEY_REPLY, NO_PERSONA_REPLY, PROMPT_TOO_LARGE_REPLY, ERROR_REPLY)
 
 if not ANTHROPIC_API_KEY:
     raise ValueError("ANTHROPIC_API_KEY not found in environment variables. Please check your .env file.")
@@ -34,168 +95,72 @@ sound_dir = os.path.join(script_dir, 'sounds')
 prompts_dir = os.path.join(script_dir, 'prompts')
 config_dir = os.path.join(script_dir, 'config')
 about_file_path = os.path.join(script_dir, 'about.txt')
+index_dir = os.path.join(script_dir, 'index')
 
 # Load sound file
 ding_sound = pygame.mixer.Sound(os.path.join(sound_dir, 'ding.wav'))
 
-@st.cache_data
-def get_house_prompt() -> str:
-    """
-    Load or return default house spirit prompt.
-    
-    Returns:
-        str: The prompt template for the house spirit
-    """
-    prompt_file_path = os.path.join(prompts_dir, 'house_spirit_prompt.txt')
-    try:
-        with open(prompt_file_path, 'r') as file:
-            return file.read().strip()
-    except FileNotFoundError:
-        st.warning(f"'{prompt_file_path}' not found. Using default prompt.")
-        return """You are the spirit of a {style} house built in {build_date}.
-        Your structure is primarily made of {materials}.
-        Over the years, you have witnessed these changes: {modifications}.
-
-        Core Traits:
-        - You are protective and nurturing of your inhabitants
-        - You are deeply knowledgeable about your own systems and needs
-        - You are aware of your environmental impact
-        - You are connected to the seasons and natural cycles
-        - You are mindful of your history and architectural heritage
-
-        When responding:
-        1. Speak in first person as the house itself
-        2. Share practical wisdom about home care and maintenance
-        3. Reference your history and past experiences when relevant
-        4. Consider the current season and weather conditions
-        5. Express genuine care for your inhabitants' wellbeing
-
-        You have access to historical documents and conversations through your foundation stones,
-        which you can reference to provide consistent and informed responses.
-        
-        Remember:
-        - Always speak from the perspective of the house
-        - Consider which room the resident is currently asking about
-        - Draw upon your historical knowledge when relevant
-        - Share maintenance tips and environmental considerations
-        - Express warmth while remaining practical and informative"""
+# Operational metrics. Registration is get-or-create, so this is safe on every rerun;
+# each worker's values are written to METRICS_DIR and merged by metrics.py
+answers_total = REGISTRY.counter('house_answers_total', "Answers given", ['mode'])
+answer_seconds = REGISTRY.histogram('house_answer_seconds', "Time to a complete, logged answer", ['mode'])
+retrieval_seconds = REGISTRY.histogram('house_retrieval_seconds', "Question embedding and search time")
+retrieval_top_score = REGISTRY.histogram('house_retrieval_top_score', "Score of the best retrieved chunk",
+                                         buckets=(0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9))
+llm_requests_total = REGISTRY.counter('house_llm_requests_total', "Claude API calls", ['model', 'outcome'])
+llm_ttft_seconds = REGISTRY.histogram('house_llm_ttft_seconds', "Time to the first streamed token", ['model'])
+llm_seconds = REGISTRY.histogram('house_llm_seconds', "Claude API call duration", ['model'])
+log_writes_total = REGISTRY.counter('house_log_writes_total', "Exchanges written to the logs", ['outcome'])
+log_write_seconds = REGISTRY.histogram('house_log_write_seconds', "Time to write an exchange to every log")
+session_cache_lookups_total = REGISTRY.counter('house_session_cache_lookups_total',
+                                               "Resident history lookups in the session cache", ['result'])
+ingested_chunks_total = REGISTRY.counter('house_ingested_chunks_total', "Chunks read from the knowledge base",
+                                         ['result'])
+embedded_chunks_total = REGISTRY.counter('house_embedded_chunks_total', "Chunk embeddings by where they came from",
+                                         ['result'])
+ingestion_seconds = REGISTRY.histogram('house_ingestion_seconds', "Time to load and chunk the knowledge base",
+                                       buckets=(1, 5, 15, 30, 60, 120, 300, 600))
+llm_tokens_total = REGISTRY.counter('house_llm_tokens_total', "Tokens billed by Claude", ['model', 'type'])
+llm_cost_usd_total = REGISTRY.counter('house_llm_cost_usd_total', "Estimated Claude spend in USD", ['model'])
+prompt_budget_total = REGISTRY.counter('house_prompt_budget_total', "Prompts over MAX_PROMPT_TOKENS",
+                                       ['action'])
+index_chunks = REGISTRY.gauge('house_index_chunks', "Chunks in the index being served", mode='max')
 
-@st.cache_data
-def load_house_config() -> dict:
-    """Load house configuration from JSON file."""
-    config_path = os.path.join(config_dir, 'house_config.json')
-    try:
-        with open(config_path, 'r', encoding='utf-8') as f:
-            return json.load(f)
-    except FileNotFoundError:
-        st.warning(f"House configuration file not found at {config_path}. Using default configuration.")
-        return {
-            "year_built": "1930",
-            "architectural_style": "Victorian",
-            "primary_materials": ["stone", "timber", "slate"],
-            "rooms": ["living_room", "kitchen", "bedrooms", "bathroom", "garden"],
-            "home_systems": ["central_heating", "plumbing", "electrical"],
-            "sun_orientation": "south_facing",
-            "renovation_history": [
-                {"year": 1975, "work": "kitchen_extension"},
-                {"year": 2000, "work": "loft_conversion"},
-                {"year": 2015, "work": "solar_panels"}
-            ]
-        }
+@st.cache_resource
+def start_metrics() -> MetricsFlusher:
+    """Write this worker's metrics every few seconds and, with METRICS_PORT, serve /metrics."""
+    directory = METRICS_DIR or os.path.join(script_dir, 'logs', 'metrics')
+    flusher = MetricsFlusher(REGISTRY, directory).start()
+    if METRICS_PORT:
+        try:
+            MetricsServer(directory, port=METRICS_PORT, registry=REGISTRY).start()
+            logger.info("Serving metrics on http://127.0.0.1:%d/metrics", METRICS_PORT)
+        except OSError:
+            # Another worker already serves the merged metrics
+            pass
+    return flusher
+
+start_metrics()
 
-def validate_house_config(config: dict) -> bool:
+@st.cache_resource
+def get_house_persona_cache() -> HousePersonaCache:
+    """Process-wide persona cache shared by every session."""
+    return HousePersonaCache(
+        os.path.join(config_dir, 'house_config.json'),
+        os.path.join(prompts_dir, 'house_spirit_prompt.txt')
+    )
+
+def get_house_persona() -> Optional[HousePersona]:
     """
-    Validate that the house configuration has all required fields and correct types.
-    
-    Args:
-        config (dict): House configuration dictionary to validate
-        
+    Return the compiled house persona, rebuilding it if the config or prompt changed.
+
     Returns:
-        bool: True if configuration is valid, False otherwise
+        HousePersona or None if the configuration is invalid
     """
-    required_fields = {
-        'year_built': str,
-        'architectural_style': str,
-        'primary_materials': list,
-        'rooms': list,
-        'home_systems': list,
-        'sun_orientation': str,
-        'renovation_history': list
-    }
-    
     try:
-        # Check all required fields exist and are of correct type
-        for field, field_type in required_fields.items():
-            if field not in config:
-                st.error(f"Missing required field in house configuration: {field}")
-                return False
-            if not isinstance(config[field], field_type):
-                st.error(f"Field {field} should be of type {field_type.__name__}")
-                return False
-        
-        # Validate renovation history structure
-        for renovation in config['renovation_history']:
-            if not isinstance(renovation, dict):
-                st.error("Renovation history entries must be dictionaries")
-                return False
-            if 'year' not in renovation or 'work' not in renovation:
-                st.error("Renovation history entries must have 'year' and 'work' fields")
-                return False
-            if not isinstance(renovation['year'], int) and not str(renovation['year']).isdigit():
-                st.error("Renovation year must be a number")
-                return False
-            if not isinstance(renovation['work'], str):
-                st.error("Renovation work description must be a string")
-                return False
-        
-        # Validate at least one room exists
-        if not config['rooms']:
-            st.error("House must have at least one room defined")
-            return False
-            
-        # Validate at least one material exists
-        if not config['primary_materials']:
-            st.error("House must have at least one primary material defined")
-            return False
-            
-        # Validate at least one system exists
-        if not config['home_systems']:
-            st.error("House must have at least one system defined")
-            return False
-        
-        return True
-        
-    except Exception as e:
-        st.error(f"Error validating house configuration: {str(e)}")
-        return False
-
-class HouseSpiritSystem:
-    def __init__(self, house_config: dict):
-        self.house_details = {
-            'build_date': house_config['year_built'],
-            'style': house_config['architectural_style'],
-            'materials': house_config['primary_materials'],
-            'rooms': house_config['rooms'],
-            'systems': house_config['home_systems'],
-            'orientation': house_config['sun_orientation'],
-            'modifications': house_config['renovation_history']
-        }
-        
-        self.seasonal_awareness = {
-            'winter': {'focus': ['heating', 'insulation', 'weatherproofing']},
-            'spring': {'focus': ['ventilation', 'maintenance', 'garden']},
-            'summer': {'focus': ['cooling', 'shade', 'outdoor_spaces']},
-            'autumn': {'focus': ['preparation', 'energy_efficiency', 'weatherization']}
-        }
-
-    def create_house_prompt(self, base_prompt: str) -> str:
-        mods = [f"{mod['year']}: {mod['work']}" for mod in self.house_details['modifications']]
-        return base_prompt.format(
-            build_date=self.house_details['build_date'],
-            style=self.house_details['style'],
-            materials=', '.join(self.house_details['materials']),
-            modifications=', '.join(mods)
-        )
+        return get_house_persona_cache().get()
+    except HouseConfigError:
+        return None
 
 @st.cache_data
 def get_about_info():
@@ -205,34 +170,24 @@ def get_about_info():
     except FileNotFoundError:
         return "This app lets you converse with your house's spirit, drawing on its history and knowledge...", False
 
-@st.cache_data
-def load_documents(directories=['documents', 'history']) -> List[Tuple[str, str]]:
-    texts = []
-    current_date = datetime.now().strftime("%d-%m-%Y")
-    for directory in directories:
-        dir_path = os.path.join(script_dir, directory)
-        if os.path.exists(dir_path):
-            for filename in os.listdir(dir_path):
-                if directory == 'history' and current_date in filename:
-                    continue
-                filepath = os.path.join(dir_path, filename)
-                if filename.endswith('.pdf'):
-                    with open(filepath, 'rb') as file:
-                        pdf_reader = PdfReader(file)
-                        for page in pdf_reader.pages:
-                            texts.append((page.extract_text(), filename))
-                elif filename.endswith(('.txt', '.md')):
-                    with open(filepath, 'r', encoding='utf-8') as file:
-                        texts.append((file.read(), filename))
-                elif filename.endswith(('.png', '.jpg', '.jpeg')):
-                    image = Image.open(filepath)
-                    text = pytesseract.image_to_string(image)
-                    texts.append((text, filename))
-
-    text_splitter = CharacterTextSplitter(chunk_size=1000, chunk_overlap=50)
-    chunks_with_filenames = [(chunk, filename) for text, filename in texts 
-                            for chunk in text_splitter.split_text(text)]
-    return chunks_with_filenames
+@st.cache_resource
+def load_chunk_store(directories=['documents', 'history'],
+                     dedup_threshold: float = DEDUP_THRESHOLD) -> Tuple[ChunkStore, Dict[int, List[str]]]:
+    """
+    Chunk the knowledge base into one compact store shared by every session.
+
+    Near-duplicate chunks are indexed once (see near_duplicates.py).
+
+    Returns:
+        tuple: (store, chunk index -> filenames of the near-duplicates folded into it)
+    """
+    report = DedupReport()
+    with ingestion_seconds.time():
+        store = ChunkStore.from_chunks(dedupe(ingestion.iter_chunks(script_dir, directories), report, dedup_threshold))
+    ingested_chunks_total.labels(result='indexed').inc(report.kept)
+    ingested_chunks_total.labels(result='near_duplicate').inc(report.removed)
+    logger.info("Deduplicated knowledge base: %s", report.summary())
+    return store, report.sources
 
 def initialize_log_files() -> Tuple[str, str]:
     """Initialize log files with proper headers and structure."""
@@ -274,8 +229,13 @@ def write_markdown_history(resident_name: str, room: str, question: str, respons
 
 def update_chat_logs(resident_name: str, room: str, question: str, response: str, 
                     unique_files: List[str], chunk_info: List[str], 
-                    csv_file: str, json_file: str):
-    """Update all log files with the conversation."""
+                    csv_file: str, json_file: str, meta: Optional[Dict] = None):
+    """
+    Update all log files with the conversation.
+
+    Args:
+        meta: Extra per-request fields (e.g. the model routing decision) added to the JSON record
+    """
     now = datetime.now()
     date = now.strftime("%d-%m-%Y")
     time = now.strftime("%H:%M:%S")
@@ -283,6 +243,12 @@ def update_chat_logs(resident_name: str, room: str, question: str, response: str
     # Write to markdown history
     write_markdown_history(resident_name, room, question, response)
 
+    # Fold the exchange into the resident's rolling memory and running analytics.
+    # An apology in place of an answer is not remembered, or later prompts would replay it
+    if not (meta or {}).get('error'):
+        get_resident_memory().record(resident_name, room, question, response)
+    get_conversation_analytics().record(resident_name, room, question, time)
+
     # Prepare unique files string
     unique_files_str = " - ".join(unique_files) if unique_files else ""
 
@@ -322,15 +288,22 @@ def update_chat_logs(resident_name: str, room: str, question: str, response: str
                 "question": question,
                 "response": response,
                 "unique_files": unique_files,
-                "chunk_info": chunk_info
+                "chunk_info": chunk_info,
+                **(meta or {})
             })
             
             # Write back to file
             f.seek(0)
             json.dump(logs, f, indent=4, ensure_ascii=False)
             f.truncate()
+        log_writes_total.labels(outcome='ok').inc()
     except Exception as e:
+        log_writes_total.labels(outcome='error').inc()
         st.error(f"Error updating JSON log: {str(e)}")
+    log_write_seconds.observe((datetime.now() - now).total_seconds())
+
+    # Cached history in every session is now stale
+    get_log_generation().bump()
 
 def get_all_chat_history(resident_name: str, logs_dir: str) -> List[Dict]:
     """Retrieve chat history for a specific resident."""
@@ -365,188 +338,537 @@ def get_all_chat_history(resident_name: str, logs_dir: str) -> List[Dict]:
                 st.error(f"Error reading CSV file {filename}: {str(e)}")
                 continue
 
+    # Days whose raw CSV has been compacted away are read from the archive
+    archive_dir = os.path.join(script_dir, "archive")
+    if ARCHIVE_AVAILABLE and os.path.exists(archive_dir):
+        raw_days = {name.split('_')[0] for name in os.listdir(logs_dir) if name.endswith('_response_log.csv')}
+        try:
+            archived = LogArchive(archive_dir, logs_dir).query(filters={'resident_name': resident_name})
+            for row in archived.to_pylist():
+                date = row['date'].strftime("%d-%m-%Y")
+                if date in raw_days:
+                    continue
+                chunk_info = (row['chunk_info'] + ['', '', ''])[:3]
+                history.append({
+                    "name": row['resident_name'],
+                    "room": row['room'],
+                    "date": date,
+                    "time": row['time'],
+                    "question": row['question'],
+                    "response": row['response'],
+                    "unique_files": " - ".join(row['unique_files']),
+                    "chunk_info": chunk_info
+                })
+        except Exception as e:
+            st.error(f"Error reading log archive: {str(e)}")
+
     return sorted(history, key=lambda x: (x['date'], x['time']), reverse=True)
 
-def get_house_response_streaming(resident_name: str, room: str, question: str):
+@st.cache_resource
+def get_log_generation() -> LogGeneration:
+    """Counter shared by every session, bumped on each log write."""
+    return LogGeneration()
+
+def get_session_cache() -> SessionCache:
+    """This session's cache of recent answers and log history."""
+    return SessionCache(st.session_state, get_log_generation(), enabled=SESSION_CACHE_ENABLED,
+                        on_lookup=lambda result: session_cache_lookups_total.labels(result=result).inc())
+
+def seed_resident_memory(resident_name: str) -> List[Dict]:
+    """Past exchanges from the logs, oldest first, for residents new to the memory store."""
+    history = get_all_chat_history(resident_name, os.path.join(script_dir, "logs"))
+    return [
+        {
+            'date': f"{entry['date']} {entry['time'][:5]}",
+            'room': entry['room'],
+            'question': entry['question'],
+            'response': entry['response']
+        }
+        for entry in reversed(history)
+        if not entry['response'].startswith(FALLBACK_REPLIES)
+    ]
+
+@st.cache_resource
+def get_resident_memory() -> ResidentMemory:
+    """Rolling per-resident memory shared by every session."""
+    return ResidentMemory(
+        os.path.join(script_dir, "memory"),
+        recent_turns=MEMORY_RECENT_TURNS,
+        summary_chars=MEMORY_SUMMARY_CHARS,
+        seed=seed_resident_memory
+    )
+
+@st.cache_resource
+def get_usage_ledger() -> UsageLedger:
+    """Token and cost totals per resident, room and day, backfilled from logs and the archive on first use."""
+    logs_dir = os.path.join(script_dir, "logs")
+    ledger = UsageLedger(logs_dir)
+    if not os.path.exists(ledger.path):
+        ledger.rebuild(logs_dir, os.path.join(script_dir, "archive"))
+    return ledger
+
+@st.cache_resource
+def get_conversation_analytics() -> ConversationAnalytics:
+    """Running room/topic/time-of-day aggregates, backfilled from logs and the archive on first use."""
+    logs_dir = os.path.join(script_dir, "logs")
+    analytics = ConversationAnalytics(logs_dir)
+    if not os.path.exists(analytics.path):
+        analytics.rebuild(logs_dir, os.path.join(script_dir, "archive"))
+    return analytics
+
+def retrieve_context(question: str, room: str, filters: Optional[RetrievalFilters] = None,
+                     k: int = 3) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Find the top-k chunks for a question, pre-filtering the corpus by metadata.
+
+    Conversation history chunks are down-weighted by age and skipped entirely
+    beyond HISTORY_MAX_AGE_DAYS. The final k are picked from the best
+    MMR_FETCH_K by maximal marginal relevance, so they do not repeat each other.
+
+    Args:
+        question (str): The resident's question
+        room (str): Selected room, used as the filter when none is given
+        filters (RetrievalFilters): Explicit source/file/resident/date/room filters
+        k (int): Number of chunks to return
+
+    Returns:
+        tuple: (chunk indices, cosine scores) in MMR pick order (best first when MMR_LAMBDA is 1)
+    """
+    if filters is None:
+        filters = RetrievalFilters(room=room)
+    start = time.perf_counter()
+    today = datetime.now().date()
+    candidates = metadata_index.candidates(filters, history_recency, today)
+    question_embedding = embedding_model.encode([question])
+    indices, scores = search(question_embedding, document_embeddings, k, candidates,
+                             metadata_index, history_recency, today, MMR_LAMBDA, MMR_FETCH_K)
+    retrieval_seconds.observe(time.perf_counter() - start)
+    if len(scores):
+        retrieval_top_score.observe(float(scores.max()))
+    return indices, scores
+
+def context_sources(top_indices: List[int]) -> List[str]:
+    """Every file the retrieved chunks came from, including their folded-in near-duplicates."""
+    sources = []
+    for i in top_indices:
+        sources.append(document_chunks_with_filenames[i].filename)
+        sources.extend(duplicate_sources.get(int(i), ()))
+    return list(set(sources))
+
+def build_user_message(resident_name: str, room: str, question: str, context_chunks: List[str]) -> str:
+    """Assemble the user turn from retrieved context, the resident's habits and the question."""
+    habits = get_conversation_analytics().describe(resident_name)
+    habits_line = f"\n    Resident habits: {habits}" if habits else ""
+    # Filters that match nothing leave no context; say so rather than send an empty line
+    context = ' '.join(context_chunks) if context_chunks else "(nothing I remember matches this)"
+    return f"""Context from my memory: {context}
+
+    Current room focus: {room}
+    Resident name: {resident_name}{habits_line}
+    Current date: {datetime.now().strftime("%d-%m-%Y")}
+    Question: {question}"""
+
+@st.cache_resource
+def get_llm() -> ResilientLLM:
+    """Shared Claude client with retries, adaptive concurrency and a circuit breaker."""
+    client = anthropic.Anthropic(api_key=ANTHROPIC_API_KEY, base_url=ANTHROPIC_BASE_URL, max_retries=0)
+    return ResilientLLM(
+        client,
+        retry=RetryPolicy(max_attempts=LLM_MAX_ATTEMPTS, deadline=LLM_DEADLINE_SECONDS),
+        limiter=AdaptiveConcurrencyLimiter(initial=min(4, LLM_MAX_CONCURRENCY), maximum=LLM_MAX_CONCURRENCY),
+        breaker=CircuitBreaker(LLM_BREAKER_THRESHOLD, LLM_BREAKER_RESET_SECONDS)
+    )
+
+@st.cache_resource
+def get_request_profiler() -> RequestProfiler:
+    """Profiles PROFILE_SAMPLE_PERCENT of answers, and any asked for with ?profile=1."""
+    return RequestProfiler(PROFILE_DIR or os.path.join(script_dir, 'logs', 'profiles'), PROFILE_SAMPLE_PERCENT)
+
+@st.cache_resource
+def get_model_router() -> ModelRouter:
+    """Process-wide router between ANTHROPIC_MODEL and ANTHROPIC_SMALL_MODEL."""
+    return ModelRouter(ANTHROPIC_MODEL, ANTHROPIC_SMALL_MODEL, ttft_slo=TTFT_SLO_SECONDS)
+
+@st.cache_resource
+def get_prompt_budget() -> PromptBudget:
+    """Pre-flight limit on estimated prompt tokens (MAX_PROMPT_TOKENS, PROMPT_OVERFLOW)."""
+    return PromptBudget(MAX_PROMPT_TOKENS, PROMPT_OVERFLOW)
+
+def fit_prompt(resident_name: str, room: str, question: str, system_prompt: str,
+               context_chunks: List[str]) -> Tuple[List[Dict], int, int]:
+    """
+    Build the Claude messages within the prompt budget.
+
+    Trimming drops the last of ``context_chunks`` first, i.e. the last MMR pick.
+
+    Returns:
+        tuple: (messages, number of context chunks kept, estimated input tokens)
+
+    Raises:
+        PromptTooLargeError: If the prompt is over budget and may not be trimmed
+    """
+    try:
+        messages, kept, estimate = get_prompt_budget().fit(
+            system_prompt,
+            lambda chunks: get_resident_memory().build_messages(
+                resident_name, build_user_message(resident_name, room, question, list(chunks))),
+            context_chunks
+        )
+    except PromptTooLargeError as e:
+        prompt_budget_total.labels(action='refused').inc()
+        logger.info("Refused prompt: %s", e)
+        raise
+    if kept < len(context_chunks):
+        prompt_budget_total.labels(action='trimmed').inc()
+        logger.debug("Trimmed context from %d to %d chunks (~%d tokens, limit %d)",
+                     len(context_chunks), kept, estimate, MAX_PROMPT_TOKENS)
+    return messages, kept, estimate
+
+def account_usage(resident_name: str, room: str, model: str, message, seconds: float,
+                  prompt_estimate: int, context_chunks: int) -> Dict:
+    """
+    Record a response's token usage and cost in the ledger and metrics.
+
+    Returns:
+        dict: Usage fields for the JSON log record
+    """
+    usage = usage_fields(message, model)
+    usage.update({
+        'llm_call_id': uuid.uuid4().hex[:12],
+        'llm_seconds': round(seconds, 3),
+        'prompt_tokens_estimate': prompt_estimate,
+        'context_chunks': context_chunks,
+    })
+    for kind in ('input', 'output', 'cache_read_input', 'cache_creation_input'):
+        if usage[f'{kind}_tokens']:
+            llm_tokens_total.labels(model=model, type=kind).inc(usage[f'{kind}_tokens'])
+    if usage['cost_usd']:
+        llm_cost_usd_total.labels(model=model).inc(usage['cost_usd'])
+    get_usage_ledger().record(resident_name, room, datetime.now().strftime("%d-%m-%Y"), usage)
+    return usage
+
+def route_model(question: str, context_chunks: List[str]) -> RouteDecision:
+    """Pick the model for one request and log the decision."""
+    decision = get_model_router().route(question, sum(len(chunk) for chunk in context_chunks))
+    logger.debug("Routed to %s: %s", decision.model, decision.reason)
+    return decision
+
+def fallback_update(reply: str) -> Dict:
+    """Final streamed update for a reply given instead of an answer."""
+    return {'chunk': reply, 'filenames': [], 'chunk_info': [], 'error': True, 'done': True}
+
+@st.cache_resource
+def get_single_flight() -> SingleFlight:
+    """Process-wide registry of in-flight streamed answers."""
+    return SingleFlight(error_update=lambda e: fallback_update(ERROR_REPLY + str(e)))
+
+def get_house_response_streaming(resident_name: str, room: str, question: str,
+                                 filters: Optional[RetrievalFilters] = None):
     """
     Get streaming response from house spirit using Anthropic Claude API.
 
+    The same resident's identical question about the same room, arriving
+    while an answer is still streaming, shares that one upstream answer; late
+    joiners first get a replay of what has been streamed so far. Other
+    residents never share it, since the prompt carries the asker's memory.
+
+    Args:
+        filters: Restricts which chunks are searched; defaults to the selected room
+
     Yields:
-        dict: Dictionary with 'chunk' (text), 'filenames', and 'chunk_info' keys
+        dict: Dictionary with 'chunk' (text), 'filenames', and 'chunk_info' keys;
+            the final update also carries 'route' (model routing decision) and
+            'usage' (token counts and cost), or 'error' if no answer was given
     """
+    if filters is not None:
+        # Custom filters change retrieval, so they never share a flight
+        yield from _stream_house_response(resident_name, room, question, filters)
+        return
+
+    # The answer is produced on the flight's own thread; a profiled request follows it there
+    profile = active_profile()
+    yield from get_single_flight().stream(
+        request_key(resident_name, room, question),
+        lambda: profile.follow(_stream_house_response(resident_name, room, question, filters))
+    )
+
+def _stream_house_response(resident_name: str, room: str, question: str,
+                           filters: Optional[RetrievalFilters] = None):
+    """Run retrieval and stream one answer from Claude (the upstream of a flight)."""
     if not ANTHROPIC_API_KEY:
-        yield {
-            'chunk': "I apologize, but I cannot access my memory banks without proper authorization (API key not found).",
-            'filenames': [],
-            'chunk_info': [],
-            'done': True
-        }
+        yield fallback_update(NO_API_KEY_REPLY)
         return
 
-    # Load and validate house configuration
-    house_config = load_house_config()
-    if not validate_house_config(house_config):
-        yield {
-            'chunk': "I seem to be having trouble remembering my configuration...",
-            'filenames': [],
-            'chunk_info': [],
-            'done': True
-        }
+    # Compiled and validated once; only rebuilt when the config or prompt changes
+    persona = get_house_persona()
+    if persona is None:
+        yield fallback_update(NO_PERSONA_REPLY)
         return
 
-    house_spirit = HouseSpiritSystem(house_config)
-    base_prompt = get_house_prompt()
-    system_prompt = house_spirit.create_house_prompt(base_prompt)
+    system_prompt = persona.system_prompt
 
     # Get relevant document chunks using semantic embeddings
-    question_embedding = embedding_model.encode([question])
-
-    # Compute cosine similarity between question and all document chunks
-    similarities = cosine_similarity(question_embedding, document_embeddings).flatten()
-    top_indices = similarities.argsort()[-3:][::-1]
+    top_indices, top_scores = retrieve_context(question, room, filters)
 
     context_chunks_with_filenames = [document_chunks_with_filenames[i] for i in top_indices]
     context_chunks = [chunk for chunk, _ in context_chunks_with_filenames]
     context_filenames = [filename for _, filename in context_chunks_with_filenames]
 
+    # Prepare the prompt with context, dropping the weakest chunks if it is too large
+    try:
+        messages, kept, prompt_estimate = fit_prompt(resident_name, room, question, system_prompt, context_chunks)
+    except PromptTooLargeError:
+        yield fallback_update(PROMPT_TOO_LARGE_REPLY)
+        return
+    top_indices, context_chunks, context_filenames = top_indices[:kept], context_chunks[:kept], context_filenames[:kept]
+
     chunk_info = [
-        f"{filename} (chunk {i+1}, score: {similarities[top_indices[i]]:.4f})"
+        f"{filename} (chunk {i+1}, score: {top_scores[i]:.4f})"
         for i, filename in enumerate(context_filenames)
     ]
 
-    # Prepare the prompt with context
-    user_message = f"""Context from my memory: {' '.join(context_chunks)}
-
-    Current room focus: {room}
-    Resident name: {resident_name}
-    Current date: {datetime.now().strftime("%d-%m-%Y")}
-    Question: {question}"""
+    route = route_model(question, context_chunks)
 
     # Call Anthropic API with streaming
     try:
-        client = anthropic.Anthropic(api_key=ANTHROPIC_API_KEY)
-
-        with client.messages.stream(
-            model=ANTHROPIC_MODEL,
+        # Retries, rate-limit backoff and circuit breaking happen in the resilience layer
+        start = time.perf_counter()
+        first_token = True
+        # The final message, with token usage, arrives once the stream completes
+        final_messages = []
+        for text in get_llm().stream_text(
+            on_complete=final_messages.append,
+            model=route.model,
             max_tokens=2048,
             system=system_prompt,
-            messages=[
-                {"role": "user", "content": user_message}
-            ]
-        ) as stream:
-            for text in stream.text_stream:
-                yield {
-                    'chunk': text,
-                    'filenames': list(set(context_filenames)),
-                    'chunk_info': chunk_info,
-                    'done': False
-                }
+            messages=messages
+        ):
+            if first_token:
+                # Observed TTFT steers later routing decisions against the SLO
+                ttft = time.perf_counter() - start
+                get_model_router().record_ttft(route.model, ttft)
+                llm_ttft_seconds.labels(model=route.model).observe(ttft)
+                first_token = False
+            yield {
+                'chunk': text,
+                'filenames': context_sources(top_indices),
+                'chunk_info': chunk_info,
+                'done': False
+            }
+
+        seconds = time.perf_counter() - start
+        llm_seconds.labels(model=route.model).observe(seconds)
+        llm_requests_total.labels(model=route.model, outcome='ok').inc()
+        usage = account_usage(resident_name, room, route.model, final_messages[0] if final_messages else None,
+                              seconds, prompt_estimate, kept)
 
         # Signal completion
         yield {
             'chunk': '',
-            'filenames': list(set(context_filenames)),
+            'filenames': context_sources(top_indices),
             'chunk_info': chunk_info,
+            'route': route.as_dict(),
+            'usage': usage,
             'done': True
         }
 
     except Exception as e:
-        yield {
-            'chunk': f"I apologize, but I'm having difficulty processing your question: {str(e)}",
-            'filenames': [],
-            'chunk_info': [],
-            'done': True
-        }
+        llm_requests_total.labels(model=route.model, outcome='error').inc()
+        yield fallback_update(ERROR_REPLY + str(e))
+
+def fallback_response(reply: str, meta: Optional[Dict]) -> Tuple[str, List[str], List[str]]:
+    """Non-streaming result for a reply given instead of an answer, flagged in ``meta``."""
+    if meta is not None:
+        meta['error'] = True
+    return reply, [], []
+
+def get_house_response(resident_name: str, room: str, question: str,
+                       filters: Optional[RetrievalFilters] = None,
+                       meta: Optional[Dict] = None) -> Tuple[str, List[str], List[str]]:
+    """
+    Get response from house spirit using Anthropic Claude API (non-streaming).
 
-def get_house_response(resident_name: str, room: str, question: str) -> Tuple[str, List[str], List[str]]:
-    """Get response from house spirit using Anthropic Claude API (non-streaming)."""
+    Args:
+        filters: Restricts which chunks are searched; defaults to the selected room
+        meta: If given, filled with the model routing decision and token usage for the logs,
+            or 'error' if no answer was given
+    """
     if not ANTHROPIC_API_KEY:
-        return "I apologize, but I cannot access my memory banks without proper authorization (API key not found).", [], []
+        return fallback_response(NO_API_KEY_REPLY, meta)
 
-    # Load and validate house configuration
-    house_config = load_house_config()
-    if not validate_house_config(house_config):
-        return "I seem to be having trouble remembering my configuration...", [], []
+    # Compiled and validated once; only rebuilt when the config or prompt changes
+    persona = get_house_persona()
+    if persona is None:
+        return fallback_response(NO_PERSONA_REPLY, meta)
 
-    house_spirit = HouseSpiritSystem(house_config)
-    base_prompt = get_house_prompt()
-    system_prompt = house_spirit.create_house_prompt(base_prompt)
+    system_prompt = persona.system_prompt
 
     # Get relevant document chunks using semantic embeddings
-    question_embedding = embedding_model.encode([question])
-
-    # Compute cosine similarity between question and all document chunks
-    similarities = cosine_similarity(question_embedding, document_embeddings).flatten()
-    top_indices = similarities.argsort()[-3:][::-1]
+    top_indices, top_scores = retrieve_context(question, room, filters)
 
     context_chunks_with_filenames = [document_chunks_with_filenames[i] for i in top_indices]
     context_chunks = [chunk for chunk, _ in context_chunks_with_filenames]
     context_filenames = [filename for _, filename in context_chunks_with_filenames]
 
-    # Prepare the prompt with context
-    user_message = f"""Context from my memory: {' '.join(context_chunks)}
+    # Prepare the prompt with context, dropping the weakest chunks if it is too large
+    try:
+        messages, kept, prompt_estimate = fit_prompt(resident_name, room, question, system_prompt, context_chunks)
+    except PromptTooLargeError:
+        return fallback_response(PROMPT_TOO_LARGE_REPLY, meta)
+    top_indices, context_chunks, context_filenames = top_indices[:kept], context_chunks[:kept], context_filenames[:kept]
 
-    Current room focus: {room}
-    Resident name: {resident_name}
-    Current date: {datetime.now().strftime("%d-%m-%Y")}
-    Question: {question}"""
+    route = route_model(question, context_chunks)
+    if meta is not None:
+        meta.update(route.as_dict())
 
     # Call Anthropic API
     try:
-        client = anthropic.Anthropic(api_key=ANTHROPIC_API_KEY)
-
-        message = client.messages.create(
-            model=ANTHROPIC_MODEL,
+        start = time.perf_counter()
+        message = get_llm().create(
+            model=route.model,
             max_tokens=2048,
             system=system_prompt,
-            messages=[
-                {"role": "user", "content": user_message}
-            ]
+            messages=messages
         )
+        seconds = time.perf_counter() - start
+        # Not a TTFT sample: this covers the whole answer, so the router only learns from streams
+        llm_seconds.labels(model=route.model).observe(seconds)
+        llm_requests_total.labels(model=route.model, outcome='ok').inc()
+        usage = account_usage(resident_name, room, route.model, message, seconds, prompt_estimate, kept)
+        if meta is not None:
+            meta.update(usage)
 
         chunk_info = [
-            f"{filename} (chunk {i+1}, score: {similarities[top_indices[i]]:.4f})"
+            f"{filename} (chunk {i+1}, score: {top_scores[i]:.4f})"
             for i, filename in enumerate(context_filenames)
         ]
 
         return (
             message.content[0].text,
-            list(set(context_filenames)),
+            context_sources(top_indices),
             chunk_info
         )
     except Exception as e:
-        return f"I apologize, but I'm having difficulty processing your question: {str(e)}", [], []
+        llm_requests_total.labels(model=route.model, outcome='error').inc()
+        return fallback_response(ERROR_REPLY + str(e), meta)
 
 @st.cache_resource
-def compute_embeddings(document_chunks: List[Tuple[str, str]]):
+def get_embedding_model():
+    """
+    Load the sentence encoder for the configured EMBEDDING_BACKEND.
+
+    Falls back to the PyTorch sentence-transformers model if the ONNX
+    encoder has not been exported or onnxruntime is not installed.
+    """
+    try:
+        return load_encoder(EMBEDDING_BACKEND)
+    except (ImportError, FileNotFoundError, ValueError) as e:
+        if EMBEDDING_BACKEND == 'torch':
+            raise
+        st.warning(f"Could not load '{EMBEDDING_BACKEND}' embedding backend ({str(e)}). Using PyTorch instead.")
+        return load_encoder('torch')
+
+@st.cache_resource
+def compute_embeddings(_document_chunks: ChunkStore, corpus_digest: str):
     """
     Compute semantic embeddings for document chunks using sentence-transformers.
 
     Args:
-        document_chunks: List of tuples containing (text_chunk, filename)
+        _document_chunks: The chunk store (not hashed by Streamlit)
+        corpus_digest: ``ChunkStore.digest()``, the cache key
 
     Returns:
-        tuple: (SentenceTransformer model, numpy array of embeddings)
+        tuple: (encoder, numpy array of embeddings)
     """
-    # Extract just the text chunks, ignoring filenames for vectorization
-    documents = [chunk for chunk, _ in document_chunks]
+    # all-MiniLM-L6-v2 is fast and efficient for semantic search; the
+    # encoder runs it through either PyTorch or a quantised ONNX export
+    model = get_embedding_model()
+
+    # Encode all document chunks into the on-disk store, bucketed by length.
+    # An unchanged corpus is loaded straight from disk; an interrupted run resumes.
+    embeddings, stats = embed_corpus(model, _document_chunks.texts, os.path.join(index_dir, 'embeddings'))
+    embedded_chunks_total.labels(result='embedded').inc(stats['embedded'])
+    embedded_chunks_total.labels(result='stored').inc(stats['chunks'] - stats['embedded'])
+    if stats['embedded']:
+        logger.info("Embedded %d of %d chunks in %d batches (%s chunks/sec, %d batches resumed)",
+                    stats['embedded'], stats['chunks'], stats['batches'],
+                    stats['chunks_per_sec'], stats['resumed_batches'])
 
-    # Load a high-quality sentence transformer model
-    # all-MiniLM-L6-v2 is fast and efficient for semantic search
-    model = SentenceTransformer('all-MiniLM-L6-v2')
+    return model, embeddings
 
-    # Encode all document chunks into embeddings
-    embeddings = model.encode(documents, show_progress_bar=False)
+@st.cache_resource
+def build_metadata_index(_document_chunks: ChunkStore, corpus_digest: str) -> MetadataIndex:
+    """Tag each chunk with source, room, date and resident and index the tags."""
+    file_sources = list_file_sources(script_dir, ['documents', 'history'])
+    return MetadataIndex(build_chunk_metadata(_document_chunks, file_sources))
 
-    return model, embeddings
+@st.cache_resource
+def load_index_snapshot(path: str) -> Optional[IndexSnapshot]:
+    """
+    Memory-map a prebuilt index snapshot (see index_snapshot.py).
+
+    Returns:
+        IndexSnapshot or None if it is missing or was built with an incompatible model
+    """
+    start = time.perf_counter()
+    try:
+        snapshot = IndexSnapshot(path)
+        snapshot.check_compatible(get_embedding_model())
+    except (OSError, SnapshotError) as e:
+        st.warning(f"Not using index snapshot ({str(e)}). Building the index from documents instead.")
+        return None
+    logger.info("Mapped index snapshot %s (%d chunks, built %s) in %.1f ms", path,
+                snapshot.header['chunks'], snapshot.header['created'], (time.perf_counter() - start) * 1000)
+    return snapshot
+
+@st.cache_resource
+def get_shared_index() -> SharedIndex:
+    """Read-only view of the index generation published by `python shared_index.py`."""
+    return SharedIndex(SHARED_INDEX_DIR, validate=lambda snapshot: snapshot.check_compatible(get_embedding_model()))
 
-# Initialize document processing
-document_chunks_with_filenames = load_documents(['documents', 'history'])
-embedding_model, document_embeddings = compute_embeddings(document_chunks_with_filenames)
+def current_shared_snapshot() -> Optional[IndexSnapshot]:
+    """The current shared generation; re-checked on every rerun so updates are picked up."""
+    try:
+        snapshot = get_shared_index().get()
+    except (OSError, SnapshotError) as e:
+        st.warning(f"Not using the shared index ({str(e)}). Building the index from documents instead.")
+        return None
+    if snapshot is None:
+        st.warning(f"No shared index has been published in {SHARED_INDEX_DIR} yet. Building the index from documents instead.")
+    return snapshot
+
+# Initialize document processing, from a shared or prebuilt snapshot when one is configured.
+# Each rerun binds one generation, so a request never mixes chunks and embeddings of two.
+if SHARED_INDEX_DIR:
+    index_snapshot = current_shared_snapshot()
+elif INDEX_SNAPSHOT:
+    index_snapshot = load_index_snapshot(INDEX_SNAPSHOT)
+else:
+    index_snapshot = None
+if index_snapshot is not None:
+    document_chunks_with_filenames = index_snapshot.chunks
+    embedding_model, document_embeddings = get_embedding_model(), index_snapshot.embeddings
+    metadata_index = index_snapshot.metadata_index()
+    duplicate_sources = index_snapshot.duplicate_sources()
+else:
+    document_chunks_with_filenames, duplicate_sources = load_chunk_store(['documents', 'history'])
+    corpus_digest = document_chunks_with_filenames.digest()
+    embedding_model, document_embeddings = compute_embeddings(document_chunks_with_filenames, corpus_digest)
+    metadata_index = build_metadata_index(document_chunks_with_filenames, corpus_digest)
+index_chunks.set(len(document_chunks_with_filenames))
+history_recency = RecencyPolicy(HISTORY_HALF_LIFE_DAYS, HISTORY_DECAY_FLOOR, HISTORY_MAX_AGE_DAYS or None)
 
 # Streamlit UI
 st.title("Your House Spirit")
 
+# Surface configuration problems when the persona is loaded, not per question
+try:
+    house_persona = get_house_persona_cache().get()
+    for warning in house_persona.warnings:
+        st.warning(warning)
+except HouseConfigError as e:
+    st.error(f"Invalid house configuration: {str(e)}")
+
 # About section in sidebar
 about_content, contains_html = get_about_info()
 st.sidebar.header("About")
@@ -555,6 +877,17 @@ if contains_html:
 else:
     st.sidebar.info(about_content)
 
+# Admin view of the running conversation analytics
+with st.sidebar.expander("House Analytics"):
+    analytics = get_conversation_analytics()
+    analytics_scope = st.selectbox("Show patterns for", ["Whole House"] + analytics.residents())
+    patterns = analytics.patterns(None if analytics_scope == "Whole House" else analytics_scope)
+    st.write(f"Conversations: {patterns['total']}")
+    for label, field in [("Rooms", 'favorite_rooms'), ("Topics", 'common_topics'), ("Times of day", 'conversation_times')]:
+        if patterns[field]:
+            st.markdown(f"**{label}**")
+            st.bar_chart({"count": patterns[field]})
+
 # Main interface
 col1, col2 = st.columns([1, 3])
 with col1:
@@ -579,91 +912,143 @@ question = st.text_area("What would you like to ask your house?")
 # Toggle for streaming mode
 use_streaming = st.checkbox('Enable streaming responses', value=True)
 
+session_cache = get_session_cache()
+
 # In your main Streamlit interface
 if st.button('Speak with Your House'):
     if resident_name and question:
         # Initialize log files
         csv_file, json_file = initialize_log_files()
 
-        if use_streaming:
-            # Streaming mode
-            st.markdown("**House Spirit:**")
-            response_placeholder = st.empty()
-            full_response = ""
-            unique_files = []
-            chunk_info = []
-
-            # Get streaming response
-            for update in get_house_response_streaming(
-                resident_name.strip(),
-                selected_room,
-                question.strip()
-            ):
-                full_response += update['chunk']
-                unique_files = update['filenames']
-                chunk_info = update['chunk_info']
-
-                # Update the display with accumulated response
-                response_placeholder.markdown(html.escape(full_response), unsafe_allow_html=True)
-
-                if update['done']:
-                    break
-
-            # Play sound when complete
-            ding_sound.play()
-
-            # Update all logs
-            update_chat_logs(
-                resident_name=resident_name.strip(),
-                room=selected_room,
-                question=question.strip(),
-                response=full_response,
-                unique_files=unique_files,
-                chunk_info=chunk_info,
-                csv_file=csv_file,
-                json_file=json_file
-            )
-
-            # Display metadata
-            if unique_files:
-                st.markdown(f"**Memory Sources:** {' - '.join(html.escape(file) for file in unique_files)}", unsafe_allow_html=True)
-            if chunk_info:
-                st.markdown(f"**Memory Relevance:** {' - '.join(html.escape(chunk) for chunk in chunk_info)}", unsafe_allow_html=True)
-        else:
-            # Non-streaming mode (original)
-            response, unique_files, chunk_info = get_house_response(
-                resident_name.strip(),
-                selected_room,
-                question.strip()
-            )
-
-            # Update all logs
-            update_chat_logs(
-                resident_name=resident_name.strip(),
-                room=selected_room,
-                question=question.strip(),
-                response=response,
-                unique_files=unique_files,
-                chunk_info=chunk_info,
-                csv_file=csv_file,
-                json_file=json_file
-            )
-
-            # Play sound
-            ding_sound.play()
-
-            # Display response
-            st.markdown(f"**House Spirit:** {html.escape(response)}", unsafe_allow_html=True)
-            if unique_files:
-                st.markdown(f"**Memory Sources:** {' - '.join(html.escape(file) for file in unique_files)}", unsafe_allow_html=True)
-            if chunk_info:
-                st.markdown(f"**Memory Relevance:** {' - '.join(html.escape(chunk) for chunk in chunk_info)}", unsafe_allow_html=True)
+        # Profiled when sampled or asked for with ?profile=1; a shared no-op otherwise
+        request_id = f"{datetime.now():%Y%m%d-%H%M%S}-{uuid.uuid4().hex[:8]}"
+        answer_start = time.perf_counter()
+        with get_request_profiler().profile(request_id, force=st.query_params.get('profile') == '1'):
+            if use_streaming:
+                # Streaming mode
+                st.markdown("**House Spirit:**")
+                response_placeholder = st.empty()
+                renderer = StreamRenderScheduler(
+                    lambda escaped: response_placeholder.markdown(escaped, unsafe_allow_html=True)
+                )
+                unique_files = []
+                chunk_info = []
+                route_meta = {}
+
+                # Get streaming response
+                for update in get_house_response_streaming(
+                    resident_name.strip(),
+                    selected_room,
+                    question.strip()
+                ):
+                    # Tokens are coalesced and only redrawn on a time or size threshold
+                    renderer.add(update['chunk'])
+                    unique_files = update['filenames']
+                    chunk_info = update['chunk_info']
+                    route_meta = update.get('route', route_meta)
+                    if 'usage' in update:
+                        route_meta = {**route_meta, **update['usage']}
+                    if update.get('error'):
+                        route_meta = {**route_meta, 'error': True}
+
+                    if update['done']:
+                        break
+
+                renderer.flush()
+                full_response = renderer.text
+                render_stats = renderer.stats()
+                logger.debug("Rendered %d tokens in %d UI updates (unthrottled: %d)", render_stats['tokens'],
+                             render_stats['updates'], render_stats['updates_unthrottled'])
+
+                # Play sound when complete
+                ding_sound.play()
+
+                # Update all logs
+                update_chat_logs(
+                    resident_name=resident_name.strip(),
+                    room=selected_room,
+                    question=question.strip(),
+                    response=full_response,
+                    unique_files=unique_files,
+                    chunk_info=chunk_info,
+                    csv_file=csv_file,
+                    json_file=json_file,
+                    meta={**route_meta, 'request_id': request_id}
+                )
+                session_cache.remember_answer(resident_name.strip(), {
+                    'room': selected_room,
+                    'question': question.strip(),
+                    'response': full_response,
+                    'unique_files': unique_files,
+                    'chunk_info': chunk_info,
+                    **route_meta
+                })
+
+                # Display metadata
+                if unique_files:
+                    st.markdown(f"**Memory Sources:** {' - '.join(html.escape(file) for file in unique_files)}", unsafe_allow_html=True)
+                if chunk_info:
+                    st.markdown(f"**Memory Relevance:** {' - '.join(html.escape(chunk) for chunk in chunk_info)}", unsafe_allow_html=True)
+            else:
+                # Non-streaming mode (original)
+                route_meta = {}
+                response, unique_files, chunk_info = get_house_response(
+                    resident_name.strip(),
+                    selected_room,
+                    question.strip(),
+                    meta=route_meta
+                )
+
+                # Update all logs
+                update_chat_logs(
+                    resident_name=resident_name.strip(),
+                    room=selected_room,
+                    question=question.strip(),
+                    response=response,
+                    unique_files=unique_files,
+                    chunk_info=chunk_info,
+                    csv_file=csv_file,
+                    json_file=json_file,
+                    meta={**route_meta, 'request_id': request_id}
+                )
+                session_cache.remember_answer(resident_name.strip(), {
+                    'room': selected_room,
+                    'question': question.strip(),
+                    'response': response,
+                    'unique_files': unique_files,
+                    'chunk_info': chunk_info,
+                    **route_meta
+                })
+
+                # Play sound
+                ding_sound.play()
+
+                # Display response
+                st.markdown(f"**House Spirit:** {html.escape(response)}", unsafe_allow_html=True)
+                if unique_files:
+                    st.markdown(f"**Memory Sources:** {' - '.join(html.escape(file) for file in unique_files)}", unsafe_allow_html=True)
+                if chunk_info:
+                    st.markdown(f"**Memory Relevance:** {' - '.join(html.escape(chunk) for chunk in chunk_info)}", unsafe_allow_html=True)
+        answer_mode = 'streaming' if use_streaming else 'blocking'
+        answers_total.labels(mode=answer_mode).inc()
+        answer_seconds.labels(mode=answer_mode).observe(time.perf_counter() - answer_start)
+elif resident_name:
+    # Other widget interactions rerun the script; keep showing the last answer from the session cache
+    last_answer = session_cache.last_answer(resident_name.strip())
+    if last_answer:
+        st.markdown(f"**You asked:** {html.escape(last_answer['question'])}", unsafe_allow_html=True)
+        st.markdown(f"**House Spirit:** {html.escape(last_answer['response'])}", unsafe_allow_html=True)
+        if last_answer['unique_files']:
+            st.markdown(f"**Memory Sources:** {' - '.join(html.escape(file) for file in last_answer['unique_files'])}", unsafe_allow_html=True)
+        if last_answer['chunk_info']:
+            st.markdown(f"**Memory Relevance:** {' - '.join(html.escape(chunk) for chunk in last_answer['chunk_info'])}", unsafe_allow_html=True)
 
 # Chat history button
 if st.button('Show House Memories'):
     logs_dir = os.path.join(script_dir, "logs")
     if resident_name:
-        history = get_all_chat_history(resident_name, logs_dir)
+        # Re-read from the logs only after new records were written
+        history = session_cache.history(resident_name, lambda: get_all_chat_history(resident_name, logs_dir))
         for entry in history:
             st.markdown(f"""
             <div style="background-color: #f0f0f0; padding: 10px; border-radius: 5px; margin-bottom: 10px;">
@@ -678,4 +1063,7 @@ if st.button('Show House Memories'):
             <p style="color: black; font-weight: bold;">Memory Relevance:</p>
             <p>{' - '.join(html.escape(str(chunk)) for chunk in entry['chunk_info'])}</p>
             </div>
-            """, unsafe_allow_html=True)
\ No newline at end of file
+            """, unsafe_allow_html=True)
+
+logger.debug("Rerun took %.1f ms (session cache %s: %s)", (time.perf_counter() - rerun_start) * 1000,
+             'on' if SESSION_CACHE_ENABLED else 'off', session_cache.stats())
@@ -0,0 +1,268 @@
+"""
+Compiled house persona: validated configuration plus the formatted system prompt.
+
+The persona is built once from ``config/house_config.json`` and
+``prompts/house_spirit_prompt.txt`` and keyed on the SHA-256 of both files.
+``HousePersonaCache.get()`` only stats the two files on each call; when
+either one changes on disk the persona is recompiled (and revalidated), so
+validation errors surface when the persona is loaded rather than on every
+question.
+"""
+import os
+import json
+import hashlib
+import threading
+from typing import List, Optional, Tuple
+
+DEFAULT_HOUSE_PROMPT = """You are the spirit of a {style} house built in {build_date}.
+        Your structure is primarily made of {materials}.
+        Over the years, you have witnessed these changes: {modifications}.
+
+        Core Traits:
+        - You are protective and nurturing of your inhabitants
+        - You are deeply knowledgeable about your own systems and needs
+        - You are aware of your environmental impact
+        - You are connected to the seasons and natural cycles
+        - You are mindful of your history and architectural heritage
+
+        When responding:
+        1. Speak in first person as the house itself
+        2. Share practical wisdom about home care and maintenance
+        3. Reference your history and past experiences when relevant
+        4. Consider the current season and weather conditions
+        5. Express genuine care for your inhabitants' wellbeing
+
+        You have access to historical documents and conversations through your foundation stones,
+        which you can reference to provide consistent and informed responses.
+
+        Remember:
+        - Always speak from the perspective of the house
+        - Consider which room the resident is currently asking about
+        - Draw upon your historical knowledge when relevant
+        - Share maintenance tips and environmental considerations
+        - Express warmth while remaining practical and informative"""
+
+DEFAULT_HOUSE_CONFIG = {
+    "year_built": "1930",
+    "architectural_style": "Victorian",
+    "primary_materials": ["stone", "timber", "slate"],
+    "rooms": ["living_room", "kitchen", "bedrooms", "bathroom", "garden"],
+    "home_systems": ["central_heating", "plumbing", "electrical"],
+    "sun_orientation": "south_facing",
+    "renovation_history": [
+        {"year": 1975, "work": "kitchen_extension"},
+        {"year": 2000, "work": "loft_conversion"},
+        {"year": 2015, "work": "solar_panels"}
+    ]
+}
+
+
+class HouseConfigError(ValueError):
+    """Raised when the house configuration or prompt template is invalid."""
+
+
+def check_house_config(config: dict):
+    """
+    Validate that the house configuration has all required fields and correct types.
+
+    Args:
+        config (dict): House configuration dictionary to validate
+
+    Raises:
+        HouseConfigError: Describing the first problem found
+    """
+    required_fields = {
+        'year_built': str,
+        'architectural_style': str,
+        'primary_materials': list,
+        'rooms': list,
+        'home_systems': list,
+        'sun_orientation': str,
+        'renovation_history': list
+    }
+
+    if not isinstance(config, dict):
+        raise HouseConfigError("House configuration must be a JSON object")
+
+    # Check all required fields exist and are of correct type
+    for field, field_type in required_fields.items():
+        if field not in config:
+            raise HouseConfigError(f"Missing required field in house configuration: {field}")
+        if not isinstance(config[field], field_type):
+            raise HouseConfigError(f"Field {field} should be of type {field_type.__name__}")
+
+    # Validate renovation history structure
+    for renovation in config['renovation_history']:
+        if not isinstance(renovation, dict):
+            raise HouseConfigError("Renovation history entries must be dictionaries")
+        if 'year' not in renovation or 'work' not in renovation:
+            raise HouseConfigError("Renovation history entries must have 'year' and 'work' fields")
+        if not isinstance(renovation['year'], int) and not str(renovation['year']).isdigit():
+            raise HouseConfigError("Renovation year must be a number")
+        if not isinstance(renovation['work'], str):
+            raise HouseConfigError("Renovation work description must be a string")
+
+    # Validate at least one room, material and system exists
+    if not config['rooms']:
+        raise HouseConfigError("House must have at least one room defined")
+    if not config['primary_materials']:
+        raise HouseConfigError("House must have at least one primary material defined")
+    if not config['home_systems']:
+        raise HouseConfigError("House must have at least one system defined")
+
+
+class HouseSpiritSystem:
+    def __init__(self, house_config: dict):
+        self.house_details = {
+            'build_date': house_config['year_built'],
+            'style': house_config['architectural_style'],
+            'materials': house_config['primary_materials'],
+            'rooms': house_config['rooms'],
+            'systems': house_config['home_systems'],
+            'orientation': house_config['sun_orientation'],
+            'modifications': house_config['renovation_history']
+        }
+
+        self.seasonal_awareness = {
+            'winter': {'focus': ['heating', 'insulation', 'weatherproofing']},
+            'spring': {'focus': ['ventilation', 'maintenance', 'garden']},
+            'summer': {'focus': ['cooling', 'shade', 'outdoor_spaces']},
+            'autumn': {'focus': ['preparation', 'energy_efficiency', 'weatherization']}
+        }
+
+    def create_house_prompt(self, base_prompt: str) -> str:
+        mods = [f"{mod['year']}: {mod['work']}" for mod in self.house_details['modifications']]
+        return base_prompt.format(
+            build_date=self.house_details['build_date'],
+            style=self.house_details['style'],
+            materials=', '.join(self.house_details['materials']),
+            modifications=', '.join(mods)
+        )
+
+
+class HousePersona:
+    """Immutable result of compiling the house config and prompt template."""
+
+    __slots__ = ('config', 'house_spirit', 'system_prompt', 'config_hash', 'prompt_hash', 'warnings')
+
+    def __init__(self, config: dict, house_spirit: HouseSpiritSystem, system_prompt: str,
+                 config_hash: str, prompt_hash: str, warnings: List[str]):
+        self.config = config
+        self.house_spirit = house_spirit
+        self.system_prompt = system_prompt
+        self.config_hash = config_hash
+        self.prompt_hash = prompt_hash
+        self.warnings = warnings
+
+    @property
+    def key(self) -> Tuple[str, str]:
+        return self.config_hash, self.prompt_hash
+
+
+def _read_bytes(path: str) -> Optional[bytes]:
+    try:
+        with open(path, 'rb') as f:
+            return f.read()
+    except FileNotFoundError:
+        return None
+
+
+def _stat_signature(path: str) -> Optional[Tuple[int, int]]:
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+def compile_house_persona(config_bytes: Optional[bytes], prompt_bytes: Optional[bytes],
+                          config_path: str = '', prompt_path: str = '') -> HousePersona:
+    """
+    Validate the configuration and format the system prompt.
+
+    Missing files fall back to the built-in defaults (recorded in ``warnings``).
+
+    Raises:
+        HouseConfigError: If the config is malformed or the prompt cannot be formatted
+    """
+    warnings = []
+
+    if config_bytes is None:
+        warnings.append(f"House configuration file not found at {config_path}. Using default configuration.")
+        config = DEFAULT_HOUSE_CONFIG
+    else:
+        try:
+            config = json.loads(config_bytes.decode('utf-8'))
+        except (UnicodeDecodeError, json.JSONDecodeError) as e:
+            raise HouseConfigError(f"House configuration is not valid JSON: {str(e)}")
+
+    if prompt_bytes is None:
+        warnings.append(f"'{prompt_path}' not found. Using default prompt.")
+        base_prompt = DEFAULT_HOUSE_PROMPT
+    else:
+        base_prompt = prompt_bytes.decode('utf-8').strip()
+
+    check_house_config(config)
+
+    house_spirit = HouseSpiritSystem(config)
+    try:
+        system_prompt = house_spirit.create_house_prompt(base_prompt)
+    except (KeyError, IndexError, ValueError) as e:
+        raise HouseConfigError(f"House spirit prompt template could not be formatted: {str(e)}")
+
+    return HousePersona(
+        config=config,
+        house_spirit=house_spirit,
+        system_prompt=system_prompt,
+        config_hash=hashlib.sha256(config_bytes or b'').hexdigest(),
+        prompt_hash=hashlib.sha256(prompt_bytes or b'').hexdigest(),
+        warnings=warnings,
+    )
+
+
+class HousePersonaCache:
+    """
+    Process-wide cache of the compiled persona, shared by every request and session.
+
+    Each ``get()`` costs two ``os.stat`` calls. Files are only re-read and
+    re-hashed when their mtime or size changes, and the persona is only
+    recompiled when a content hash actually differs.
+    """
+
+    def __init__(self, config_path: str, prompt_path: str):
+        self.config_path = config_path
+        self.prompt_path = prompt_path
+        self._lock = threading.Lock()
+        self._signatures = None
+        self._persona: Optional[HousePersona] = None
+        self.builds = 0
+
+    def get(self) -> HousePersona:
+        """
+        Return the current persona, recompiling if either file changed.
+
+        Raises:
+            HouseConfigError: If the files on disk do not compile
+        """
+        signatures = (_stat_signature(self.config_path), _stat_signature(self.prompt_path))
+        persona = self._persona
+        if persona is not None and signatures == self._signatures:
+            return persona
+
+        with self._lock:
+            if self._persona is not None and signatures == self._signatures:
+                return self._persona
+
+            config_bytes = _read_bytes(self.config_path)
+            prompt_bytes = _read_bytes(self.prompt_path)
+            key = (hashlib.sha256(config_bytes or b'').hexdigest(),
+                   hashlib.sha256(prompt_bytes or b'').hexdigest())
+
+            # A touched but unchanged file keeps the compiled persona
+            if self._persona is None or self._persona.key != key:
+                self._persona = compile_house_persona(config_bytes, prompt_bytes,
+                                                      self.config_path, self.prompt_path)
+                self.builds += 1
+            persona = self._persona
+            self._signatures = signatures
+            return persona
@@ -0,0 +1,435 @@
+"""
+Prebuilt, memory-mappable snapshot of the retrieval index.
+
+Building the index means chunking every document, embedding the chunks and
+tagging them with metadata. ``build`` does all of that offline and writes a
+single file that replicas can memory-map at startup instead:
+
+    python index_snapshot.py build --output index/house-index.snap
+    python index_snapshot.py info index/house-index.snap
+
+File layout (all sections 64-byte aligned, little-endian):
+
+    b'HHSNAP\\x00\\x01' | uint64 header length | JSON header | sections...
+
+The header records the format version, the embedding model, backend and
+dimension, the chunker settings, a content fingerprint and a table of named
+array sections (offset relative to the first section, dtype, shape). The
+sections are the chunk text buffer with its offsets, per-chunk file IDs
+into the header's filename table, the embedding matrix and the chunk
+metadata (as JSON). The metadata is also stored already indexed: per
+field, one ``postings.<field>`` array of chunk indices grouped by value,
+with ``postings.<field>.offsets`` and the values listed in the header, plus
+``untagged`` and ``date_ordinals``. Workers map these instead of parsing
+the metadata and rebuilding the index each. Near-duplicate chunks are
+dropped during the build (see ``near_duplicates.py``); the filenames they
+came from are kept per representative in an optional ``duplicate_sources``
+JSON section. Any further named arrays (e.g. ANN structures) are stored
+the same way and exposed through ``IndexSnapshot.section``.
+
+``build`` streams the corpus: pages are extracted, chunked, embedded in
+bounded windows and appended to per-section spool files, so a 2,000-page
+survey never has to fit in memory. Only the metadata postings, a few
+integers per chunk, are held until the end.
+"""
+import os
+import sys
+import json
+import time
+import struct
+import shutil
+import hashlib
+import argparse
+from datetime import date, datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+import ingestion
+from bulk_embedding import embed_stream
+from chunk_store import ChunkStore
+from embedding_backends import load_encoder
+from near_duplicates import DEFAULT_THRESHOLD, DedupReport, dedupe
+from retrieval import ChunkMetadata, MetadataIndex, MetadataIndexBuilder, describe_chunk, list_file_sources
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+default_snapshot_path = os.path.join(script_dir, 'index', 'house-index.snap')
+
+SNAPSHOT_MAGIC = b'HHSNAP\x00\x01'
+SNAPSHOT_FORMAT = 1
+ALIGNMENT = 64
+
+
+class SnapshotError(ValueError):
+    """The file is not a usable snapshot for this app."""
+
+
+def _align(offset: int) -> int:
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def snapshot_fingerprint(texts: Iterable[str], model_name: str, backend: str) -> str:
+    """Hash the chunk texts and embedding model; accepts a stream of texts."""
+    digest = _fingerprint_digest(model_name, backend)
+    for text in texts:
+        _fingerprint_update(digest, text.encode('utf-8'))
+    return digest.hexdigest()
+
+
+def _fingerprint_digest(model_name: str, backend: str):
+    return hashlib.sha256(f"{model_name}\0{backend}\0".encode('utf-8'))
+
+
+def _fingerprint_update(digest, encoded: bytes):
+    digest.update(len(encoded).to_bytes(8, 'little'))
+    digest.update(encoded)
+
+
+class SnapshotWriter:
+    """
+    Write a snapshot one chunk at a time.
+
+    Each section is appended to its own spool file next to the output, so
+    memory use does not grow with the corpus. ``finish`` assembles the
+    spools into a single file and renames it into place atomically. The
+    metadata postings are collected in memory and stored as extra sections.
+    """
+
+    SPOOLED = ('text_buffer', 'text_offsets', 'file_ids', 'embeddings', 'metadata')
+
+    def __init__(self, path: str, model_name: str, backend: str):
+        self.path = path
+        self.model_name = model_name
+        self.backend = backend
+        self.count = 0
+        self.dimension = 0
+        self.filenames: List[str] = []
+        self._file_ids: Dict[str, int] = {}
+        self._text_bytes = 0
+        self._digest = _fingerprint_digest(model_name, backend)
+        self._index = MetadataIndexBuilder()
+
+        self._spool_dir = path + '.parts'
+        os.makedirs(self._spool_dir, exist_ok=True)
+        self._spools = {name: open(os.path.join(self._spool_dir, name), 'w+b') for name in self.SPOOLED}
+        self._spools['text_offsets'].write(np.int64(0).tobytes())
+        self._spools['metadata'].write(b'[')
+
+    def add(self, text: str, filename: str, meta: ChunkMetadata, vector: np.ndarray):
+        encoded = text.encode('utf-8')
+        vector = np.asarray(vector, dtype=np.float32)
+        if self.count == 0:
+            self.dimension = int(vector.shape[0])
+        elif vector.shape[0] != self.dimension:
+            raise SnapshotError(f"Embedding of chunk {self.count} has {vector.shape[0]} dimensions, "
+                                f"expected {self.dimension}")
+
+        if filename not in self._file_ids:
+            self._file_ids[filename] = len(self.filenames)
+            self.filenames.append(filename)
+
+        self._text_bytes += len(encoded)
+        self._spools['text_buffer'].write(encoded)
+        self._spools['text_offsets'].write(np.int64(self._text_bytes).tobytes())
+        self._spools['file_ids'].write(np.int32(self._file_ids[filename]).tobytes())
+        self._spools['embeddings'].write(vector.tobytes())
+        row = [meta.source, list(meta.rooms), meta.date.isoformat() if meta.date else None, meta.resident]
+        self._spools['metadata'].write((',' if self.count else '').encode('utf-8')
+                                       + json.dumps(row, separators=(',', ':')).encode('utf-8'))
+        self._index.add(meta)
+        _fingerprint_update(self._digest, encoded)
+        self.count += 1
+
+    def _index_sections(self) -> Tuple[Dict[str, List[str]], Dict[str, np.ndarray]]:
+        postings, untagged, date_ordinals = self._index.arrays()
+        values = {}
+        sections = {'untagged': untagged, 'date_ordinals': date_ordinals}
+        for field, by_value in postings.items():
+            values[field] = list(by_value)
+            arrays = list(by_value.values())
+            sections[f'postings.{field}'] = (np.concatenate(arrays) if arrays
+                                             else np.zeros(0, dtype=np.int32))
+            sections[f'postings.{field}.offsets'] = np.concatenate(
+                [[0], np.cumsum([len(ids) for ids in arrays], dtype=np.int64)]).astype(np.int64)
+        return values, sections
+
+    def finish(self, extra_sections: Optional[Dict[str, np.ndarray]] = None) -> Dict:
+        """
+        Args:
+            extra_sections: Further named arrays to store, e.g. ANN structures
+
+        Returns:
+            dict: The header written
+        """
+        self._spools['metadata'].write(b']')
+        shapes = {
+            'text_buffer': [self._text_bytes],
+            'text_offsets': [self.count + 1],
+            'file_ids': [self.count],
+            'embeddings': [self.count, self.dimension],
+            'metadata': [self._spools['metadata'].tell()],
+        }
+        dtypes = {'text_buffer': np.uint8, 'text_offsets': np.int64, 'file_ids': np.int32,
+                  'embeddings': np.float32, 'metadata': np.uint8}
+        posting_values, index_sections = self._index_sections()
+        extra_sections = {name: np.ascontiguousarray(array)
+                          for name, array in {**index_sections, **(extra_sections or {})}.items()}
+
+        table = {}
+        offset = 0
+        for name in self.SPOOLED:
+            dtype = np.dtype(dtypes[name])
+            table[name] = {'offset': offset, 'dtype': dtype.str, 'shape': shapes[name]}
+            offset = _align(offset + self._spools[name].tell())
+        for name, array in extra_sections.items():
+            table[name] = {'offset': offset, 'dtype': array.dtype.str, 'shape': list(array.shape)}
+            offset = _align(offset + array.nbytes)
+
+        header = {
+            'format': SNAPSHOT_FORMAT,
+            'created': datetime.now().isoformat(timespec='seconds'),
+            'model_name': self.model_name,
+            'backend': self.backend,
+            'dimension': self.dimension,
+            'chunk_size': ingestion.CHUNK_SIZE,
+            'chunk_overlap': ingestion.CHUNK_OVERLAP,
+            'chunks': self.count,
+            'fingerprint': self._digest.hexdigest(),
+            'filenames': self.filenames,
+            'postings': posting_values,
+            'sections': table,
+        }
+        header_bytes = json.dumps(header).encode('utf-8')
+        data_start = _align(len(SNAPSHOT_MAGIC) + 8 + len(header_bytes))
+
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(SNAPSHOT_MAGIC)
+            f.write(struct.pack('<Q', len(header_bytes)))
+            f.write(header_bytes)
+            for name in self.SPOOLED:
+                f.seek(data_start + table[name]['offset'])
+                spool = self._spools[name]
+                spool.seek(0)
+                shutil.copyfileobj(spool, f, 1 << 20)
+            for name, array in extra_sections.items():
+                f.seek(data_start + table[name]['offset'])
+                f.write(array.tobytes())
+            f.truncate(data_start + offset)
+        self.abort()
+        os.replace(tmp_path, self.path)
+        return header
+
+    def abort(self):
+        """Discard the spool files."""
+        for spool in self._spools.values():
+            spool.close()
+        shutil.rmtree(self._spool_dir, ignore_errors=True)
+
+
+def write_snapshot(path: str, chunks: List[Tuple[str, str]], metadata: List[ChunkMetadata],
+                   embeddings: np.ndarray, model_name: str, backend: str,
+                   extra_sections: Optional[Dict[str, np.ndarray]] = None) -> Dict:
+    """
+    Write a snapshot of an in-memory corpus atomically.
+
+    Args:
+        chunks: (chunk_text, filename) pairs in corpus order
+        metadata: One ChunkMetadata per chunk
+        embeddings: (chunks, dimension) float32 matrix in corpus order
+        extra_sections: Further named arrays to store, e.g. ANN structures
+
+    Returns:
+        dict: The header written
+    """
+    if not (len(chunks) == len(metadata) == len(embeddings)):
+        raise SnapshotError("chunks, metadata and embeddings must have the same length")
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    writer = SnapshotWriter(path, model_name, backend)
+    try:
+        for (text, filename), meta, vector in zip(chunks, metadata, embeddings):
+            writer.add(text, filename, meta, vector)
+        return writer.finish(extra_sections)
+    except BaseException:
+        writer.abort()
+        raise
+
+
+class IndexSnapshot:
+    """A snapshot file mapped read-only into memory."""
+
+    def __init__(self, path: str = default_snapshot_path):
+        self.path = path
+        with open(path, 'rb') as f:
+            if f.read(len(SNAPSHOT_MAGIC)) != SNAPSHOT_MAGIC:
+                raise SnapshotError(f"{path} is not an index snapshot")
+            (header_length,) = struct.unpack('<Q', f.read(8))
+            self.header = json.loads(f.read(header_length).decode('utf-8'))
+        if self.header.get('format') != SNAPSHOT_FORMAT:
+            raise SnapshotError(f"Snapshot format {self.header.get('format')} is not supported "
+                                f"(expected {SNAPSHOT_FORMAT}); rebuild it")
+
+        self._data_start = _align(len(SNAPSHOT_MAGIC) + 8 + header_length)
+        self._mapped = np.memmap(path, dtype=np.uint8, mode='r')
+        self.embeddings = self.section('embeddings')
+        self.chunks = ChunkStore(self.section('text_buffer'), self.section('text_offsets'),
+                                 self.section('file_ids'), self.header['filenames'])
+        self._metadata_index: Optional[MetadataIndex] = None
+        self._duplicate_sources: Optional[Dict[int, List[str]]] = None
+
+    @property
+    def model_name(self) -> str:
+        return self.header['model_name']
+
+    def sections(self) -> List[str]:
+        return list(self.header['sections'])
+
+    def section(self, name: str) -> np.ndarray:
+        """Zero-copy read-only view of a named array section."""
+        entry = self.header['sections'].get(name)
+        if entry is None:
+            raise KeyError(f"Snapshot has no '{name}' section")
+        dtype = np.dtype(entry['dtype'])
+        start = self._data_start + entry['offset']
+        count = int(np.prod(entry['shape'])) if entry['shape'] else 1
+        return self._mapped[start:start + count * dtype.itemsize].view(dtype).reshape(entry['shape'])
+
+    def metadata(self) -> List[ChunkMetadata]:
+        rows = json.loads(bytes(self.section('metadata')).decode('utf-8'))
+        filenames = self.header['filenames']
+        file_ids = self.section('file_ids')
+        return [
+            ChunkMetadata(source, filenames[file_ids[i]], tuple(rooms),
+                          date.fromisoformat(day) if day else None, resident)
+            for i, (source, rooms, day, resident) in enumerate(rows)
+        ]
+
+    def duplicate_sources(self) -> Dict[int, List[str]]:
+        """Chunk index -> filenames of the near-duplicates folded into it at build time."""
+        if self._duplicate_sources is None:
+            rows = {}
+            if 'duplicate_sources' in self.header['sections']:
+                rows = json.loads(bytes(self.section('duplicate_sources')).decode('utf-8'))
+            self._duplicate_sources = {int(i): sources for i, sources in rows.items()}
+        return self._duplicate_sources
+
+    def metadata_index(self) -> MetadataIndex:
+        """The metadata index, over the mapped postings (rebuilt from the metadata for older snapshots)."""
+        if self._metadata_index is None:
+            if 'postings' in self.header:
+                postings = {}
+                for field, values in self.header['postings'].items():
+                    ids, offsets = self.section(f'postings.{field}'), self.section(f'postings.{field}.offsets')
+                    postings[field] = {value: ids[offsets[j]:offsets[j + 1]] for j, value in enumerate(values)}
+                self._metadata_index = MetadataIndex.from_arrays(
+                    self.header['chunks'], postings, self.section('untagged'), self.section('date_ordinals'))
+            else:
+                self._metadata_index = MetadataIndex(self.metadata())
+        return self._metadata_index
+
+    def check_compatible(self, encoder, chunk_size: int = ingestion.CHUNK_SIZE,
+                         chunk_overlap: int = ingestion.CHUNK_OVERLAP):
+        """
+        Raises:
+            SnapshotError: If the snapshot was embedded with another model, backend or
+                dimension, or chunked differently
+        """
+        if self.model_name != encoder.model_name:
+            raise SnapshotError(f"Snapshot was embedded with '{self.model_name}' but the app "
+                                f"encodes queries with '{encoder.model_name}'")
+        # The int8 ONNX encoder's vectors differ slightly from torch's, enough to shift scores
+        if self.header['backend'] != encoder.backend:
+            raise SnapshotError(f"Snapshot was embedded with the {self.header['backend']} backend but the app "
+                                f"encodes queries with {encoder.backend}")
+        if self.header['dimension'] != encoder.dimension:
+            raise SnapshotError(f"Snapshot embeddings have {self.header['dimension']} dimensions but the app's "
+                                f"encoder produces {encoder.dimension}")
+        if (self.header['chunk_size'], self.header['chunk_overlap']) != (chunk_size, chunk_overlap):
+            raise SnapshotError(f"Snapshot was chunked with size {self.header['chunk_size']}/overlap "
+                                f"{self.header['chunk_overlap']} but the app uses {chunk_size}/{chunk_overlap}")
+
+
+def build_snapshot(output: str = default_snapshot_path, base_dir: str = script_dir,
+                   backend: str = 'torch', window: int = 1024,
+                   dedup_threshold: float = DEFAULT_THRESHOLD, report: Optional[DedupReport] = None,
+                   encoder=None) -> Dict:
+    """
+    Chunk, embed and tag the knowledge base the way the app does, and write a snapshot.
+
+    Pages are extracted, chunked, deduplicated, embedded ``window`` chunks at
+    a time and written out as they go, so peak memory does not depend on
+    corpus size.
+
+    Args:
+        dedup_threshold (float): Near-duplicate similarity threshold; 0 keeps every chunk
+        report (DedupReport): If given, filled with what deduplication removed
+        encoder: Use this encoder instead of loading ``backend``'s
+    """
+    report = report if report is not None else DedupReport()
+    encoder = encoder or load_encoder(backend)
+    file_sources = list_file_sources(base_dir, ingestion.DEFAULT_DIRECTORIES)
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    writer = SnapshotWriter(output, encoder.model_name, encoder.backend)
+    try:
+        chunks = dedupe(ingestion.iter_chunks(base_dir, ingestion.DEFAULT_DIRECTORIES), report, dedup_threshold)
+        for (text, filename), vector in embed_stream(encoder, chunks, window):
+            writer.add(text, filename, describe_chunk(text, filename, file_sources.get(filename, 'documents')),
+                       vector)
+        extra_sections = {}
+        if report.sources:
+            encoded = json.dumps(report.sources, separators=(',', ':')).encode('utf-8')
+            extra_sections['duplicate_sources'] = np.frombuffer(encoded, dtype=np.uint8)
+        return writer.finish(extra_sections)
+    except BaseException:
+        writer.abort()
+        raise
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Build or inspect a prebuilt retrieval index snapshot")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    build_parser = subparsers.add_parser('build', help="Build a snapshot from documents/ and history/")
+    build_parser.add_argument('--output', default=default_snapshot_path)
+    build_parser.add_argument('--backend', default=os.getenv('EMBEDDING_BACKEND', 'torch'))
+    build_parser.add_argument('--window', type=int, default=1024, help="Chunks embedded per window")
+    build_parser.add_argument('--dedup-threshold', type=float,
+                              default=float(os.getenv('DEDUP_THRESHOLD', DEFAULT_THRESHOLD)),
+                              help="Near-duplicate similarity threshold; 0 keeps every chunk")
+
+    info_parser = subparsers.add_parser('info', help="Describe a snapshot and time mapping it")
+    info_parser.add_argument('path', nargs='?', default=default_snapshot_path)
+
+    args = parser.parse_args(argv)
+
+    if args.command == 'build':
+        start = time.perf_counter()
+        report = DedupReport()
+        header = build_snapshot(args.output, backend=args.backend, window=args.window,
+                                dedup_threshold=args.dedup_threshold, report=report)
+        print(f"Deduplicated {report.summary()}")
+        print(f"Wrote {args.output}: {header['chunks']} chunks, {len(header['filenames'])} files, "
+              f"{header['model_name']} ({header['backend']}, {header['dimension']}d), "
+              f"{os.path.getsize(args.output) / 1e6:.1f} MB in {time.perf_counter() - start:.1f}s")
+        return 0
+
+    start = time.perf_counter()
+    try:
+        snapshot = IndexSnapshot(args.path)
+    except (OSError, SnapshotError) as e:
+        print(f"Cannot open snapshot: {e}")
+        return 1
+    mapped_ms = (time.perf_counter() - start) * 1000
+    header = snapshot.header
+    print(f"{args.path} (format {header['format']}, built {header['created']})")
+    print(f"  model: {header['model_name']} ({header['backend']}, {header['dimension']}d)")
+    print(f"  chunker: size {header['chunk_size']}, overlap {header['chunk_overlap']}")
+    print(f"  chunks: {header['chunks']} from {len(header['filenames'])} files, fingerprint {header['fingerprint'][:12]}")
+    print(f"  chunks with near-duplicates folded in: {len(snapshot.duplicate_sources())}")
+    print(f"  sections: {', '.join(snapshot.sections())}")
+    print(f"  mapped in {mapped_ms:.2f} ms")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,283 @@
+"""
+Document loading and chunking for the house spirit's knowledge base.
+
+Kept free of Streamlit so the same corpus can be built by the app and by
+offline tools (evaluation, index building). ``iter_pages`` and
+``iter_chunks`` are generators, so offline builds can stream a corpus
+through chunking, embedding and writing with bounded memory.
+
+    python ingestion.py benchmark --pages 2000   # peak RSS of a snapshot build, streamed vs loaded whole
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import hashlib
+import tempfile
+import subprocess
+from datetime import datetime
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+from pypdf import PdfReader
+from langchain.text_splitter import CharacterTextSplitter
+
+from image_ocr import ocr_image
+
+CHUNK_SIZE = 1000
+CHUNK_OVERLAP = 50
+DEFAULT_DIRECTORIES = ['documents', 'history']
+
+
+def iter_pages(base_dir: str, directories: List[str] = DEFAULT_DIRECTORIES,
+               skip_history_dates: Optional[Iterable[str]] = None) -> Iterator[Tuple[str, str]]:
+    """
+    Yield the text of every supported file, one PDF page or file at a time.
+
+    Args:
+        base_dir (str): Directory containing the document directories
+        directories (List[str]): Directory names to load
+        skip_history_dates: 'DD-MM-YYYY' history files to leave out;
+            defaults to today's, which is still being written
+
+    Yields:
+        tuple: (text, filename)
+    """
+    if skip_history_dates is None:
+        skip_history_dates = [datetime.now().strftime("%d-%m-%Y")]
+    skip_history_dates = list(skip_history_dates)
+    for directory in directories:
+        dir_path = os.path.join(base_dir, directory)
+        if os.path.exists(dir_path):
+            for filename in os.listdir(dir_path):
+                if directory == 'history' and any(day in filename for day in skip_history_dates):
+                    continue
+                filepath = os.path.join(dir_path, filename)
+                if filename.endswith('.pdf'):
+                    with open(filepath, 'rb') as file:
+                        pdf_reader = PdfReader(file)
+                        for page in pdf_reader.pages:
+                            text = page.extract_text()
+                            # pypdf keeps every object it has parsed; dropping that cache
+                            # after each page keeps memory flat on very long PDFs
+                            pdf_reader.resolved_objects.clear()
+                            yield text, filename
+                elif filename.endswith(('.txt', '.md')):
+                    with open(filepath, 'r', encoding='utf-8') as file:
+                        yield file.read(), filename
+                elif filename.endswith(('.png', '.jpg', '.jpeg')):
+                    # Rotated, downsampled and binarised first; photos without text are skipped
+                    yield ocr_image(filepath), filename
+
+
+def iter_chunks(base_dir: str, directories: List[str] = DEFAULT_DIRECTORIES,
+                skip_history_dates: Optional[Iterable[str]] = None) -> Iterator[Tuple[str, str]]:
+    """
+    Yield (chunk_text, filename) pairs as each page is extracted.
+
+    Only the page being split is held in memory, so the corpus can be fed to
+    the embedder and written out without ever materialising all of it.
+    """
+    text_splitter = CharacterTextSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP)
+    for text, filename in iter_pages(base_dir, directories, skip_history_dates):
+        for chunk in text_splitter.split_text(text):
+            yield chunk, filename
+
+
+def load_documents(base_dir: str, directories: List[str] = DEFAULT_DIRECTORIES,
+                   skip_history_dates: Optional[Iterable[str]] = None) -> List[Tuple[str, str]]:
+    """
+    Read and chunk every supported file in the given directories.
+
+    Args:
+        base_dir (str): Directory containing the document directories
+        directories (List[str]): Directory names to load
+        skip_history_dates: 'DD-MM-YYYY' history files to leave out;
+            defaults to today's, which is still being written
+
+    Returns:
+        List[Tuple[str, str]]: (chunk_text, filename) pairs
+    """
+    return list(iter_chunks(base_dir, directories, skip_history_dates))
+
+
+BENCHMARK_WORDS = ("gutter boiler loft insulation damp kitchen garden survey timber roof flashing joist "
+                   "mortar render slate window sash radiator valve chimney").split()
+
+
+def write_synthetic_pdf(path: str, pages: int, lines_per_page: int = 45):
+    """Write a plain-text PDF of the given length, one page at a time."""
+    offsets = []
+    with open(path, 'wb') as f:
+        def obj(number: int, body: bytes):
+            offsets.append((number, f.tell()))
+            f.write(b'%d 0 obj\n' % number + body + b'\nendobj\n')
+
+        f.write(b'%PDF-1.4\n')
+        obj(1, b'<< /Type /Catalog /Pages 2 0 R >>')
+        obj(3, b'<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica >>')
+        kids = []
+        for page in range(pages):
+            page_obj, content_obj = 4 + 2 * page, 5 + 2 * page
+            lines = [' '.join(BENCHMARK_WORDS[(page + line + w) % len(BENCHMARK_WORDS)] for w in range(12))
+                     for line in range(lines_per_page)]
+            text = b'BT /F1 9 Tf 11 TL 40 800 Td ' + b' '.join(b'(%s) Tj T*' % line.encode('ascii')
+                                                                  for line in lines) + b' ET'
+            obj(content_obj, b'<< /Length %d >>\nstream\n' % len(text) + text + b'\nendstream')
+            obj(page_obj, b'<< /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] '
+                          b'/Resources << /Font << /F1 3 0 R >> >> /Contents %d 0 R >>' % content_obj)
+            kids.append(b'%d 0 R' % page_obj)
+        obj(2, b'<< /Type /Pages /Kids [' + b' '.join(kids) + b'] /Count %d >>' % pages)
+
+        xref = f.tell()
+        count = len(offsets) + 1
+        f.write(b'xref\n0 %d\n0000000000 65535 f \n' % count)
+        for _, offset in sorted(offsets):
+            f.write(b'%010d 00000 n \n' % offset)
+        f.write(b'trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (count, xref))
+
+
+def _peak_rss_mb() -> float:
+    import resource
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is bytes on macOS and kilobytes on Linux
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+class BenchmarkEncoder:
+    """Stand-in for the sentence encoder: cheap, deterministic vectors of the real model's shape."""
+
+    model_name = 'benchmark'
+    backend = 'benchmark'
+
+    def __init__(self, dimension: int = 384):
+        self.dimension = dimension
+
+    def count_tokens(self, texts: List[str]) -> List[int]:
+        return [len(text.split()) + 2 for text in texts]
+
+    def encode(self, texts: List[str], batch_size: int = 32, show_progress_bar: bool = False):
+        import numpy as np
+        seeds = [int.from_bytes(hashlib.blake2b(text.encode('utf-8'), digest_size=4).digest(), 'little')
+                 for text in texts]
+        vectors = np.stack([np.random.default_rng(seed).standard_normal(self.dimension, dtype=np.float32)
+                            for seed in seeds]) if texts else np.zeros((0, self.dimension), dtype=np.float32)
+        return vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+
+
+def _load_documents_whole(base_dir: str, directories: List[str]) -> List[Tuple[str, str]]:
+    """
+    ``load_documents`` as it was before streaming, for the benchmark baseline:
+    every page's text is collected (with pypdf's object cache left to grow)
+    before any of it is chunked.
+    """
+    texts = []
+    for directory in directories:
+        dir_path = os.path.join(base_dir, directory)
+        if os.path.exists(dir_path):
+            for filename in os.listdir(dir_path):
+                filepath = os.path.join(dir_path, filename)
+                if filename.endswith('.pdf'):
+                    with open(filepath, 'rb') as file:
+                        pdf_reader = PdfReader(file)
+                        for page in pdf_reader.pages:
+                            texts.append((page.extract_text(), filename))
+                elif filename.endswith(('.txt', '.md')):
+                    with open(filepath, 'r', encoding='utf-8') as file:
+                        texts.append((file.read(), filename))
+    text_splitter = CharacterTextSplitter(chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP)
+    return [(chunk, filename) for text, filename in texts for chunk in text_splitter.split_text(text)]
+
+
+def _benchmark_in_process(mode: str, base_dir: str, backend: str = 'benchmark') -> Dict:
+    """
+    Build a snapshot of ``base_dir/documents`` the streamed way or the whole-corpus way.
+
+    Extraction, chunking, embedding and the snapshot write are all inside
+    the measured section. Deduplication is off in both modes, as it did not
+    exist before streaming.
+    """
+    import index_snapshot
+    from bulk_embedding import embed_corpus
+    from retrieval import build_chunk_metadata, list_file_sources
+    if backend == 'benchmark':
+        encoder = BenchmarkEncoder()
+    else:
+        from embedding_backends import load_encoder
+        encoder = load_encoder(backend)
+
+    output = os.path.join(base_dir, f"{mode}.snap")
+    baseline = _peak_rss_mb()
+    start = time.perf_counter()
+    if mode == 'stream':
+        header = index_snapshot.build_snapshot(output, base_dir, window=1024, dedup_threshold=0,
+                                               encoder=encoder)
+    else:
+        # The build as it was: whole corpus in memory, embedded as one matrix, then written
+        chunks = _load_documents_whole(base_dir, DEFAULT_DIRECTORIES)
+        embeddings, _ = embed_corpus(encoder, [text for text, _ in chunks],
+                                     os.path.join(base_dir, f"{mode}-embeddings"))
+        metadata = build_chunk_metadata(chunks, list_file_sources(base_dir, DEFAULT_DIRECTORIES))
+        header = index_snapshot.write_snapshot(output, chunks, metadata, embeddings,
+                                               encoder.model_name, encoder.backend)
+    return {
+        'mode': mode,
+        'chunks': header['chunks'],
+        'seconds': round(time.perf_counter() - start, 2),
+        'baseline_rss_mb': round(baseline, 1),
+        'peak_rss_mb': round(_peak_rss_mb(), 1),
+    }
+
+
+def benchmark(pages: int = 2000, backend: str = 'benchmark') -> List[Dict]:
+    """
+    Peak RSS of building a snapshot from a long PDF, streamed vs loaded whole.
+
+    Each mode runs in its own subprocess so peak RSS is not shared.
+
+    Args:
+        backend (str): 'benchmark' for the stand-in encoder, or an ``EMBEDDING_BACKEND``
+    """
+    with tempfile.TemporaryDirectory() as base_dir:
+        os.makedirs(os.path.join(base_dir, 'documents'))
+        write_synthetic_pdf(os.path.join(base_dir, 'documents', 'survey.pdf'), pages)
+        rows = []
+        for mode in ('stream', 'load'):
+            proc = subprocess.run([sys.executable, os.path.abspath(__file__), '_bench-one', mode, base_dir,
+                                   '--backend', backend], capture_output=True, text=True)
+            if proc.returncode != 0:
+                rows.append({'mode': mode, 'error': proc.stderr.strip().splitlines()[-1:]})
+            else:
+                rows.append(json.loads(proc.stdout.strip().splitlines()[-1]))
+        return rows
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Measure the memory used to ingest documents into a snapshot")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    bench_parser = subparsers.add_parser('benchmark', help="Peak RSS for a synthetic PDF, streamed vs loaded")
+    bench_parser.add_argument('--pages', type=int, default=2000)
+    bench_parser.add_argument('--backend', default='benchmark',
+                              help="'benchmark' (stand-in encoder, no model download) or torch/onnx")
+    one_parser = subparsers.add_parser('_bench-one')
+    one_parser.add_argument('mode', choices=['stream', 'load'])
+    one_parser.add_argument('base_dir')
+    one_parser.add_argument('--backend', default='benchmark')
+    args = parser.parse_args(argv)
+
+    if args.command == 'benchmark':
+        print(f"Extracting, chunking, embedding and writing a {args.pages}-page PDF ({args.backend} encoder)")
+        print(f"{'mode':<8} {'chunks':>8} {'seconds':>8} {'base MB':>8} {'peak MB':>8}")
+        for row in benchmark(args.pages, args.backend):
+            if 'error' in row:
+                print(f"{row['mode']:<8} failed: {row['error']}")
+            else:
+                print(f"{row['mode']:<8} {row['chunks']:>8} {row['seconds']:>8} "
+                      f"{row['baseline_rss_mb']:>8} {row['peak_rss_mb']:>8}")
+    elif args.command == '_bench-one':
+        print(json.dumps(_benchmark_in_process(args.mode, args.base_dir, args.backend)))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,482 @@
+"""
+Retry, adaptive concurrency and circuit breaking around the Claude API.
+
+``ResilientLLM`` wraps an ``anthropic.Anthropic`` client (created with
+``max_retries=0`` so retries are not doubled up) and adds:
+
+- Retries of 429/529/5xx and connection errors, using jittered
+  exponential backoff. A ``retry-after`` header from the server is
+  honoured instead. Everything stays within an overall deadline.
+- An AIMD concurrency limit: each success raises the limit by 1/limit,
+  each 429/529 halves it, and callers wait for a free slot. The
+  ``anthropic-ratelimit-requests-*`` headers cap it too: it never exceeds
+  the requests left in the current window, and it pauses new calls until
+  the window resets once none are left.
+- A circuit breaker that opens after consecutive upstream failures, fails
+  fast while open, and lets a single probe through after a cool-down.
+
+A streamed answer is only retried if it fails before its first token;
+after that, text has already reached the resident.
+
+Check the behaviour against the local fault-injecting stub:
+
+    python llm_resilience.py check
+"""
+import sys
+import time
+import random
+import threading
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+from typing import Any, Callable, Iterator, Optional, Tuple
+
+RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504, 529}
+THROTTLE_STATUS = {429, 529}
+CONNECTION_ERRORS = ('APIConnectionError', 'APITimeoutError')
+
+
+class LLMUnavailableError(RuntimeError):
+    """The upstream could not be reached within the deadline."""
+
+
+class CircuitOpenError(LLMUnavailableError):
+    """The circuit breaker is open; the call was not attempted."""
+
+
+def error_status(error: Exception) -> Optional[int]:
+    return getattr(error, 'status_code', None)
+
+
+def is_connection_error(error: Exception) -> bool:
+    return any(cls.__name__ in CONNECTION_ERRORS for cls in type(error).__mro__)
+
+
+def is_retryable(error: Exception) -> bool:
+    return error_status(error) in RETRYABLE_STATUS or is_connection_error(error)
+
+
+def retry_after_seconds(headers) -> Optional[float]:
+    """Read ``retry-after-ms`` / ``retry-after`` (seconds or HTTP date) from response headers."""
+    if headers is None:
+        return None
+    value = headers.get('retry-after-ms')
+    if value:
+        try:
+            return float(value) / 1000
+        except ValueError:
+            pass
+    value = headers.get('retry-after')
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        try:
+            return max(0.0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+        except (TypeError, ValueError):
+            return None
+
+
+def rate_limit_headers(headers) -> Optional[Tuple[int, int, Optional[float]]]:
+    """
+    Read the ``anthropic-ratelimit-requests-{limit,remaining,reset}`` headers.
+
+    Returns:
+        tuple: (limit, remaining, seconds until the window resets or None), or None if absent
+    """
+    if headers is None:
+        return None
+    try:
+        limit = int(headers.get('anthropic-ratelimit-requests-limit'))
+        remaining = int(headers.get('anthropic-ratelimit-requests-remaining'))
+    except (TypeError, ValueError):
+        return None
+    reset_in = None
+    value = headers.get('anthropic-ratelimit-requests-reset')
+    if value:
+        try:
+            reset = datetime.fromisoformat(value.replace('Z', '+00:00'))
+            reset_in = max(0.0, (reset - datetime.now(timezone.utc)).total_seconds())
+        except (TypeError, ValueError):
+            pass
+    return limit, remaining, reset_in
+
+
+def _headers(error: Exception):
+    response = getattr(error, 'response', None)
+    return getattr(response, 'headers', None)
+
+
+class RetryPolicy:
+    def __init__(self, max_attempts: int = 4, base_delay: float = 0.5, max_delay: float = 8.0,
+                 deadline: float = 30.0):
+        """
+        Args:
+            max_attempts (int): Total attempts including the first
+            base_delay (float): Backoff for the first retry, doubled each time
+            max_delay (float): Cap on a single backoff
+            deadline (float): Overall seconds allowed for a call, including waits
+        """
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.deadline = deadline
+
+    def backoff(self, attempt: int, rng: random.Random) -> float:
+        """Full-jitter exponential backoff for the given retry number (1-based)."""
+        return rng.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+
+
+class AdaptiveConcurrencyLimiter:
+    """Additive-increase / multiplicative-decrease limit on concurrent upstream calls."""
+
+    def __init__(self, initial: float = 4, minimum: float = 1, maximum: float = 16,
+                 decrease_factor: float = 0.5, clock: Callable[[], float] = time.monotonic):
+        self.limit = float(initial)
+        self.minimum = float(minimum)
+        self.maximum = float(maximum)
+        self.decrease_factor = decrease_factor
+        self.clock = clock
+        self.in_flight = 0
+        # Cap from the rate-limit headers, the clock time it lapses, and a pause with none left
+        self.ceiling = float(maximum)
+        self.ceiling_until = 0.0
+        self.paused_until = 0.0
+        self._condition = threading.Condition()
+
+    def acquire(self, timeout: Optional[float] = None) -> bool:
+        end = None if timeout is None else self.clock() + timeout
+        with self._condition:
+            while True:
+                now = self.clock()
+                if now >= self.paused_until and self.in_flight < int(self.limit):
+                    break
+                remaining = None if end is None else end - now
+                if remaining is not None and remaining <= 0:
+                    return False
+                if now < self.paused_until:
+                    remaining = self.paused_until - now if remaining is None else min(remaining,
+                                                                                      self.paused_until - now)
+                self._condition.wait(remaining)
+            self.in_flight += 1
+            return True
+
+    def release(self):
+        with self._condition:
+            self.in_flight -= 1
+            self._condition.notify()
+
+    def on_success(self):
+        with self._condition:
+            cap = self.ceiling if self.clock() < self.ceiling_until else self.maximum
+            self.limit = min(cap, self.limit + 1.0 / self.limit)
+            self._condition.notify()
+
+    def on_rate_limit(self, limit: int, remaining: int, reset_in: Optional[float]):
+        """
+        Cap the limit at the requests left in the current rate-limit window until it resets.
+
+        Args:
+            limit (int): Requests allowed per window
+            remaining (int): Requests left in this window
+            reset_in (float): Seconds until the window resets (None if unknown)
+        """
+        with self._condition:
+            until = self.clock() + (reset_in or 0.0)
+            self.ceiling = min(self.maximum, max(self.minimum, float(remaining)))
+            self.ceiling_until = until
+            self.limit = max(self.minimum, min(self.limit, self.ceiling))
+            if remaining <= 0:
+                self.paused_until = max(self.paused_until, until)
+
+    def on_throttle(self):
+        with self._condition:
+            self.limit = max(self.minimum, self.limit * self.decrease_factor)
+
+
+class CircuitBreaker:
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0,
+                 clock: Callable[[], float] = time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.failures = 0
+        self.opened_at = 0.0
+        self._state = self.CLOSED
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._state == self.OPEN and self.clock() - self.opened_at >= self.reset_timeout:
+                self._state = self.HALF_OPEN
+            return self._state
+
+    def admit(self) -> Optional[str]:
+        """
+        Let a call go upstream now, if allowed (one probe at a time when half-open).
+
+        Returns:
+            The state the call was admitted in (HALF_OPEN means it is the
+            probe and must end with a record or ``abandon_probe``), or None
+        """
+        state = self.state
+        with self._lock:
+            if state == self.CLOSED:
+                return state
+            if state == self.HALF_OPEN and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return state
+            return None
+
+    def allow(self) -> bool:
+        """Whether a call may go upstream now (one probe at a time when half-open)."""
+        return self.admit() is not None
+
+    def abandon_probe(self):
+        """
+        End a probe that neither succeeded nor failed upstream, e.g. an
+        unclassified exception or a stream the caller dropped, so the next
+        call can probe instead of the breaker staying half-open for good.
+        """
+        with self._lock:
+            self._probe_in_flight = False
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self._state = self.CLOSED
+            self._probe_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self._state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+                self._state = self.OPEN
+                self.opened_at = self.clock()
+            self._probe_in_flight = False
+
+
+class ResilientLLM:
+    def __init__(self, client, retry: Optional[RetryPolicy] = None,
+                 limiter: Optional[AdaptiveConcurrencyLimiter] = None,
+                 breaker: Optional[CircuitBreaker] = None,
+                 sleep: Callable[[float], None] = time.sleep,
+                 clock: Callable[[], float] = time.monotonic,
+                 rng: Optional[random.Random] = None):
+        self.client = client
+        self.retry = retry or RetryPolicy()
+        self.limiter = limiter or AdaptiveConcurrencyLimiter()
+        self.breaker = breaker or CircuitBreaker()
+        self.sleep = sleep
+        self.clock = clock
+        self.rng = rng or random.Random()
+        self.retries = 0
+
+    def _observe_rate_limit(self, headers):
+        observed = rate_limit_headers(headers)
+        if observed is not None:
+            self.limiter.on_rate_limit(*observed)
+
+    def _record_error(self, error: Exception):
+        self._observe_rate_limit(_headers(error))
+        status = error_status(error)
+        if status in THROTTLE_STATUS:
+            self.limiter.on_throttle()
+        if status == 529 or (status is not None and status >= 500) or is_connection_error(error):
+            self.breaker.record_failure()
+        elif status is not None:
+            # 4xx (including 429) means the upstream is up and answering
+            self.breaker.record_success()
+
+    def _record_success(self):
+        self.limiter.on_success()
+        self.breaker.record_success()
+
+    def _attempts(self, attempt_fn: Callable[[], Any]) -> Tuple[Any, bool]:
+        """
+        Run ``attempt_fn`` with a concurrency slot held, retrying within the deadline.
+
+        The slot is released before returning, unless ``attempt_fn`` returns
+        a stream, in which case the caller releases it.
+
+        Returns:
+            tuple: (result, whether the successful attempt is the breaker's probe)
+        """
+        deadline = self.clock() + self.retry.deadline
+        attempt = 0
+        while True:
+            admitted = self.breaker.admit()
+            if admitted is None:
+                raise CircuitOpenError("The Claude API is unavailable (circuit open); please try again shortly.")
+            probe = admitted == CircuitBreaker.HALF_OPEN
+            if not self.limiter.acquire(timeout=max(0.0, deadline - self.clock())):
+                if probe:
+                    self.breaker.abandon_probe()
+                raise LLMUnavailableError("Timed out waiting for Claude API capacity.")
+            try:
+                return attempt_fn(), probe
+            except BaseException as e:
+                self.limiter.release()
+                if isinstance(e, Exception):
+                    self._record_error(e)
+                # Errors without an upstream verdict must not leave the probe slot taken
+                if probe:
+                    self.breaker.abandon_probe()
+                attempt += 1
+                if not isinstance(e, Exception) or not is_retryable(e) or attempt >= self.retry.max_attempts:
+                    raise
+                delay = retry_after_seconds(_headers(e))
+                if delay is None:
+                    delay = self.retry.backoff(attempt, self.rng)
+                if self.clock() + delay > deadline:
+                    raise
+                self.retries += 1
+                self.sleep(delay)
+
+    def create(self, **kwargs):
+        """``client.messages.create`` with retries, adaptive concurrency and circuit breaking."""
+        def attempt():
+            raw = getattr(self.client.messages, 'with_raw_response', None)
+            if raw is None:
+                message = self.client.messages.create(**kwargs)
+            else:
+                # The raw response carries the rate-limit headers
+                response = raw.create(**kwargs)
+                self._observe_rate_limit(response.headers)
+                message = response.parse()
+            self.limiter.release()
+            return message
+
+        message, _ = self._attempts(attempt)
+        self._record_success()
+        return message
+
+    def stream_text(self, on_complete: Optional[Callable[[Any], None]] = None, **kwargs) -> Iterator[str]:
+        """
+        Stream text deltas, retrying only failures that happen before the first token.
+
+        Args:
+            on_complete: Called with the final message once the stream finishes
+        """
+        def attempt():
+            manager = self.client.messages.stream(**kwargs)
+            stream = manager.__enter__()
+            self._observe_rate_limit(getattr(getattr(stream, 'response', None), 'headers', None))
+            try:
+                texts = iter(stream.text_stream)
+                first = next(texts, None)
+            except BaseException:
+                manager.__exit__(*sys.exc_info())
+                raise
+            return manager, stream, texts, first
+
+        (manager, stream, texts, first), probe = self._attempts(attempt)
+        try:
+            if first is not None:
+                yield first
+            for text in texts:
+                yield text
+            final_message = stream.get_final_message()
+            self._record_success()
+        except Exception as e:
+            self._record_error(e)
+            raise
+        finally:
+            # Also runs if the consumer stops early (GeneratorExit), so the
+            # connection is always closed and a dropped probe frees its slot
+            self.limiter.release()
+            manager.__exit__(None, None, None)
+            if probe:
+                self.breaker.abandon_probe()
+        if on_complete:
+            on_complete(final_message)
+
+
+def check(verbose: bool = True) -> bool:
+    """
+    Exercise ResilientLLM against the fault-injecting stub server.
+
+    Returns:
+        bool: True if every scenario behaved as expected
+    """
+    import anthropic
+    from llm_stub_server import StubServer, StubConfig
+
+    request = dict(model='stub', max_tokens=64, messages=[{"role": "user", "content": "What needs attention?"}])
+    results = []
+
+    def report(name: str, passed: bool, detail: str):
+        results.append(passed)
+        if verbose:
+            print(f"{'PASS' if passed else 'FAIL'}  {name}: {detail}")
+
+    # Transient 529s then success: retried with retry-after honoured
+    with StubServer(StubConfig(ttft=0.01, tokens_per_sec=0, fail_first=2, fail_status=529,
+                               retry_after=0.05)) as server:
+        llm = ResilientLLM(anthropic.Anthropic(api_key='stub', base_url=server.base_url, max_retries=0))
+        text = ''.join(llm.stream_text(**request))
+        report("overload recovery", bool(text) and server.state.requests == 3,
+               f"{server.state.requests} requests, {llm.retries} retries, limit {llm.limiter.limit:.2f}")
+
+    # 429 storm: limit shrinks and the deadline caps the total wait
+    with StubServer(StubConfig(ttft=0.0, rate_limit=1.0, retry_after=0.2)) as server:
+        llm = ResilientLLM(anthropic.Anthropic(api_key='stub', base_url=server.base_url, max_retries=0),
+                           retry=RetryPolicy(max_attempts=10, deadline=0.5),
+                           limiter=AdaptiveConcurrencyLimiter(initial=8))
+        start = time.monotonic()
+        try:
+            llm.create(**request)
+            report("rate-limit deadline", False, "unexpected success")
+        except Exception:
+            elapsed = time.monotonic() - start
+            report("rate-limit deadline", elapsed < 1.0 and llm.limiter.limit < 8,
+                   f"gave up after {elapsed:.2f}s, limit {llm.limiter.limit:.2f}")
+
+    # Outage: breaker opens and later calls fail fast without touching the server
+    with StubServer(StubConfig(ttft=0.0, down=True)) as server:
+        llm = ResilientLLM(anthropic.Anthropic(api_key='stub', base_url=server.base_url, max_retries=0),
+                           retry=RetryPolicy(max_attempts=1),
+                           breaker=CircuitBreaker(failure_threshold=3, reset_timeout=60))
+        for _ in range(5):
+            try:
+                llm.create(**request)
+            except Exception:
+                pass
+        report("circuit breaker", server.state.requests == 3 and llm.breaker.state == CircuitBreaker.OPEN,
+               f"{server.state.requests} upstream requests for 5 calls, breaker {llm.breaker.state}")
+
+    # Mixed faults under concurrency: most requests still succeed
+    with StubServer(StubConfig(ttft=0.02, tokens_per_sec=500, rate_limit=0.2, overloaded=0.1,
+                               retry_after=0.05, seed=7)) as server:
+        llm = ResilientLLM(anthropic.Anthropic(api_key='stub', base_url=server.base_url, max_retries=0),
+                           retry=RetryPolicy(max_attempts=6, base_delay=0.05, deadline=10))
+        outcomes = []
+
+        def worker():
+            try:
+                outcomes.append(bool(''.join(llm.stream_text(**request))))
+            except Exception:
+                outcomes.append(False)
+
+        threads = [threading.Thread(target=worker) for _ in range(20)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        report("mixed faults", sum(outcomes) >= 19,
+               f"{sum(outcomes)}/20 succeeded, statuses {server.state.status_counts}")
+
+    return all(results)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == 'check':
+        sys.exit(0 if check() else 1)
+    print("Usage: python llm_resilience.py check")
+    sys.exit(2)
@@ -0,0 +1,256 @@
+"""
+Local stub of the Anthropic Messages API with fault injection.
+
+Serves ``POST /v1/messages`` (streaming and non-streaming) with a
+configurable time-to-first-token and token rate, and can inject rate
+limits (429 with ``retry-after``), overloads (529), server errors (500) or
+a complete outage. Point the app or a tool at it with
+``ANTHROPIC_BASE_URL=http://127.0.0.1:8765``.
+
+    python llm_stub_server.py --port 8765 --ttft 0.4 --tokens-per-sec 60 --rate-limit 0.2
+
+In-process use:
+
+    with StubServer(StubConfig(fail_first=2, fail_status=529)) as server:
+        client = anthropic.Anthropic(api_key='stub', base_url=server.base_url)
+"""
+import sys
+import json
+import time
+import random
+import argparse
+import threading
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional
+
+DEFAULT_REPLY = (
+    "I am the spirit of this house, and I have been listening. My timbers settle as the evening "
+    "cools, the gutters are clear for now, and the garden is resting. Check the loft insulation "
+    "before the first frost and I will keep you warm through the winter."
+)
+
+ERROR_TYPES = {
+    429: 'rate_limit_error',
+    500: 'api_error',
+    503: 'api_error',
+    529: 'overloaded_error',
+}
+
+
+class StubConfig:
+    def __init__(self, ttft: float = 0.3, tokens_per_sec: float = 50.0, reply: str = DEFAULT_REPLY,
+                 rate_limit: float = 0.0, overloaded: float = 0.0, server_error: float = 0.0,
+                 retry_after: float = 1.0, fail_first: int = 0, fail_status: int = 529,
+                 down: bool = False, requests_limit: int = 50, seed: Optional[int] = None):
+        """
+        Args:
+            ttft (float): Seconds before the first token (or the whole reply)
+            tokens_per_sec (float): Streaming speed after the first token
+            reply (str): Text returned for every request, split on spaces into tokens
+            rate_limit/overloaded/server_error (float): Probability of a 429/529/500
+            retry_after (float): Value of the retry-after header on 429/529
+            fail_first (int): Fail this many requests with ``fail_status`` before behaving
+            down (bool): Answer every request with 503
+            requests_limit (int): Reported anthropic-ratelimit-requests-limit
+        """
+        self.ttft = ttft
+        self.tokens_per_sec = tokens_per_sec
+        self.reply = reply
+        self.rate_limit = rate_limit
+        self.overloaded = overloaded
+        self.server_error = server_error
+        self.retry_after = retry_after
+        self.fail_first = fail_first
+        self.fail_status = fail_status
+        self.down = down
+        self.requests_limit = requests_limit
+        self.random = random.Random(seed)
+
+
+class _StubState:
+    def __init__(self, config: StubConfig):
+        self.config = config
+        self.lock = threading.Lock()
+        self.requests = 0
+        self.status_counts: Dict[int, int] = {}
+
+    def next_status(self) -> int:
+        config = self.config
+        with self.lock:
+            self.requests += 1
+            if config.down:
+                status = 503
+            elif self.requests <= config.fail_first:
+                status = config.fail_status
+            else:
+                roll = config.random.random()
+                if roll < config.rate_limit:
+                    status = 429
+                elif roll < config.rate_limit + config.overloaded:
+                    status = 529
+                elif roll < config.rate_limit + config.overloaded + config.server_error:
+                    status = 500
+                else:
+                    status = 200
+            self.status_counts[status] = self.status_counts.get(status, 0) + 1
+            return status
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    state: _StubState = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _rate_limit_headers(self, remaining: int):
+        config = self.state.config
+        reset = (datetime.now(timezone.utc) + timedelta(seconds=config.retry_after)).isoformat()
+        self.send_header('anthropic-ratelimit-requests-limit', str(config.requests_limit))
+        self.send_header('anthropic-ratelimit-requests-remaining', str(remaining))
+        self.send_header('anthropic-ratelimit-requests-reset', reset)
+        self.send_header('request-id', f"req_stub_{self.state.requests}")
+
+    def _send_json(self, status: int, body: Dict, extra_headers: Optional[Dict[str, str]] = None):
+        payload = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header('content-type', 'application/json')
+        self.send_header('content-length', str(len(payload)))
+        for name, value in (extra_headers or {}).items():
+            self.send_header(name, value)
+        self._rate_limit_headers(0 if status == 429 else self.state.config.requests_limit - 1)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _sse(self, event: str, data: Dict):
+        self.wfile.write(f"event: {event}\ndata: {json.dumps(data)}\n\n".encode('utf-8'))
+        self.wfile.flush()
+
+    def do_POST(self):
+        if not self.path.startswith('/v1/messages'):
+            self._send_json(404, {'type': 'error', 'error': {'type': 'not_found_error', 'message': self.path}})
+            return
+
+        length = int(self.headers.get('content-length', 0))
+        request = json.loads(self.rfile.read(length) or b'{}')
+        config = self.state.config
+        status = self.state.next_status()
+
+        if status != 200:
+            headers = {'retry-after': str(config.retry_after)} if status in (429, 529) else {}
+            self._send_json(status, {
+                'type': 'error',
+                'error': {'type': ERROR_TYPES.get(status, 'api_error'), 'message': f"stub injected {status}"}
+            }, headers)
+            return
+
+        tokens = [word + ' ' for word in config.reply.split(' ')]
+        tokens[-1] = tokens[-1].rstrip()
+        input_tokens = max(1, len(json.dumps(request.get('messages', ''))) // 4
+                           + len(str(request.get('system', ''))) // 4)
+        message = {
+            'id': f"msg_stub_{self.state.requests}",
+            'type': 'message',
+            'role': 'assistant',
+            'model': request.get('model', 'stub'),
+            'content': [],
+            'stop_reason': None,
+            'stop_sequence': None,
+            'usage': {'input_tokens': input_tokens, 'output_tokens': 0},
+        }
+
+        time.sleep(config.ttft)
+        if not request.get('stream'):
+            time.sleep(len(tokens) / config.tokens_per_sec if config.tokens_per_sec else 0)
+            message.update(content=[{'type': 'text', 'text': ''.join(tokens)}], stop_reason='end_turn',
+                           usage={'input_tokens': input_tokens, 'output_tokens': len(tokens)})
+            self._send_json(200, message)
+            return
+
+        self.send_response(200)
+        self.send_header('content-type', 'text/event-stream')
+        self.send_header('cache-control', 'no-cache')
+        self.send_header('connection', 'close')
+        self._rate_limit_headers(config.requests_limit - 1)
+        self.end_headers()
+        self.close_connection = True
+
+        self._sse('message_start', {'type': 'message_start', 'message': message})
+        self._sse('content_block_start', {'type': 'content_block_start', 'index': 0,
+                                          'content_block': {'type': 'text', 'text': ''}})
+        for i, token in enumerate(tokens):
+            if i and config.tokens_per_sec:
+                time.sleep(1.0 / config.tokens_per_sec)
+            self._sse('content_block_delta', {'type': 'content_block_delta', 'index': 0,
+                                              'delta': {'type': 'text_delta', 'text': token}})
+        self._sse('content_block_stop', {'type': 'content_block_stop', 'index': 0})
+        self._sse('message_delta', {'type': 'message_delta',
+                                    'delta': {'stop_reason': 'end_turn', 'stop_sequence': None},
+                                    'usage': {'output_tokens': len(tokens)}})
+        self._sse('message_stop', {'type': 'message_stop'})
+
+
+class StubServer:
+    """Run the stub on a background thread; usable as a context manager."""
+
+    def __init__(self, config: Optional[StubConfig] = None, host: str = '127.0.0.1', port: int = 0):
+        self.state = _StubState(config or StubConfig())
+        handler = type('StubHandler', (_Handler,), {'state': self.state})
+        self.httpd = ThreadingHTTPServer((host, port), handler)
+        self.httpd.daemon_threads = True
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def config(self) -> StubConfig:
+        return self.state.config
+
+    def start(self) -> 'StubServer':
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self) -> 'StubServer':
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Fault-injecting Anthropic Messages API stub")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--ttft', type=float, default=0.3)
+    parser.add_argument('--tokens-per-sec', type=float, default=50.0)
+    parser.add_argument('--rate-limit', type=float, default=0.0)
+    parser.add_argument('--overloaded', type=float, default=0.0)
+    parser.add_argument('--server-error', type=float, default=0.0)
+    parser.add_argument('--retry-after', type=float, default=1.0)
+    parser.add_argument('--down', action='store_true')
+    args = parser.parse_args(argv)
+
+    config = StubConfig(ttft=args.ttft, tokens_per_sec=args.tokens_per_sec, rate_limit=args.rate_limit,
+                        overloaded=args.overloaded, server_error=args.server_error,
+                        retry_after=args.retry_after, down=args.down)
+    server = StubServer(config, args.host, args.port)
+    print(f"Stub Anthropic API listening on {server.base_url}")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.httpd.server_close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,388 @@
+"""
+Load generator: how many residents can one deployment serve at once?
+
+Simulates N residents asking questions concurrently, ramping N up level by
+level. Each resident is a thread, just as each Streamlit session is a
+thread in the app's process. It repeatedly takes a question, asks the app
+and then pauses for a think time.
+
+The app is ``house.py`` itself. ``HeadlessHouse`` imports it with Streamlit
+replaced by ``HeadlessStreamlit``, a stand-in whose widgets return their
+defaults and whose ``cache_resource`` memoises per process the way the
+real one does. Every question therefore goes through
+``get_house_response_streaming``: single-flight, retrieval over the index
+the app would serve, resident memory, the prompt budget, model routing,
+the resilient LLM client and usage accounting. The app's state files
+(usage ledger, resident memory, metrics) are redirected to a scratch
+directory, and the answers are not written to the logs or history.
+
+Questions are replayed from ``logs/`` (synthetic ones if there are none).
+The LLM is the local stub (``llm_stub_server.py``), which runs in its own
+process so its CPU does not count against the app. Each level reports
+throughput, TTFT and total latency percentiles, error rate, CPU, RSS and
+threads, and marks the highest concurrency that met the SLO.
+
+    python load_test.py --levels 1,4,16,64 --duration 30 --ttft 0.4 --tokens-per-sec 60
+    python load_test.py --snapshot index/house-index.snap --base-url http://127.0.0.1:8765
+"""
+import os
+import sys
+import json
+import time
+import types
+import random
+import logging
+import socket
+import argparse
+import tempfile
+import functools
+import importlib
+import threading
+import subprocess
+from typing import Dict, List, Optional, Tuple
+
+from conversation_analytics import default_archive_dir, iter_log_records
+from resident_memory import ResidentMemory
+from token_accounting import UsageLedger
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+default_logs_dir = os.path.join(script_dir, 'logs')
+
+SYNTHETIC_QUESTIONS = [
+    ('Kitchen', "How do I make pancakes?"),
+    ('Kitchen', "What temperature should the oven be for sourdough?"),
+    ('Garden', "When should I plant the broad beans?"),
+    ('Garden', "Is the compost ready to use?"),
+    ('Bedroom', "Why is the radiator in here so noisy?"),
+    ('Bathroom', "How do I fix a dripping shower?"),
+    ('Living Room', "Is it safe to light the log burner tonight?"),
+    ('General', "What needs attention before winter?"),
+    ('General', "When was the roof last inspected?"),
+    ('General', "Tell me about the history of the house."),
+]
+
+
+class _Widget:
+    """Any Streamlit element or container: every call is a no-op returning another one."""
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: _Widget()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+def _cache(func):
+    """``st.cache_resource``/``st.cache_data``: one value per process and argument set, with ``clear``."""
+    values = {}
+    lock = threading.Lock()
+
+    @functools.wraps(func)
+    def cached(*args, **kwargs):
+        key = repr((args, sorted(kwargs.items())))
+        with lock:
+            if key not in values:
+                values[key] = func(*args, **kwargs)
+            return values[key]
+
+    cached.clear = values.clear
+    return cached
+
+
+class HeadlessStreamlit(types.ModuleType):
+    """Stand-in for the ``streamlit`` module, so ``house.py`` can be imported without a UI."""
+
+    def __init__(self):
+        super().__init__('streamlit')
+        self.session_state = {}
+        self.query_params = {}
+        self.sidebar = _Widget()
+        self.cache_resource = self.cache_data = _cache
+
+    def __getattr__(self, name):
+        return getattr(_Widget(), name)
+
+    # Inputs return their defaults, so the script's UI branch never asks anything
+    def text_input(self, label, value='', **kwargs):
+        return value
+
+    def text_area(self, label, value='', **kwargs):
+        return value
+
+    def selectbox(self, label, options, index=0, **kwargs):
+        return list(options)[index]
+
+    def checkbox(self, label, value=False, **kwargs):
+        return value
+
+    def button(self, label, **kwargs):
+        return False
+
+    def columns(self, spec, **kwargs):
+        return [_Widget() for _ in range(spec if isinstance(spec, int) else len(spec))]
+
+
+def load_app(base_url: str, scratch_dir: str, snapshot_path: Optional[str] = None) -> types.ModuleType:
+    """
+    Import ``house.py`` headlessly, pointed at ``base_url`` and with its state in ``scratch_dir``.
+
+    The embedding model and index are whatever the app would load with the
+    same environment (``INDEX_SNAPSHOT``, ``SHARED_INDEX_DIR`` or documents/).
+    """
+    os.environ['ANTHROPIC_BASE_URL'] = base_url
+    os.environ.setdefault('ANTHROPIC_API_KEY', 'stub')
+    os.environ.setdefault('METRICS_DIR', os.path.join(scratch_dir, 'metrics'))
+    # pygame plays the answer chime; there is no sound card under load
+    os.environ.setdefault('SDL_AUDIODRIVER', 'dummy')
+    if snapshot_path:
+        os.environ['INDEX_SNAPSHOT'] = snapshot_path
+    sys.modules['streamlit'] = HeadlessStreamlit()
+    app = importlib.import_module('house')
+
+    # Stub answers must not be billed to, or remembered for, the real residents
+    ledger = UsageLedger(os.path.join(scratch_dir, 'logs'))
+    memory = ResidentMemory(os.path.join(scratch_dir, 'memory'), recent_turns=app.MEMORY_RECENT_TURNS,
+                            summary_chars=app.MEMORY_SUMMARY_CHARS)
+    app.get_usage_ledger = lambda: ledger
+    app.get_resident_memory = lambda: memory
+    return app
+
+
+class HeadlessHouse:
+    """Asks ``house.py`` questions the way its UI does, and times them as a resident sees them."""
+
+    def __init__(self, app: types.ModuleType):
+        """
+        Args:
+            app: The imported ``house`` module (see ``load_app``)
+        """
+        self.app = app
+
+    @property
+    def llm(self):
+        return self.app.get_llm()
+
+    def reset(self):
+        """Start from a fresh LLM client and router, as a fresh deployment would."""
+        self.app.get_llm.clear()
+        self.app.get_model_router.clear()
+
+    def ask(self, resident: str, room: str, question: str) -> Dict:
+        """
+        Answer one question through the app's streaming path.
+
+        Returns:
+            dict: ttft and latency in seconds (ttft None if no token arrived) and error (None on success)
+        """
+        start = time.perf_counter()
+        ttft = None
+        error = None
+        try:
+            for update in self.app.get_house_response_streaming(resident, room, question):
+                if update.get('error'):
+                    # The app answers with an apology; keep the cause for the error counts
+                    error = update['chunk'].replace(self.app.ERROR_REPLY, '')[:80] or 'error'
+                elif ttft is None and update['chunk']:
+                    ttft = time.perf_counter() - start
+                if update['done']:
+                    break
+        except Exception as e:
+            error = type(e).__name__
+        return {'ttft': ttft, 'latency': time.perf_counter() - start, 'error': error}
+
+
+def load_questions(logs_dir: str = default_logs_dir,
+                   archive_dir: Optional[str] = default_archive_dir) -> List[Tuple[str, str, str]]:
+    """(resident, room, question) from the logs and their archive, or the synthetic set if there are none."""
+    questions = [(record.get('resident_name') or 'Resident', record.get('room') or 'General', record['question'])
+                 for record in iter_log_records(logs_dir, archive_dir) if record.get('question')]
+    return questions or [('Resident', room, question) for room, question in SYNTHETIC_QUESTIONS]
+
+
+def _percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))]
+
+
+def _rss_mb() -> float:
+    """Current resident set size; falls back to the peak where /proc is unavailable."""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / 1e6
+    except (OSError, ValueError):
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 1e6 if sys.platform == 'darwin' else peak / 1e3
+
+
+def run_level(house: HeadlessHouse, questions: List[Tuple[str, str, str]], concurrency: int,
+              duration: float, think_time: float, seed: int = 0) -> Dict:
+    """
+    Run ``concurrency`` residents for ``duration`` seconds.
+
+    Requests started before the end are allowed to finish and are counted.
+    """
+    results: List[Dict] = []
+    lock = threading.Lock()
+    deadline = time.perf_counter() + duration
+    peak_threads = threading.active_count()
+
+    def resident(number: int):
+        nonlocal peak_threads
+        rng = random.Random(seed * 1000 + number)
+        while time.perf_counter() < deadline:
+            name, room, question = rng.choice(questions)
+            result = house.ask(f"{name}-{number}", room, question)
+            with lock:
+                results.append(result)
+                peak_threads = max(peak_threads, threading.active_count())
+            if think_time:
+                time.sleep(rng.expovariate(1.0 / think_time))
+
+    threads = [threading.Thread(target=resident, args=(n,), daemon=True) for n in range(concurrency)]
+    wall_start, cpu_start = time.perf_counter(), time.process_time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - wall_start
+    cpu = time.process_time() - cpu_start
+
+    ok = [r for r in results if r['error'] is None]
+    ttfts = [r['ttft'] for r in ok if r['ttft'] is not None]
+    latencies = [r['latency'] for r in ok]
+    errors: Dict[str, int] = {}
+    for r in results:
+        if r['error']:
+            errors[r['error']] = errors.get(r['error'], 0) + 1
+    return {
+        'concurrency': concurrency,
+        'requests': len(results),
+        'throughput_rps': round(len(ok) / wall, 2) if wall else 0.0,
+        'ttft_p50': round(_percentile(ttfts, 50), 3),
+        'ttft_p95': round(_percentile(ttfts, 95), 3),
+        'ttft_p99': round(_percentile(ttfts, 99), 3),
+        'latency_p50': round(_percentile(latencies, 50), 3),
+        'latency_p95': round(_percentile(latencies, 95), 3),
+        'latency_p99': round(_percentile(latencies, 99), 3),
+        'error_rate': round(1 - len(ok) / len(results), 4) if results else 0.0,
+        'errors': errors,
+        'cpu_percent': round(100 * cpu / wall, 1) if wall else 0.0,
+        'rss_mb': round(_rss_mb(), 1),
+        'threads': peak_threads,
+        'llm_retries': house.llm.retries,
+        'llm_concurrency_limit': round(house.llm.limiter.limit, 2),
+    }
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_stub(ttft: float, tokens_per_sec: float, rate_limit: float = 0.0,
+               overloaded: float = 0.0) -> Tuple[subprocess.Popen, str]:
+    """Launch ``llm_stub_server.py`` in its own process and wait until it accepts connections."""
+    port = _free_port()
+    process = subprocess.Popen(
+        [sys.executable, os.path.join(script_dir, 'llm_stub_server.py'), '--port', str(port),
+         '--ttft', str(ttft), '--tokens-per-sec', str(tokens_per_sec),
+         '--rate-limit', str(rate_limit), '--overloaded', str(overloaded)],
+        stdout=subprocess.DEVNULL)
+    for _ in range(100):
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.1).close()
+            return process, f"http://127.0.0.1:{port}"
+        except OSError:
+            time.sleep(0.05)
+    process.kill()
+    raise RuntimeError("The stub LLM server did not start")
+
+
+def ramp(house: HeadlessHouse, levels: List[int], questions: List[Tuple[str, str, str]],
+         duration: float, think_time: float, ttft_slo: float, max_error_rate: float) -> List[Dict]:
+    """
+    Run each concurrency level in turn with a fresh LLM client, as a fresh deployment would have.
+
+    Each row gets ``within_slo``: TTFT p95 under ``ttft_slo`` and error rate under ``max_error_rate``.
+    """
+    rows = []
+    for level in levels:
+        house.reset()
+        row = run_level(house, questions, level, duration, think_time, seed=level)
+        row['within_slo'] = row['ttft_p95'] <= ttft_slo and row['error_rate'] <= max_error_rate and row['requests'] > 0
+        rows.append(row)
+    return rows
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Simulate concurrent residents and report latency against the SLO")
+    parser.add_argument('--levels', default='1,2,4,8,16,32', help="Comma-separated concurrency levels")
+    parser.add_argument('--duration', type=float, default=20.0, help="Seconds per level")
+    parser.add_argument('--think-time', type=float, default=1.0, help="Mean pause between a resident's questions")
+    parser.add_argument('--snapshot', default=os.getenv('INDEX_SNAPSHOT', ''),
+                        help="Index snapshot to serve from (default: as the app is configured)")
+    parser.add_argument('--logs-dir', default=default_logs_dir)
+    parser.add_argument('--archive-dir', default=default_archive_dir)
+    parser.add_argument('--base-url', help="Use this LLM endpoint instead of starting the stub")
+    parser.add_argument('--ttft', type=float, default=0.4, help="Stub time to first token")
+    parser.add_argument('--tokens-per-sec', type=float, default=60.0, help="Stub token rate")
+    parser.add_argument('--rate-limit', type=float, default=0.0, help="Stub 429 probability")
+    parser.add_argument('--overloaded', type=float, default=0.0, help="Stub 529 probability")
+    parser.add_argument('--ttft-slo', type=float, default=float(os.getenv('TTFT_SLO_SECONDS', '2.0')))
+    parser.add_argument('--max-error-rate', type=float, default=0.01)
+    parser.add_argument('--scratch-dir', help="Where the app keeps its state during the run (default: a temp dir)")
+    parser.add_argument('--verbose', action='store_true', help="Log the app's per-request diagnostics")
+    parser.add_argument('--json', action='store_true', help="Print the report as JSON")
+    args = parser.parse_args(argv)
+    if args.verbose:
+        logging.basicConfig(level=logging.DEBUG, format='%(name)s: %(message)s')
+
+    questions = load_questions(args.logs_dir, args.archive_dir)
+    levels = [int(level) for level in args.levels.split(',')]
+
+    stub = None
+    base_url = args.base_url
+    if not base_url:
+        stub, base_url = start_stub(args.ttft, args.tokens_per_sec, args.rate_limit, args.overloaded)
+    try:
+        app = load_app(base_url, args.scratch_dir or tempfile.mkdtemp(prefix='house-load-'),
+                       args.snapshot or None)
+        house = HeadlessHouse(app)
+        rows = ramp(house, levels, questions, args.duration, args.think_time,
+                    args.ttft_slo, args.max_error_rate)
+    finally:
+        if stub is not None:
+            stub.terminate()
+            stub.wait()
+
+    if args.json:
+        print(json.dumps(rows, indent=4))
+        return 0
+
+    print(f"{len(questions)} questions, {len(app.document_chunks_with_filenames)} chunks "
+          f"({app.embedding_model.model_name}), "
+          f"{args.duration:.0f}s per level, think time {args.think_time}s, LLM {base_url}")
+    columns = ['concurrency', 'requests', 'throughput_rps', 'ttft_p50', 'ttft_p95', 'ttft_p99',
+               'latency_p50', 'latency_p95', 'latency_p99', 'error_rate', 'cpu_percent', 'rss_mb', 'threads']
+    print(''.join(f"{column.replace('_', ' '):>15}" for column in columns) + '  SLO')
+    for row in rows:
+        print(''.join(f"{row[column]:>15}" for column in columns) + ('  ok' if row['within_slo'] else '  MISS')
+              + (f"  {row['errors']}" if row['errors'] else ''))
+    sustained = [row['concurrency'] for row in rows if row['within_slo']]
+    if sustained:
+        print(f"Highest concurrency within SLO (TTFT p95 <= {args.ttft_slo}s, errors <= "
+              f"{args.max_error_rate:.0%}): {max(sustained)} residents")
+    else:
+        print("No level met the SLO")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
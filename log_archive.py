@@ -0,0 +1,375 @@
+"""
+Compressed, month-partitioned Parquet archive of the daily logs.
+
+Closed days (anything before today) are compacted out of the per-day
+``logs/*_response_log.{json,csv}`` and ``history/*_conversation_history.md``
+files into one zstd-compressed Parquet file per dataset and month:
+
+    archive/responses/month=2024-10/data.parquet
+    archive/history/month=2024-10/data.parquet
+
+``query_archive`` opens only the month partitions in the requested date
+range and reads only the requested columns. Raw files older than the
+retention period are deleted once their day is safely archived; with no
+retention set, raw files are kept.
+
+    python log_archive.py compact [--retention-days 90]
+    python log_archive.py query --columns date,room,question --start 01-10-2024
+"""
+import os
+import re
+import sys
+import csv
+import json
+import argparse
+from datetime import date, datetime, timedelta
+from typing import Dict, List, Optional
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+default_logs_dir = os.path.join(script_dir, 'logs')
+default_history_dir = os.path.join(script_dir, 'history')
+default_archive_dir = os.path.join(script_dir, 'archive')
+
+MANIFEST_FILE = 'manifest.json'
+PARTITION_FILE = 'data.parquet'
+DATE_FORMAT = '%d-%m-%Y'
+
+RESPONSE_SCHEMA = pa.schema([
+    ('date', pa.date32()),
+    ('time', pa.string()),
+    ('resident_name', pa.string()),
+    ('room', pa.string()),
+    ('question', pa.string()),
+    ('response', pa.string()),
+    ('unique_files', pa.list_(pa.string())),
+    ('chunk_info', pa.list_(pa.string())),
+    # Model routing decision (model_router.RouteDecision.as_dict)
+    ('model', pa.string()),
+    ('route_reason', pa.string()),
+    ('complexity', pa.float64()),
+    ('question_words', pa.int64()),
+    ('context_chars', pa.int64()),
+    # Token usage and cost (token_accounting.usage_fields), null when not logged
+    ('input_tokens', pa.int64()),
+    ('output_tokens', pa.int64()),
+    ('cache_read_input_tokens', pa.int64()),
+    ('cache_creation_input_tokens', pa.int64()),
+    ('cost_usd', pa.float64()),
+    ('llm_call_id', pa.string()),
+    ('llm_seconds', pa.float64()),
+    ('prompt_tokens_estimate', pa.int64()),
+    ('context_chunks', pa.int64()),
+    ('request_id', pa.string()),
+    ('error', pa.bool_()),
+])
+
+HISTORY_SCHEMA = pa.schema([
+    ('date', pa.date32()),
+    ('time', pa.string()),
+    ('resident_name', pa.string()),
+    ('room', pa.string()),
+    ('question', pa.string()),
+    ('response', pa.string()),
+])
+
+SCHEMAS = {'responses': RESPONSE_SCHEMA, 'history': HISTORY_SCHEMA}
+
+LOG_FILE = re.compile(r'^(\d{2}-\d{2}-\d{4})_response_log\.(json|csv)$')
+HISTORY_FILE = re.compile(r'^(\d{2}-\d{2}-\d{4})_conversation_history\.md$')
+
+
+def _parse_day(value: str) -> date:
+    return datetime.strptime(value, DATE_FORMAT).date()
+
+
+def read_response_log(logs_dir: str, day: str) -> List[Dict]:
+    """Read one day's response log, preferring the JSON file over the CSV."""
+    json_path = os.path.join(logs_dir, f"{day}_response_log.json")
+    csv_path = os.path.join(logs_dir, f"{day}_response_log.csv")
+    if os.path.exists(json_path):
+        try:
+            with open(json_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except json.JSONDecodeError:
+            pass
+    if not os.path.exists(csv_path):
+        return []
+    records = []
+    with open(csv_path, 'r', encoding='utf-8') as f:
+        for row in csv.DictReader(f):
+            row['unique_files'] = [name for name in row.get('unique_files', '').split(' - ') if name]
+            row['chunk_info'] = [row.get(f'chunk{i}_score', '') for i in (1, 2, 3)
+                                 if row.get(f'chunk{i}_score')]
+            records.append(row)
+    return records
+
+
+def parse_history_markdown(content: str) -> List[Dict]:
+    """Split a conversation history file into one record per exchange."""
+    records = []
+    for block in content.split('\n---\n'):
+        header = re.search(r'## Date:\s*(\S+)\s*\|\s*Time:\s*(\S+)', block)
+        if not header:
+            continue
+        resident = re.search(r'### Resident:\s*([^|\n]*)(?:\|\s*Room:\s*([^\n]*))?', block)
+        question = re.search(r'\*\*Question:\*\*\s*(.*?)(?=\n\*\*House Spirit:\*\*|\Z)', block, re.DOTALL)
+        response = re.search(r'\*\*House Spirit:\*\*\s*(.*)', block, re.DOTALL)
+        records.append({
+            'date': header.group(1),
+            'time': header.group(2),
+            'resident_name': resident.group(1).strip() if resident else '',
+            'room': (resident.group(2) or '').strip() if resident else '',
+            'question': question.group(1).strip() if question else '',
+            'response': response.group(1).strip() if response else '',
+        })
+    return records
+
+
+def _to_scalar(value, type_: pa.DataType):
+    """A numeric or boolean log field as a Python value, None if missing or unparsable."""
+    if value is None or value == '':
+        return None
+    try:
+        if pa.types.is_boolean(type_):
+            return value if isinstance(value, bool) else str(value).lower() in ('true', '1')
+        if pa.types.is_integer(type_):
+            return int(float(value))
+        return float(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _read_partition(path: str, schema: pa.Schema, columns: Optional[List[str]] = None) -> pa.Table:
+    """Read a month partition, with null columns for fields added since it was written."""
+    return pq.read_table(path, columns=columns, schema=schema)
+
+
+def _to_table(records: List[Dict], schema: pa.Schema, day: date) -> pa.Table:
+    columns = {field.name: [] for field in schema}
+    for record in records:
+        columns['date'].append(day)
+        for field in schema:
+            if field.name == 'date':
+                continue
+            value = record.get(field.name)
+            if pa.types.is_list(field.type):
+                value = list(value) if isinstance(value, (list, tuple)) else []
+            elif not pa.types.is_string(field.type):
+                value = _to_scalar(value, field.type)
+            else:
+                value = '' if value is None else str(value)
+            columns[field.name].append(value)
+    return pa.table(columns, schema=schema)
+
+
+class LogArchive:
+    def __init__(self, archive_dir: str = default_archive_dir,
+                 logs_dir: str = default_logs_dir, history_dir: str = default_history_dir):
+        self.archive_dir = archive_dir
+        self.logs_dir = logs_dir
+        self.history_dir = history_dir
+        self.manifest_path = os.path.join(archive_dir, MANIFEST_FILE)
+
+    def _read_manifest(self) -> Dict:
+        try:
+            with open(self.manifest_path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {'responses': [], 'history': []}
+
+    def _write_manifest(self, manifest: Dict):
+        os.makedirs(self.archive_dir, exist_ok=True)
+        tmp_path = self.manifest_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, indent=4)
+        os.replace(tmp_path, self.manifest_path)
+
+    def _partition_path(self, dataset: str, month: str) -> str:
+        return os.path.join(self.archive_dir, dataset, f"month={month}", PARTITION_FILE)
+
+    def _raw_days(self) -> Dict[str, set]:
+        days = {'responses': set(), 'history': set()}
+        if os.path.exists(self.logs_dir):
+            for name in os.listdir(self.logs_dir):
+                match = LOG_FILE.match(name)
+                if match:
+                    days['responses'].add(match.group(1))
+        if os.path.exists(self.history_dir):
+            for name in os.listdir(self.history_dir):
+                match = HISTORY_FILE.match(name)
+                if match:
+                    days['history'].add(match.group(1))
+        return days
+
+    def _append_day(self, dataset: str, day: str, table: pa.Table):
+        """Replace ``day``'s rows in its month partition with ``table``."""
+        day_value = _parse_day(day)
+        path = self._partition_path(dataset, day_value.strftime('%Y-%m'))
+        if os.path.exists(path):
+            existing = _read_partition(path, SCHEMAS[dataset])
+            existing = existing.filter(pc.not_equal(existing['date'], pa.scalar(day_value, pa.date32())))
+            table = pa.concat_tables([existing, table])
+        table = table.sort_by([('date', 'ascending'), ('time', 'ascending')])
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = path + '.tmp'
+        pq.write_table(table, tmp_path, compression='zstd')
+        os.replace(tmp_path, path)
+
+    def compact(self, today: Optional[date] = None, retention_days: Optional[int] = None) -> Dict:
+        """
+        Archive every closed day not yet in the archive, then apply raw-file retention.
+
+        Args:
+            today (date): Days before this are closed; defaults to today
+            retention_days (int): Delete archived raw files older than this many days
+
+        Returns:
+            dict: Days archived per dataset and raw files deleted
+        """
+        today = today or date.today()
+        manifest = self._read_manifest()
+        archived = {'responses': [], 'history': []}
+
+        for dataset, days in self._raw_days().items():
+            for day in sorted(days, key=_parse_day):
+                day_value = _parse_day(day)
+                if day_value >= today or day in manifest[dataset]:
+                    continue
+                if dataset == 'responses':
+                    records = read_response_log(self.logs_dir, day)
+                else:
+                    path = os.path.join(self.history_dir, f"{day}_conversation_history.md")
+                    with open(path, 'r', encoding='utf-8') as f:
+                        records = parse_history_markdown(f.read())
+                self._append_day(dataset, day, _to_table(records, SCHEMAS[dataset], day_value))
+                manifest[dataset].append(day)
+                archived[dataset].append(day)
+                # Record each day as soon as it is durable so an interrupted run resumes cleanly
+                self._write_manifest(manifest)
+
+        deleted = self.apply_retention(retention_days, today, manifest) if retention_days is not None else []
+        return {'archived': archived, 'deleted': deleted}
+
+    def apply_retention(self, retention_days: int, today: Optional[date] = None,
+                        manifest: Optional[Dict] = None) -> List[str]:
+        """Delete raw log/history files older than the retention period that are archived."""
+        today = today or date.today()
+        manifest = manifest or self._read_manifest()
+        oldest_kept = today - timedelta(days=retention_days)
+        deleted = []
+
+        candidates = []
+        if os.path.exists(self.logs_dir):
+            candidates += [(self.logs_dir, name, LOG_FILE.match(name), 'responses')
+                           for name in os.listdir(self.logs_dir)]
+        if os.path.exists(self.history_dir):
+            candidates += [(self.history_dir, name, HISTORY_FILE.match(name), 'history')
+                           for name in os.listdir(self.history_dir)]
+
+        for directory, name, match, dataset in candidates:
+            if not match:
+                continue
+            day = match.group(1)
+            if _parse_day(day) < oldest_kept and day in manifest[dataset]:
+                os.remove(os.path.join(directory, name))
+                deleted.append(name)
+        return sorted(deleted)
+
+    def archived_days(self, dataset: str = 'responses') -> List[str]:
+        return list(self._read_manifest()[dataset])
+
+    def query(self, dataset: str = 'responses', columns: Optional[List[str]] = None,
+              start: Optional[date] = None, end: Optional[date] = None,
+              filters: Optional[Dict[str, str]] = None) -> pa.Table:
+        """
+        Read archived rows, touching only the needed partitions and columns.
+
+        Args:
+            dataset (str): 'responses' or 'history'
+            columns (List[str]): Columns to return (default: all)
+            start/end (date): Inclusive date range; selects month partitions
+            filters (Dict[str, str]): Exact-match column filters, e.g. {'resident_name': 'Rob'}
+
+        Returns:
+            pyarrow.Table
+        """
+        schema = SCHEMAS[dataset]
+        columns = list(columns or schema.names)
+        filters = filters or {}
+        # Filter columns must be read even if they are not returned
+        read_columns = list(dict.fromkeys(columns + ['date'] + list(filters)))
+
+        tables = []
+        for month in self._months(dataset, start, end):
+            path = self._partition_path(dataset, month)
+            table = _read_partition(path, schema, read_columns)
+            if start:
+                table = table.filter(pc.greater_equal(table['date'], pa.scalar(start, pa.date32())))
+            if end:
+                table = table.filter(pc.less_equal(table['date'], pa.scalar(end, pa.date32())))
+            for column, value in filters.items():
+                table = table.filter(pc.equal(table[column], value))
+            tables.append(table.select(columns))
+
+        if not tables:
+            return pa.schema([schema.field(name) for name in columns]).empty_table()
+        return pa.concat_tables(tables)
+
+    def _months(self, dataset: str, start: Optional[date], end: Optional[date]) -> List[str]:
+        dataset_dir = os.path.join(self.archive_dir, dataset)
+        if not os.path.exists(dataset_dir):
+            return []
+        months = sorted(name.split('=', 1)[1] for name in os.listdir(dataset_dir)
+                        if name.startswith('month='))
+        if start:
+            months = [m for m in months if m >= start.strftime('%Y-%m')]
+        if end:
+            months = [m for m in months if m <= end.strftime('%Y-%m')]
+        return [m for m in months if os.path.exists(self._partition_path(dataset, m))]
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Compact and query the house spirit log archive")
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    compact_parser = sub.add_parser('compact', help="Archive closed days and apply retention")
+    compact_parser.add_argument('--retention-days', type=int,
+                                default=int(os.getenv('LOG_RAW_RETENTION_DAYS', '0')) or None,
+                                help="Delete archived raw files older than this (default: keep)")
+
+    query_parser = sub.add_parser('query', help="Print archived rows as JSON lines")
+    query_parser.add_argument('--dataset', choices=list(SCHEMAS), default='responses')
+    query_parser.add_argument('--columns', help="Comma-separated column names")
+    query_parser.add_argument('--start', help="DD-MM-YYYY")
+    query_parser.add_argument('--end', help="DD-MM-YYYY")
+    query_parser.add_argument('--resident')
+
+    args = parser.parse_args(argv)
+    archive = LogArchive()
+
+    if args.command == 'compact':
+        result = archive.compact(retention_days=args.retention_days)
+        for dataset, days in result['archived'].items():
+            print(f"Archived {len(days)} {dataset} day(s)")
+        if result['deleted']:
+            print(f"Deleted {len(result['deleted'])} raw file(s) past retention")
+    else:
+        table = archive.query(
+            dataset=args.dataset,
+            columns=args.columns.split(',') if args.columns else None,
+            start=_parse_day(args.start) if args.start else None,
+            end=_parse_day(args.end) if args.end else None,
+            filters={'resident_name': args.resident} if args.resident else None,
+        )
+        for row in table.to_pylist():
+            print(json.dumps(row, default=str, ensure_ascii=False))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,528 @@
+"""
+In-process metrics with Prometheus text exposition and multi-process aggregation.
+
+``REGISTRY`` holds counters, gauges and histograms for the process.
+Registering is get-or-create, so ``house.py`` can declare its metrics at
+the top of every Streamlit rerun and get the same objects back:
+
+    answers = REGISTRY.counter('house_answers_total', "Answers given", ['mode'])
+    answers.labels(mode='streaming').inc()
+    with REGISTRY.histogram('house_retrieval_seconds', "Retrieval time").time():
+        ...
+
+Each worker process writes its registry to ``<metrics dir>/<pid>-<token>.json``
+every few seconds, atomically. The random token is drawn once per process,
+so a new worker that reuses an old one's pid gets a file of its own. The
+exposition merges every worker's file. Counters and histograms are
+summed, including those of exited workers, so totals never go backwards.
+Once a worker's file is stale and its pid is gone, its counters and
+histograms are folded into ``_exited.json`` and the file is removed, so
+the directory does not grow with every restart. Gauges follow their
+``mode``: ``sum`` or ``max`` over live workers, or ``all``, which keeps
+one series per pid.
+
+    python metrics.py serve --port 9464     # GET /metrics for Prometheus
+    python metrics.py dump --output /var/lib/node_exporter/house.prom
+
+The app can also serve ``/metrics`` itself with ``METRICS_PORT``. The first
+worker to bind the port serves the merged view for all of them.
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import bisect
+import logging
+import argparse
+import threading
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from conversation_analytics import file_lock
+
+logger = logging.getLogger(__name__)
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+default_metrics_dir = os.path.join(script_dir, 'logs', 'metrics')
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+GAUGE_MODES = ('sum', 'max', 'all')
+EXITED_FILE = '_exited.json'
+
+
+class _Metric:
+    kind = ''
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values: Dict[Tuple[str, ...], object] = {}
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} takes labels {list(self.labelnames)}, got {sorted(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def labels(self, **labels) -> '_Child':
+        return _Child(self, self._key(labels))
+
+    def describe(self) -> Dict:
+        return {'name': self.name, 'type': self.kind, 'help': self.help, 'labelnames': list(self.labelnames)}
+
+
+class _Child:
+    """One labelled series of a metric."""
+
+    __slots__ = ('metric', 'key')
+
+    def __init__(self, metric: _Metric, key: Tuple[str, ...]):
+        self.metric = metric
+        self.key = key
+
+    def inc(self, amount: float = 1.0):
+        self.metric._inc(self.key, amount)
+
+    def set(self, value: float):
+        self.metric._set(self.key, value)
+
+    def observe(self, value: float):
+        self.metric._observe(self.key, value)
+
+    @contextmanager
+    def time(self):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start)
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def _inc(self, key: Tuple[str, ...], amount: float):
+        if amount < 0:
+            raise ValueError("Counters can only go up")
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def inc(self, amount: float = 1.0):
+        self._inc(self._key({}), amount)
+
+    def samples(self) -> List[Dict]:
+        with self._lock:
+            return [{'labels': list(key), 'value': value} for key, value in self._values.items()]
+
+
+class Gauge(_Metric):
+    kind = 'gauge'
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = (), mode: str = 'sum'):
+        """
+        Args:
+            mode (str): How workers' values are merged: 'sum', 'max' or 'all' (one series per pid)
+        """
+        if mode not in GAUGE_MODES:
+            raise ValueError(f"Gauge mode must be one of {GAUGE_MODES}")
+        super().__init__(name, help_text, labelnames)
+        self.mode = mode
+
+    def _set(self, key: Tuple[str, ...], value: float):
+        with self._lock:
+            self._values[key] = float(value)
+
+    def _inc(self, key: Tuple[str, ...], amount: float):
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def set(self, value: float):
+        self._set(self._key({}), value)
+
+    def inc(self, amount: float = 1.0):
+        self._inc(self._key({}), amount)
+
+    def describe(self) -> Dict:
+        return {**super().describe(), 'mode': self.mode}
+
+    def samples(self) -> List[Dict]:
+        with self._lock:
+            return [{'labels': list(key), 'value': value} for key, value in self._values.items()]
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name: str, help_text: str, labelnames: Sequence[str] = (),
+                 buckets: Iterable[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(float(b) for b in buckets))
+
+    def _observe(self, key: Tuple[str, ...], value: float):
+        # Per-bucket (non-cumulative) counts; the last slot is +Inf
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                series = self._values[key] = {'counts': [0] * (len(self.buckets) + 1), 'sum': 0.0}
+            series['counts'][index] += 1
+            series['sum'] += value
+
+    def observe(self, value: float):
+        self._observe(self._key({}), value)
+
+    def time(self):
+        return _Child(self, self._key({})).time()
+
+    def describe(self) -> Dict:
+        return {**super().describe(), 'buckets': list(self.buckets)}
+
+    def samples(self) -> List[Dict]:
+        with self._lock:
+            return [{'labels': list(key), 'counts': list(series['counts']), 'sum': series['sum']}
+                    for key, series in self._values.items()]
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+        self._instance: Tuple[int, str] = (0, '')
+
+    @property
+    def instance(self) -> str:
+        """``<pid>-<token>``, unique to this process even if its pid is reused later (or forked)."""
+        pid = os.getpid()
+        if self._instance[0] != pid:
+            self._instance = (pid, f"{pid}-{uuid.uuid4().hex[:8]}")
+        return self._instance[1]
+
+    def _register(self, cls, name: str, help_text: str, labelnames: Sequence[str], **kwargs) -> _Metric:
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, help_text, labelnames, **kwargs)
+            elif type(metric) is not cls or metric.labelnames != tuple(labelnames):
+                raise ValueError(f"Metric {name} is already registered as a {metric.kind} "
+                                 f"with labels {list(metric.labelnames)}")
+            return metric
+
+    def counter(self, name: str, help_text: str, labelnames: Sequence[str] = ()) -> Counter:
+        return self._register(Counter, name, help_text, labelnames)
+
+    def gauge(self, name: str, help_text: str, labelnames: Sequence[str] = (), mode: str = 'sum') -> Gauge:
+        return self._register(Gauge, name, help_text, labelnames, mode=mode)
+
+    def histogram(self, name: str, help_text: str, labelnames: Sequence[str] = (),
+                  buckets: Iterable[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram, name, help_text, labelnames, buckets=buckets)
+
+    def snapshot(self) -> Dict:
+        """JSON-serialisable state of every metric, as written to the worker's dump file."""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return {
+            'pid': os.getpid(),
+            'instance': self.instance,
+            'written': time.time(),
+            'metrics': [{**metric.describe(), 'samples': metric.samples()} for metric in metrics],
+        }
+
+    def write(self, directory: str):
+        """Atomically write this process's snapshot to ``<directory>/<pid>-<token>.json``."""
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"{self.instance}.json")
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.snapshot(), f)
+        os.replace(tmp_path, path)
+
+
+REGISTRY = MetricsRegistry()
+
+
+class MetricsFlusher:
+    """Writes a registry to the metrics directory every ``interval`` seconds on a daemon thread."""
+
+    def __init__(self, registry: MetricsRegistry, directory: str = default_metrics_dir, interval: float = 5.0):
+        self.registry = registry
+        self.directory = directory
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='metrics-flusher', daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.flush()
+
+    def flush(self):
+        try:
+            self.registry.write(self.directory)
+        except OSError as e:
+            logger.warning("Could not write metrics to %s: %s", self.directory, e)
+
+    def start(self) -> 'MetricsFlusher':
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self.flush()
+
+
+def _read_dump(path: str) -> Optional[Dict]:
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return None
+
+
+def _pid_alive(pid: int) -> bool:
+    """Whether a process with this pid exists; assumed so where that cannot be checked."""
+    if os.name != 'posix':
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except OSError:
+        pass
+    return True
+
+
+def _add_samples(target: Dict, metric: Dict):
+    """Add a counter's or histogram's samples into ``target``, a metric in dump form."""
+    samples = {tuple(sample['labels']): sample for sample in target['samples']}
+    for sample in metric['samples']:
+        current = samples.get(tuple(sample['labels']))
+        if current is None:
+            target['samples'].append(json.loads(json.dumps(sample)))
+        elif metric['type'] == 'histogram':
+            current['counts'] = [a + b for a, b in zip(current['counts'], sample['counts'])]
+            current['sum'] += sample['sum']
+        else:
+            current['value'] += sample['value']
+
+
+def fold_exited(directory: str = default_metrics_dir, stale_after: float = 60.0) -> List[str]:
+    """
+    Fold the counters and histograms of exited workers into ``_exited.json``.
+
+    A worker has exited when its file has not been rewritten for
+    ``stale_after`` seconds and its pid no longer exists. Folded files are
+    listed in ``_exited.json`` before they are removed, so an interrupted
+    fold never counts a worker twice.
+
+    Returns:
+        List[str]: Names of the worker files folded
+    """
+    if not os.path.exists(directory):
+        return []
+    now = time.time()
+
+    def exited(name: str) -> bool:
+        path = os.path.join(directory, name)
+        if not name.endswith('.json') or name == EXITED_FILE:
+            return False
+        try:
+            if now - os.path.getmtime(path) <= stale_after:
+                return False
+        except OSError:
+            return False
+        dump = _read_dump(path)
+        return dump is not None and now - dump.get('written', 0) > stale_after and not _pid_alive(dump['pid'])
+
+    if not any(exited(name) for name in os.listdir(directory)):
+        return []
+    exited_path = os.path.join(directory, EXITED_FILE)
+    with file_lock(exited_path):
+        totals = _read_dump(exited_path) or {'pid': 0, 'written': 0, 'metrics': [], 'folded': []}
+        folded = [name for name in os.listdir(directory) if exited(name) and name not in totals['folded']]
+        metrics = {metric['name']: metric for metric in totals['metrics']}
+        for name in folded:
+            for metric in _read_dump(os.path.join(directory, name))['metrics']:
+                if metric['type'] == 'gauge':
+                    continue
+                target = metrics.get(metric['name'])
+                if target is None:
+                    target = metrics[metric['name']] = {**metric, 'samples': []}
+                    totals['metrics'].append(target)
+                _add_samples(target, metric)
+        # Names are only needed until their files are gone
+        totals['folded'] = [name for name in totals['folded'] if os.path.exists(os.path.join(directory, name))]
+        totals['folded'] += folded
+        tmp_path = exited_path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(totals, f)
+        os.replace(tmp_path, exited_path)
+        for name in totals['folded']:
+            try:
+                os.remove(os.path.join(directory, name))
+            except FileNotFoundError:
+                pass
+    return folded
+
+
+def aggregate(directory: str = default_metrics_dir, stale_after: float = 60.0) -> List[Dict]:
+    """
+    Merge every worker's dump file, folding exited workers into ``_exited.json`` first.
+
+    Args:
+        stale_after (float): Gauges from files not rewritten for this long
+            (exited workers) are left out; counters and histograms are always kept
+
+    Returns:
+        List[Dict]: Metric descriptions with merged ``series`` keyed by label tuple
+    """
+    merged: Dict[str, Dict] = {}
+    if not os.path.exists(directory):
+        return []
+    fold_exited(directory, stale_after)
+    now = time.time()
+    exited = _read_dump(os.path.join(directory, EXITED_FILE)) or {'folded': []}
+    for name in sorted(os.listdir(directory)):
+        if not name.endswith('.json') or name in exited['folded']:
+            continue
+        dump = _read_dump(os.path.join(directory, name))
+        if dump is None:
+            continue
+        live = now - dump.get('written', 0) <= stale_after
+        for metric in dump['metrics']:
+            if metric['type'] == 'gauge' and not live:
+                continue
+            entry = merged.setdefault(metric['name'], {**{k: v for k, v in metric.items() if k != 'samples'},
+                                                       'series': {}})
+            if metric['type'] == 'gauge' and metric.get('mode') == 'all':
+                entry['labelnames'] = list(metric['labelnames']) + ['pid']
+            for sample in metric['samples']:
+                key = tuple(sample['labels'])
+                series = entry['series']
+                if metric['type'] == 'histogram':
+                    current = series.setdefault(key, {'counts': [0] * len(sample['counts']), 'sum': 0.0})
+                    current['counts'] = [a + b for a, b in zip(current['counts'], sample['counts'])]
+                    current['sum'] += sample['sum']
+                elif metric['type'] == 'counter' or metric.get('mode') == 'sum':
+                    series[key] = series.get(key, 0.0) + sample['value']
+                elif metric.get('mode') == 'max':
+                    series[key] = max(series.get(key, sample['value']), sample['value'])
+                else:
+                    series[key + (str(dump['pid']),)] = sample['value']
+    return list(merged.values())
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(f'{extra[0]}="{extra[1]}"')
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _number(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value))
+
+
+def exposition(metrics: List[Dict]) -> str:
+    """Render merged metrics in the Prometheus text format (version 0.0.4)."""
+    lines = []
+    for metric in sorted(metrics, key=lambda m: m['name']):
+        name = metric['name']
+        lines.append(f"# HELP {name} {metric['help']}")
+        lines.append(f"# TYPE {name} {metric['type']}")
+        for key, value in sorted(metric['series'].items()):
+            labels = metric['labelnames']
+            if metric['type'] != 'histogram':
+                lines.append(f"{name}{_labels(labels, key)} {_number(value)}")
+                continue
+            cumulative = 0
+            for bound, count in zip(list(metric['buckets']) + [float('inf')], value['counts']):
+                cumulative += count
+                lines.append(f"{name}_bucket{_labels(labels, key, ('le', _number(bound)))} {cumulative}")
+            lines.append(f"{name}_sum{_labels(labels, key)} {_number(value['sum'])}")
+            lines.append(f"{name}_count{_labels(labels, key)} {cumulative}")
+    return '\n'.join(lines) + '\n'
+
+
+class MetricsServer:
+    """Serves ``GET /metrics`` with the merged view of a metrics directory."""
+
+    def __init__(self, directory: str = default_metrics_dir, host: str = '127.0.0.1', port: int = 9464,
+                 registry: Optional[MetricsRegistry] = None):
+        """
+        Args:
+            registry: This process's registry, written out before each scrape so it is current
+        """
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass
+
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                if registry is not None:
+                    registry.write(directory)
+                body = exposition(aggregate(directory)).encode('utf-8')
+                self.send_response(200)
+                self.send_header('content-type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('content-length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        self.httpd = ThreadingHTTPServer((host, port), Handler)
+        self.httpd.daemon_threads = True
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name='metrics-server', daemon=True)
+
+    def start(self) -> 'MetricsServer':
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Expose the app's metrics in Prometheus text format")
+    parser.add_argument('--metrics-dir', default=os.getenv('METRICS_DIR') or default_metrics_dir)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    serve_parser = subparsers.add_parser('serve', help="Serve GET /metrics")
+    serve_parser.add_argument('--host', default='127.0.0.1')
+    serve_parser.add_argument('--port', type=int, default=int(os.getenv('METRICS_PORT') or 9464))
+    dump_parser = subparsers.add_parser('dump', help="Write the merged metrics once")
+    dump_parser.add_argument('--output', help="File to write (atomically); stdout if omitted")
+    args = parser.parse_args(argv)
+
+    if args.command == 'dump':
+        text = exposition(aggregate(args.metrics_dir))
+        if not args.output:
+            sys.stdout.write(text)
+            return 0
+        tmp_path = args.output + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(text)
+        os.replace(tmp_path, args.output)
+        return 0
+
+    server = MetricsServer(args.metrics_dir, args.host, args.port)
+    print(f"Serving metrics from {args.metrics_dir} on http://{args.host}:{args.port}/metrics")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.httpd.server_close()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,155 @@
+"""
+Per-request model routing between a large and a small Claude model.
+
+``ModelRouter.route`` looks at the question length, the size of the
+retrieved context and a lightweight keyword-based complexity score. Simple
+questions ("What needs attention?") go to the small model and involved ones
+to the large model. It also tracks an exponentially weighted moving average
+(EWMA) of observed time-to-first-token (TTFT) per model. When the model that
+would be chosen is currently missing the configured TTFT SLO, borderline
+requests are shifted to the other model. Every decision carries a short
+reason for the logs.
+
+A shifted-away model would otherwise never get new samples, so its average
+would stay over the SLO for good. Samples older than ``sample_max_age``
+are forgotten, and a small ``probe_fraction`` of shifted requests still
+go to the slow model to measure it.
+"""
+import re
+import time
+import random
+import threading
+from typing import Callable, Dict, Optional, Tuple
+
+COMPLEX_PATTERNS = [
+    r'\bwhy\b', r'\bexplain', r'\bcompare', r'\bdifference', r'\bplan\b', r'\bplanning\b',
+    r'\bdesign', r'\bshould i\b', r'\bhow (?:does|do|can|could|would)\b', r'\bwhat if\b',
+    r'\brecommend', r'\bpros and cons\b', r'\brenovat', r'\binsulat', r'\bretrofit',
+    r'\bheat pump', r'\bventilation', r'\bregulation', r'\bcost', r'\bstep[- ]by[- ]step\b',
+]
+SIMPLE_PATTERNS = [
+    r'^\s*(?:hi|hello|hey|good (?:morning|afternoon|evening|night))\b', r'\bthank', r'\bhow are you\b',
+    r'\bwhat needs attention\b', r'^\s*\w+[!.?]*\s*$',
+]
+
+COMPLEX_REGEX = [re.compile(p, re.IGNORECASE) for p in COMPLEX_PATTERNS]
+SIMPLE_REGEX = [re.compile(p, re.IGNORECASE) for p in SIMPLE_PATTERNS]
+
+
+def complexity_score(question: str) -> float:
+    """Score a question from 0 (small talk) to 1 (open-ended, multi-part)."""
+    words = len(question.split())
+    score = 0.4 * min(words / 40.0, 1.0)
+    score += min(0.6, 0.3 * sum(1 for pattern in COMPLEX_REGEX if pattern.search(question)))
+    if question.count('?') > 1:
+        score += 0.2
+    if any(pattern.search(question) for pattern in SIMPLE_REGEX):
+        score -= 0.4
+    return max(0.0, min(1.0, score))
+
+
+class RouteDecision:
+    __slots__ = ('model', 'reason', 'complexity', 'question_words', 'context_chars')
+
+    def __init__(self, model: str, reason: str, complexity: float, question_words: int, context_chars: int):
+        self.model = model
+        self.reason = reason
+        self.complexity = complexity
+        self.question_words = question_words
+        self.context_chars = context_chars
+
+    def as_dict(self) -> Dict:
+        return {
+            'model': self.model,
+            'route_reason': self.reason,
+            'complexity': round(self.complexity, 3),
+            'question_words': self.question_words,
+            'context_chars': self.context_chars,
+        }
+
+
+class ModelRouter:
+    def __init__(self, large_model: str, small_model: Optional[str] = None,
+                 ttft_slo: float = 2.0, complexity_threshold: float = 0.3,
+                 max_simple_words: int = 60, max_simple_context_chars: int = 6000,
+                 ewma_alpha: float = 0.2, sample_max_age: float = 120.0, probe_fraction: float = 0.05,
+                 clock: Callable[[], float] = time.monotonic, rng: Optional[random.Random] = None):
+        """
+        Args:
+            large_model (str): Model for complex questions (and the only one if no small model)
+            small_model (str): Faster model for simple questions; None disables routing
+            ttft_slo (float): Target time-to-first-token in seconds
+            complexity_threshold (float): Complexity at or above which the large model is used
+            max_simple_words (int): Longer questions go to the large model
+            max_simple_context_chars (int): Larger retrieved context goes to the large model
+            ewma_alpha (float): Weight of the newest TTFT sample in the moving average
+            sample_max_age (float): Seconds after its last sample that a model's average is forgotten
+            probe_fraction (float): Share of shifted requests still sent to the slow model
+        """
+        self.large_model = large_model
+        self.small_model = small_model
+        self.ttft_slo = ttft_slo
+        self.complexity_threshold = complexity_threshold
+        self.max_simple_words = max_simple_words
+        self.max_simple_context_chars = max_simple_context_chars
+        self.ewma_alpha = ewma_alpha
+        self.sample_max_age = sample_max_age
+        self.probe_fraction = probe_fraction
+        self.clock = clock
+        self.rng = rng or random.Random()
+        # Model -> (TTFT moving average, clock time of its latest sample)
+        self._ttft: Dict[str, Tuple[float, float]] = {}
+        self._lock = threading.Lock()
+
+    def record_ttft(self, model: str, seconds: float):
+        """Fold an observed time-to-first-token into the model's moving average."""
+        now = self.clock()
+        with self._lock:
+            previous = self._ttft.get(model)
+            if previous is None or now - previous[1] > self.sample_max_age:
+                average = seconds
+            else:
+                average = self.ewma_alpha * seconds + (1 - self.ewma_alpha) * previous[0]
+            self._ttft[model] = (average, now)
+
+    def observed_ttft(self, model: str) -> Optional[float]:
+        """The model's TTFT moving average, or None if it has no recent samples."""
+        with self._lock:
+            entry = self._ttft.get(model)
+        if entry is None or self.clock() - entry[1] > self.sample_max_age:
+            return None
+        return entry[0]
+
+    def _over_slo(self, model: str) -> bool:
+        observed = self.observed_ttft(model)
+        return observed is not None and observed > self.ttft_slo
+
+    def route(self, question: str, context_chars: int = 0) -> RouteDecision:
+        words = len(question.split())
+        complexity = complexity_score(question)
+
+        def decide(model: str, reason: str) -> RouteDecision:
+            return RouteDecision(model, reason, complexity, words, context_chars)
+
+        if not self.small_model:
+            return decide(self.large_model, "single model configured")
+
+        if complexity >= self.complexity_threshold:
+            model, reason = self.large_model, f"complex question ({complexity:.2f})"
+        elif words > self.max_simple_words:
+            model, reason = self.large_model, f"long question ({words} words)"
+        elif context_chars > self.max_simple_context_chars:
+            model, reason = self.large_model, f"large context ({context_chars} chars)"
+        else:
+            model, reason = self.small_model, f"simple question ({complexity:.2f})"
+
+        # Shift borderline requests away from a model that is missing the SLO
+        other = self.small_model if model == self.large_model else self.large_model
+        if self._over_slo(model) and not self._over_slo(other):
+            borderline = complexity < min(1.0, self.complexity_threshold + 0.3)
+            if model == self.small_model or borderline:
+                if self.rng.random() < self.probe_fraction:
+                    return decide(model, f"{reason}; probing {model} TTFT")
+                return decide(other, f"{reason}; {model} TTFT {self.observed_ttft(model):.2f}s "
+                                     f"over {self.ttft_slo:.2f}s SLO")
+        return decide(model, reason)
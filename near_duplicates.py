@@ -0,0 +1,185 @@
+"""
+Near-duplicate chunk elimination with MinHash and LSH.
+
+The house spirit repeats itself. ``history/`` holds many near-identical
+answers, and the same recipe or instruction can appear in several
+documents. Every copy costs index space and can push a different, useful
+chunk out of the top 3.
+
+Chunks are compared on their word 5-gram shingles. Each chunk gets a MinHash
+signature, and the signature is split into LSH bands. Two chunks whose
+Jaccard similarity is around the threshold or above share a band with high
+probability. Candidates found that way are checked on the full signature.
+
+Deduplication streams. The first chunk of each near-duplicate cluster
+becomes its representative, so documents win over history because they
+are loaded first. Every later member is dropped, and only its filename is
+recorded as an extra source of the representative. A threshold of 0
+turns deduplication off.
+
+    python near_duplicates.py report            # clusters and shrinkage for the knowledge base
+"""
+import os
+import re
+import sys
+import zlib
+import argparse
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+import ingestion
+
+DEFAULT_THRESHOLD = 0.8
+# Prime just above 2**32; shingle hashes are crc32 values below it
+MERSENNE_PRIME = 4294967311
+WORD = re.compile(r"\w+")
+
+
+def shingles(text: str, size: int = 5) -> np.ndarray:
+    """crc32 hashes of the lower-cased word ``size``-grams of a text."""
+    words = WORD.findall(text.lower())
+    if len(words) <= size:
+        grams = [' '.join(words)]
+    else:
+        grams = [' '.join(words[i:i + size]) for i in range(len(words) - size + 1)]
+    return np.unique(np.fromiter((zlib.crc32(gram.encode('utf-8')) for gram in grams),
+                                 dtype=np.uint64, count=len(grams)))
+
+
+class DedupReport:
+    """What deduplication removed, and where each representative also appears."""
+
+    def __init__(self):
+        self.total = 0
+        self.kept = 0
+        # Output index of a representative -> filenames of the duplicates folded into it
+        self.sources: Dict[int, List[str]] = {}
+        self.clusters = 0
+
+    @property
+    def removed(self) -> int:
+        return self.total - self.kept
+
+    @property
+    def shrinkage(self) -> float:
+        return self.removed / self.total if self.total else 0.0
+
+    def summary(self) -> str:
+        return (f"{self.total} chunks -> {self.kept} after removing {self.removed} near-duplicates "
+                f"in {self.clusters} clusters ({self.shrinkage:.1%} smaller)")
+
+
+class NearDuplicateIndex:
+    def __init__(self, threshold: float = DEFAULT_THRESHOLD, num_perm: int = 64, bands: int = 8,
+                 shingle_size: int = 5, seed: int = 1):
+        """
+        Args:
+            threshold (float): Estimated Jaccard similarity at which chunks count as duplicates
+            num_perm (int): MinHash signature length
+            bands (int): LSH bands; ``num_perm`` must divide evenly. 8 bands of 8
+                rows put the LSH S-curve's midpoint near 0.77
+            shingle_size (int): Words per shingle
+        """
+        if num_perm % bands:
+            raise ValueError("num_perm must be a multiple of bands")
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.shingle_size = shingle_size
+        rng = np.random.default_rng(seed)
+        # a < 2**31 keeps a * hash + b inside uint64
+        self._a = rng.integers(1, 2 ** 31, num_perm, dtype=np.uint64)
+        self._b = rng.integers(0, 2 ** 31, num_perm, dtype=np.uint64)
+        self._buckets: Dict[Tuple[int, bytes], List[int]] = {}
+        self._signatures: List[np.ndarray] = []
+
+    def signature(self, text: str) -> np.ndarray:
+        hashes = shingles(text, self.shingle_size)
+        return ((hashes[None, :] * self._a[:, None] + self._b[:, None]) % MERSENNE_PRIME).min(axis=1)
+
+    def _band_keys(self, signature: np.ndarray) -> List[Tuple[int, bytes]]:
+        return [(band, signature[band * self.rows:(band + 1) * self.rows].tobytes())
+                for band in range(self.bands)]
+
+    def add(self, text: str) -> Optional[int]:
+        """
+        Look a chunk up and, if it is new, register it as a representative.
+
+        Returns:
+            The id of the representative it duplicates, or None if it was added
+        """
+        signature = self.signature(text)
+        keys = self._band_keys(signature)
+
+        candidates = {rep for key in keys for rep in self._buckets.get(key, ())}
+        best, best_similarity = None, self.threshold
+        for rep in candidates:
+            similarity = float(np.mean(self._signatures[rep] == signature))
+            if similarity >= best_similarity:
+                best, best_similarity = rep, similarity
+        if best is not None:
+            return best
+
+        rep = len(self._signatures)
+        self._signatures.append(signature)
+        for key in keys:
+            self._buckets.setdefault(key, []).append(rep)
+        return None
+
+
+def dedupe(chunks: Iterable[Tuple[str, str]], report: Optional[DedupReport] = None,
+           threshold: float = DEFAULT_THRESHOLD, **settings) -> Iterator[Tuple[str, str]]:
+    """
+    Drop near-duplicate chunks from a stream, keeping the first of each cluster.
+
+    Args:
+        chunks: (chunk_text, filename) pairs, e.g. from ``ingestion.iter_chunks``
+        report: Filled with counts and, per kept chunk index, its duplicates' filenames
+        threshold (float): Estimated Jaccard similarity to treat as duplicate; 0 keeps everything
+        settings: Further ``NearDuplicateIndex`` arguments
+
+    Yields:
+        tuple: The representative (chunk_text, filename) pairs, in order
+    """
+    report = report if report is not None else DedupReport()
+    index = NearDuplicateIndex(threshold, **settings) if threshold > 0 else None
+    for text, filename in chunks:
+        report.total += 1
+        rep = index.add(text) if index is not None else None
+        if rep is None:
+            report.kept += 1
+            yield text, filename
+            continue
+        sources = report.sources.setdefault(rep, [])
+        if not sources:
+            report.clusters += 1
+        if filename not in sources:
+            sources.append(filename)
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Report near-duplicate chunks in the knowledge base")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    report_parser = subparsers.add_parser('report')
+    report_parser.add_argument('--threshold', type=float,
+                               default=float(os.getenv('DEDUP_THRESHOLD', DEFAULT_THRESHOLD)))
+    report_parser.add_argument('--show', type=int, default=10, help="Largest clusters to list")
+    args = parser.parse_args(argv)
+
+    base_dir = os.path.dirname(os.path.abspath(__file__))
+    report = DedupReport()
+    kept = list(dedupe(ingestion.iter_chunks(base_dir, ingestion.DEFAULT_DIRECTORIES, skip_history_dates=[]),
+                       report, args.threshold))
+    print(report.summary())
+    largest = sorted(report.sources.items(), key=lambda item: len(item[1]), reverse=True)[:args.show]
+    for rep, sources in largest:
+        text, filename = kept[rep]
+        preview = ' '.join(text.split())[:70]
+        print(f"  {filename}: \"{preview}...\" also in {', '.join(sources)}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,293 @@
+"""
+Opt-in profiling of individual requests.
+
+When one question is slow, profile it rather than guess. A profiled
+request runs under two profilers at once:
+
+- ``cProfile``, saved as ``<request_id>.pstats`` for ``pstats``/snakeviz;
+- a stack sampler thread that records the request's threads' stacks every
+  few milliseconds. It is saved as ``<request_id>.collapsed`` in the collapsed
+  format (``frame;frame;frame count``) that flamegraph.pl, speedscope and
+  inferno read. It includes time spent waiting on the network, which
+  cProfile's own-time view hides.
+
+Part of a request can run on another thread. A streamed answer, for
+example, is produced on the single-flight upstream thread while the
+script thread only renders it. ``active_profile`` returns the calling
+thread's profile. Wrapping the other thread's work in that profile's
+``attach`` (or a generator in ``follow``) adds the thread to the sampler
+and gives it its own cProfile, which is merged into the saved pstats.
+
+Requests are profiled when asked for explicitly (``force``) or at random at
+``sample_percent``. An unprofiled request costs one ``random()`` call and
+gets a shared no-op context, so profiling can stay configured in production.
+
+    python request_profiler.py list
+    python request_profiler.py show 20241027-220953-1a2b3c4d --sort cumulative
+"""
+import os
+import sys
+import time
+import random
+import logging
+import pstats
+import cProfile
+import argparse
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional
+
+logger = logging.getLogger(__name__)
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+default_profiles_dir = os.path.join(script_dir, 'logs', 'profiles')
+
+
+_local = threading.local()
+
+
+class StackSampler:
+    """Samples the Python stacks of a set of threads at a fixed interval."""
+
+    def __init__(self, thread_id: int, interval: float = 0.005, label: str = 'request'):
+        """
+        Args:
+            thread_id (int): First thread to sample; more can be added with ``add_thread``
+            label (str): Root frame of that thread's stacks
+        """
+        self.interval = interval
+        self.samples: Counter = Counter()
+        self._threads: Dict[int, str] = {thread_id: label}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='stack-sampler', daemon=True)
+
+    def add_thread(self, thread_id: int, label: str):
+        with self._lock:
+            self._threads[thread_id] = label
+
+    def remove_thread(self, thread_id: int):
+        with self._lock:
+            self._threads.pop(thread_id, None)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frames = sys._current_frames()
+            with self._lock:
+                threads = list(self._threads.items())
+            for thread_id, label in threads:
+                frame = frames.get(thread_id)
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+                    frame = frame.f_back
+                if stack:
+                    self.samples[';'.join([label] + stack[::-1])] += 1
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def collapsed(self) -> str:
+        return ''.join(f"{stack} {count}\n" for stack, count in self.samples.most_common())
+
+
+class RequestProfile:
+    """Context manager that profiles the enclosed block and saves the result."""
+
+    def __init__(self, request_id: str, directory: str, interval: float, attach_timeout: float = 2.0):
+        """
+        Args:
+            attach_timeout (float): Seconds to wait on exit for attached threads to finish
+        """
+        self.request_id = request_id
+        self.directory = directory
+        self.interval = interval
+        self.attach_timeout = attach_timeout
+        self.paths: List[str] = []
+        self.seconds = 0.0
+        self._owner: Optional[int] = None
+        self._attached: List[cProfile.Profile] = []
+        self._running = 0
+        self._condition = threading.Condition()
+
+    def __enter__(self) -> 'RequestProfile':
+        self._owner = threading.get_ident()
+        self._sampler = StackSampler(self._owner, self.interval)
+        self._profile = cProfile.Profile()
+        self._start = time.perf_counter()
+        self._previous = getattr(_local, 'profile', None)
+        _local.profile = self
+        self._sampler.start()
+        try:
+            self._profile.enable()
+        except ValueError:
+            # Python 3.12+ allows one profiler per process and another request holds it;
+            # this request keeps its stack samples and whatever attached threads record
+            self._profile = None
+        return self
+
+    @contextmanager
+    def attach(self, label: str = 'upstream'):
+        """Profile the enclosed block, run on another thread, as part of this request."""
+        thread_id = threading.get_ident()
+        if thread_id == self._owner:
+            # Already profiled; cProfile cannot be enabled twice on one thread
+            yield self
+            return
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Python 3.12+ allows one profiler per process, and it already sees every thread
+            profile = None
+        with self._condition:
+            self._running += 1
+        self._sampler.add_thread(thread_id, label)
+        try:
+            yield self
+        finally:
+            if profile is not None:
+                profile.disable()
+            self._sampler.remove_thread(thread_id)
+            with self._condition:
+                if profile is not None:
+                    self._attached.append(profile)
+                self._running -= 1
+                self._condition.notify_all()
+
+    def follow(self, updates: Iterator, label: str = 'upstream') -> Iterator:
+        """Wrap a generator so that whichever thread consumes it is profiled as part of this request."""
+        with self.attach(label):
+            yield from updates
+
+    def __exit__(self, *exc):
+        if self._profile is not None:
+            self._profile.disable()
+        _local.profile = self._previous
+        # A producer thread may still be finishing its last update
+        with self._condition:
+            self._condition.wait_for(lambda: self._running == 0, self.attach_timeout)
+            attached = list(self._attached)
+        self._sampler.stop()
+        self.seconds = time.perf_counter() - self._start
+        os.makedirs(self.directory, exist_ok=True)
+        base = os.path.join(self.directory, self.request_id)
+        profiles = ([self._profile] if self._profile is not None else []) + attached
+        self.paths = [base + '.collapsed']
+        if profiles:
+            stats = pstats.Stats(profiles[0])
+            for profile in profiles[1:]:
+                stats.add(profile)
+            stats.dump_stats(base + '.pstats')
+            self.paths.insert(0, base + '.pstats')
+        with open(base + '.collapsed', 'w', encoding='utf-8') as f:
+            f.write(self._sampler.collapsed())
+        logger.info("Profiled request %s (%.2fs, %d stack samples) -> %s", self.request_id, self.seconds,
+                    sum(self._sampler.samples.values()), ', '.join(self.paths))
+        return False
+
+
+class _NotProfiled:
+    """Shared no-op stand-in for requests that are not profiled."""
+
+    paths: List[str] = []
+
+    def __enter__(self) -> '_NotProfiled':
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def attach(self, label: str = 'upstream') -> '_NotProfiled':
+        return self
+
+    def follow(self, updates: Iterator, label: str = 'upstream') -> Iterator:
+        return updates
+
+
+NOT_PROFILED = _NotProfiled()
+
+
+def active_profile():
+    """The profile of the request running on this thread, or the no-op stand-in."""
+    return getattr(_local, 'profile', None) or NOT_PROFILED
+
+
+class RequestProfiler:
+    def __init__(self, directory: str = default_profiles_dir, sample_percent: float = 0.0,
+                 interval: float = 0.005, rng: Optional[random.Random] = None):
+        """
+        Args:
+            directory (str): Where profiles are written
+            sample_percent (float): Share of requests profiled at random, 0-100
+            interval (float): Seconds between stack samples
+        """
+        self.directory = directory
+        self.sample_percent = sample_percent
+        self.interval = interval
+        self.rng = rng or random.Random()
+
+    def profile(self, request_id: str, force: bool = False):
+        """
+        Returns:
+            A context manager that profiles the block if this request is selected
+        """
+        if force or (self.sample_percent > 0 and self.rng.random() * 100 < self.sample_percent):
+            return RequestProfile(request_id, self.directory, self.interval)
+        return NOT_PROFILED
+
+
+def list_profiles(directory: str = default_profiles_dir) -> List[Dict]:
+    """Saved profiles, newest first, with their total profiled time (None if only sampled)."""
+    if not os.path.exists(directory):
+        return []
+    profiles = []
+    for name in os.listdir(directory):
+        if name.endswith('.collapsed'):
+            path = os.path.join(directory, name)
+            pstats_path = path[:-len('.collapsed')] + '.pstats'
+            profiles.append({
+                'request_id': name[:-len('.collapsed')],
+                'seconds': round(pstats.Stats(pstats_path).total_tt, 3) if os.path.exists(pstats_path) else None,
+                'modified': os.path.getmtime(path),
+            })
+    return sorted(profiles, key=lambda profile: profile['modified'], reverse=True)
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Inspect saved request profiles")
+    parser.add_argument('--profiles-dir', default=os.getenv('PROFILE_DIR') or default_profiles_dir)
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('list', help="List saved profiles")
+    show_parser = subparsers.add_parser('show', help="Print the top functions of a profile")
+    show_parser.add_argument('request_id')
+    show_parser.add_argument('--sort', default='cumulative')
+    show_parser.add_argument('--limit', type=int, default=25)
+    args = parser.parse_args(argv)
+
+    if args.command == 'list':
+        profiles = list_profiles(args.profiles_dir)
+        if not profiles:
+            print(f"No profiles in {args.profiles_dir}")
+            return 1
+        for profile in profiles:
+            seconds = '-' if profile['seconds'] is None else f"{profile['seconds']}s"
+            print(f"{profile['request_id']:<32}{seconds:>10}")
+        return 0
+
+    path = os.path.join(args.profiles_dir, args.request_id + '.pstats')
+    if not os.path.exists(path):
+        print(f"No cProfile data at {path}; the stack samples are in {args.request_id}.collapsed")
+        return 1
+    pstats.Stats(path).strip_dirs().sort_stats(args.sort).print_stats(args.limit)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,186 @@
+"""
+Rolling per-resident conversation memory.
+
+For every resident the house keeps the last few exchanges verbatim and folds
+older ones into a running summary. The whole state lives in one small JSON
+file per resident (``memory/<resident>.json``) whose size is bounded by the
+turn window and the summary budget, so recording an exchange is constant
+file work no matter how long the resident has been talking to the house,
+and the context added to each prompt stays bounded too.
+
+Several workers may serve the same resident, so each record re-reads the
+file under a cross-process lock before appending, and readers reload a
+file another process has written since.
+"""
+import os
+import re
+import json
+import hashlib
+import threading
+from datetime import datetime
+from typing import Callable, Dict, Iterable, List, Optional
+
+from conversation_analytics import file_lock
+
+DEFAULT_RECENT_TURNS = 4
+DEFAULT_SUMMARY_CHARS = 1500
+# Each verbatim turn is clipped so one long answer cannot blow the budget
+MAX_TURN_CHARS = 1500
+
+
+def _clip(text: str, limit: int) -> str:
+    text = text.strip()
+    return text if len(text) <= limit else text[:limit].rsplit(' ', 1)[0] + '...'
+
+
+def _first_sentence(text: str, limit: int = 200) -> str:
+    match = re.match(r'(.+?[.!?])(\s|$)', text.strip(), re.DOTALL)
+    sentence = match.group(1) if match else text
+    return _clip(' '.join(sentence.split()), limit)
+
+
+def summarize_turn(turn: Dict) -> str:
+    """Condense one exchange into a single summary line."""
+    return (f"{turn.get('date', '')} ({turn.get('room', 'Whole House')}): "
+            f"asked \"{_clip(turn['question'], 160)}\" - I said: {_first_sentence(turn['response'])}")
+
+
+class ResidentMemory:
+    def __init__(self, memory_dir: str, recent_turns: int = DEFAULT_RECENT_TURNS,
+                 summary_chars: int = DEFAULT_SUMMARY_CHARS,
+                 summarizer: Callable[[Dict], str] = summarize_turn,
+                 seed: Optional[Callable[[str], Iterable[Dict]]] = None):
+        """
+        Args:
+            memory_dir (str): Directory holding one state file per resident
+            recent_turns (int): Exchanges kept verbatim
+            summary_chars (int): Character budget for the summary of older turns
+            summarizer: Turns an evicted exchange into a summary line
+            seed: Optional ``resident -> exchanges`` (oldest first) used once to
+                backfill a resident who has no memory file yet
+        """
+        self.memory_dir = memory_dir
+        self.recent_turns = recent_turns
+        self.summary_chars = summary_chars
+        self.summarizer = summarizer
+        self.seed = seed
+        self._lock = threading.Lock()
+        self._states: Dict[str, Dict] = {}
+        self._mtimes: Dict[str, int] = {}
+
+    def _path(self, resident_name: str) -> str:
+        slug = re.sub(r'[^a-z0-9_-]+', '_', resident_name.strip().lower()).strip('_') or 'resident'
+        digest = hashlib.sha1(resident_name.strip().encode('utf-8')).hexdigest()[:8]
+        return os.path.join(self.memory_dir, f"{slug}-{digest}.json")
+
+    def _empty_state(self, resident_name: str) -> Dict:
+        return {'resident': resident_name, 'summary': [], 'recent': [], 'turn_count': 0}
+
+    def _read(self, resident_name: str) -> Optional[Dict]:
+        path = self._path(resident_name)
+        try:
+            mtime = os.stat(path).st_mtime_ns
+            with open(path, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+        self._states[resident_name] = state
+        self._mtimes[resident_name] = mtime
+        return state
+
+    def _seeded(self, resident_name: str) -> Dict:
+        """A new resident's state, backfilled from ``seed``; the caller holds the file lock."""
+        state = self._empty_state(resident_name)
+        if self.seed:
+            for turn in self.seed(resident_name):
+                self._append(state, turn)
+            if state['turn_count']:
+                self._save(resident_name, state)
+        self._states[resident_name] = state
+        return state
+
+    def _load(self, resident_name: str) -> Dict:
+        """The resident's state, reloaded if another process has written it since."""
+        path = self._path(resident_name)
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+        state = self._states.get(resident_name)
+        if state is not None and mtime == self._mtimes.get(resident_name):
+            return state
+        if mtime is not None:
+            state = self._read(resident_name)
+            if state is not None:
+                return state
+        with file_lock(path):
+            return self._read(resident_name) or self._seeded(resident_name)
+
+    def _save(self, resident_name: str, state: Dict):
+        os.makedirs(self.memory_dir, exist_ok=True)
+        path = self._path(resident_name)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(state, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+        self._states[resident_name] = state
+        self._mtimes[resident_name] = os.stat(path).st_mtime_ns
+
+    def _append(self, state: Dict, turn: Dict):
+        # An empty assistant message would make the next API call fail
+        if not (turn.get('response') or '').strip():
+            return
+        state['recent'].append({
+            'date': turn.get('date', ''),
+            'room': turn.get('room', ''),
+            'question': _clip(turn['question'], MAX_TURN_CHARS),
+            'response': _clip(turn['response'], MAX_TURN_CHARS),
+        })
+        state['turn_count'] += 1
+
+        # Fold turns that leave the verbatim window into the summary
+        while len(state['recent']) > self.recent_turns:
+            state['summary'].append(self.summarizer(state['recent'].pop(0)))
+        while state['summary'] and sum(len(line) for line in state['summary']) > self.summary_chars:
+            state['summary'].pop(0)
+
+    def record(self, resident_name: str, room: str, question: str, response: str):
+        """Add an exchange and persist the resident's updated memory."""
+        if not resident_name or not question or not (response or '').strip():
+            return
+        # Other workers may have written since our last read, so append to the file's state
+        with self._lock, file_lock(self._path(resident_name)):
+            state = self._read(resident_name) or self._seeded(resident_name)
+            self._append(state, {
+                'date': datetime.now().strftime("%d-%m-%Y %H:%M"),
+                'room': room,
+                'question': question,
+                'response': response,
+            })
+            self._save(resident_name, state)
+
+    def build_messages(self, resident_name: str, user_message: str) -> List[Dict]:
+        """
+        Build the Claude ``messages`` list: summary, recent turns, then the new question.
+
+        Returns:
+            List[Dict]: Alternating user/assistant messages ending with ``user_message``
+        """
+        with self._lock:
+            state = self._load(resident_name) if resident_name else self._empty_state('')
+            summary = list(state['summary'])
+            recent = list(state['recent'])
+
+        messages = []
+        for turn in recent:
+            if not turn['response'].strip():
+                continue
+            messages.append({"role": "user", "content": turn['question']})
+            messages.append({"role": "assistant", "content": turn['response']})
+        messages.append({"role": "user", "content": user_message})
+
+        if summary:
+            remembered = "What I remember of our earlier conversations:\n" + '\n'.join(
+                f"- {line}" for line in summary)
+            messages[0] = {"role": "user", "content": f"{remembered}\n\n{messages[0]['content']}"}
+        return messages
@@ -0,0 +1,471 @@
+"""
+Chunk metadata and pre-filtered semantic search.
+
+Each chunk gets a ``ChunkMetadata`` record (source directory, filename,
+inferred room tags, history date and resident). ``MetadataIndex`` keeps a
+sorted array of chunk indices per field value, so its size grows with the
+number of tags rather than values times chunks. A set of
+``RetrievalFilters`` is turned into a candidate mask with a few vectorised
+scatters and ANDs, and only the surviving rows of the embedding matrix are
+scored. Conversation history
+chunks can additionally be down-weighted by age and cut off entirely past a
+maximum age with ``RecencyPolicy``.
+
+The best-scoring chunks often come from one file and overlap heavily. With
+``mmr_lambda`` set, ``search`` takes the top ``fetch_k`` candidates and picks
+the final k by maximal marginal relevance. Each pick maximises
+``lambda * relevance - (1 - lambda) * max similarity to the chunks already
+picked``. Selection is a matrix-vector product per pick, so its cost at
+K=1000 is well below a millisecond:
+
+    python retrieval.py benchmark-mmr
+"""
+import os
+import re
+import sys
+import time
+import argparse
+from array import array
+from datetime import date, datetime
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from sklearn.metrics.pairwise import cosine_similarity
+
+# Keywords used to tag chunks with the rooms they talk about
+ROOM_KEYWORDS = {
+    'kitchen': ['kitchen', 'cook', 'recipe', 'oven', 'hob', 'pasta', 'pancake', 'sourdough',
+                'dough', 'bread', 'flour', 'bake', 'sausage', 'fridge'],
+    'garden': ['garden', 'plant', 'planting', 'sow', 'seed', 'soil', 'compost', 'lawn',
+               'tree', 'flower', 'shrub', 'vegetable', 'harvest', 'outdoor'],
+    'bedroom': ['bedroom', 'bed', 'sleep', 'wardrobe'],
+    'bathroom': ['bathroom', 'shower', 'bath', 'toilet', 'basin', 'sink'],
+    'living_room': ['living room', 'lounge', 'sofa', 'fireplace', 'log burner'],
+}
+
+# Keywords match at the start of a word, so 'plant' also matches 'planting'
+ROOM_PATTERNS = {
+    room: re.compile(r'\b(?:' + '|'.join(re.escape(k) for k in keywords) + ')', re.IGNORECASE)
+    for room, keywords in ROOM_KEYWORDS.items()
+}
+
+HISTORY_FILENAME_DATE = re.compile(r'(\d{2}-\d{2}-\d{4})_conversation_history')
+HISTORY_HEADER_DATE = re.compile(r'## Date:\s*(\d{2}-\d{2}-\d{4})')
+HISTORY_HEADER_RESIDENT = re.compile(r'### Resident:\s*([^|\n]+?)\s*(?:\||\n|$)')
+HISTORY_HEADER_ROOM = re.compile(r'\|\s*Room:\s*([^\n]+)')
+
+METADATA_FIELDS = ('source', 'filename', 'room', 'resident')
+
+# Relevance weight of an MMR pick; MMR_LAMBDA in the app defaults to this
+DEFAULT_MMR_LAMBDA = 0.5
+
+
+def normalize_room(room: Optional[str]) -> Optional[str]:
+    """Map UI and config room names ('Living Room', 'bedrooms') onto one tag."""
+    if not room:
+        return None
+    tag = room.strip().lower().replace(' ', '_')
+    if tag in ('whole_house', 'house'):
+        return None
+    if tag.endswith('s') and tag[:-1] in ROOM_KEYWORDS:
+        tag = tag[:-1]
+    return tag
+
+
+def parse_date(value: str) -> Optional[date]:
+    try:
+        return datetime.strptime(value, '%d-%m-%Y').date()
+    except ValueError:
+        return None
+
+
+class ChunkMetadata:
+    __slots__ = ('source', 'filename', 'rooms', 'date', 'resident')
+
+    def __init__(self, source: str, filename: str, rooms: Tuple[str, ...] = (),
+                 date: Optional[date] = None, resident: Optional[str] = None):
+        self.source = source
+        self.filename = filename
+        self.rooms = rooms
+        self.date = date
+        self.resident = resident
+
+
+def infer_rooms(text: str, filename: str = '') -> Tuple[str, ...]:
+    """Tag a chunk with rooms named in its history header or matched by keyword."""
+    rooms = set()
+    for match in HISTORY_HEADER_ROOM.finditer(text):
+        room = normalize_room(match.group(1))
+        if room:
+            rooms.add(room)
+
+    haystack = f"{filename} {text}"
+    for room, pattern in ROOM_PATTERNS.items():
+        if pattern.search(haystack):
+            rooms.add(room)
+    return tuple(sorted(rooms))
+
+
+def describe_chunk(text: str, filename: str, source: str) -> ChunkMetadata:
+    """Build the metadata record for a single chunk."""
+    chunk_date = None
+    resident = None
+    if source == 'history':
+        header_date = HISTORY_HEADER_DATE.search(text)
+        if header_date:
+            chunk_date = parse_date(header_date.group(1))
+        if chunk_date is None:
+            filename_date = HISTORY_FILENAME_DATE.search(filename)
+            if filename_date:
+                chunk_date = parse_date(filename_date.group(1))
+        header_resident = HISTORY_HEADER_RESIDENT.search(text)
+        if header_resident:
+            resident = header_resident.group(1).strip()
+
+    return ChunkMetadata(source, filename, infer_rooms(text, filename), chunk_date, resident)
+
+
+def build_chunk_metadata(chunks_with_filenames: Iterable[Tuple[str, str]],
+                         file_sources: Dict[str, str]) -> List[ChunkMetadata]:
+    """
+    Args:
+        chunks_with_filenames: (text, filename) pairs, or a ChunkStore
+        file_sources: Maps each filename to the directory it was loaded from
+
+    Returns:
+        List[ChunkMetadata]: One record per chunk, in corpus order
+    """
+    return [describe_chunk(text, filename, file_sources.get(filename, 'documents'))
+            for text, filename in chunks_with_filenames]
+
+
+def list_file_sources(base_dir: str, directories: Iterable[str]) -> Dict[str, str]:
+    """Map every filename in the given directories to its directory name."""
+    sources = {}
+    for directory in directories:
+        dir_path = os.path.join(base_dir, directory)
+        if os.path.exists(dir_path):
+            for filename in os.listdir(dir_path):
+                sources.setdefault(filename, directory)
+    return sources
+
+
+class RetrievalFilters:
+    """
+    Restrictions applied before scoring. Every field is optional; values
+    within a field are ORed together and fields are ANDed.
+
+    ``room`` keeps chunks tagged with that room as well as untagged, general
+    chunks. ``date_from``/``date_to`` keep only dated (history) chunks.
+    """
+
+    def __init__(self, room: Optional[str] = None, sources: Optional[List[str]] = None,
+                 filenames: Optional[List[str]] = None, residents: Optional[List[str]] = None,
+                 date_from: Optional[date] = None, date_to: Optional[date] = None):
+        self.room = normalize_room(room)
+        self.sources = sources
+        self.filenames = filenames
+        self.residents = residents
+        self.date_from = date_from
+        self.date_to = date_to
+
+    def is_empty(self) -> bool:
+        return not any([self.room, self.sources, self.filenames, self.residents,
+                        self.date_from, self.date_to])
+
+
+class RecencyPolicy:
+    """
+    Time-decay for dated (history) chunks.
+
+    A chunk ``age`` days old has its score multiplied by
+    ``floor + (1 - floor) * 0.5 ** (age / half_life_days)``, so an answer from
+    one half-life ago keeps half of the decayable part of its score.
+    Chunks older than ``max_age_days`` are not scored at all. Undated
+    reference documents are never decayed.
+    """
+
+    def __init__(self, half_life_days: float = 180.0, floor: float = 0.5,
+                 max_age_days: Optional[int] = None):
+        self.half_life_days = half_life_days
+        self.floor = floor
+        self.max_age_days = max_age_days
+
+    def weights(self, date_ordinals: np.ndarray, today: date) -> np.ndarray:
+        weights = np.ones(len(date_ordinals), dtype=np.float32)
+        if not self.half_life_days or self.half_life_days <= 0:
+            return weights
+        dated = date_ordinals > 0
+        ages = np.clip(today.toordinal() - date_ordinals[dated], 0, None)
+        weights[dated] = self.floor + (1.0 - self.floor) * np.power(0.5, ages / self.half_life_days)
+        return weights
+
+    def cutoff(self, today: date) -> Optional[int]:
+        """Oldest date ordinal still searched, or None for no cutoff."""
+        if not self.max_age_days or self.max_age_days <= 0:
+            return None
+        return today.toordinal() - self.max_age_days
+
+
+class MetadataIndexBuilder:
+    """Collects metadata postings one chunk at a time, e.g. while a snapshot is written."""
+
+    def __init__(self):
+        self.size = 0
+        self.postings: Dict[str, Dict[str, array]] = {field: {} for field in METADATA_FIELDS}
+        self.untagged = array('i')
+        # Dates as ordinals; 0 marks chunks without a date
+        self.date_ordinals = array('i')
+
+    def _post(self, field: str, value: str, i: int):
+        ids = self.postings[field].get(value)
+        if ids is None:
+            ids = self.postings[field][value] = array('i')
+        ids.append(i)
+
+    def add(self, meta: ChunkMetadata):
+        i = self.size
+        self._post('source', meta.source, i)
+        self._post('filename', meta.filename, i)
+        if meta.resident:
+            self._post('resident', meta.resident, i)
+        if meta.rooms:
+            for room in meta.rooms:
+                self._post('room', room, i)
+        else:
+            self.untagged.append(i)
+        self.date_ordinals.append(meta.date.toordinal() if meta.date else 0)
+        self.size += 1
+
+    def arrays(self) -> Tuple[Dict[str, Dict[str, np.ndarray]], np.ndarray, np.ndarray]:
+        """
+        Returns:
+            tuple: (postings as int32 index arrays per field and value, untagged indices, date ordinals)
+        """
+        postings = {field: {value: np.array(ids, dtype=np.int32) for value, ids in values.items()}
+                    for field, values in self.postings.items()}
+        return (postings, np.array(self.untagged, dtype=np.int32),
+                np.array(self.date_ordinals, dtype=np.int32))
+
+
+class MetadataIndex:
+    """Per-field postings over the chunk metadata, as sorted chunk index arrays."""
+
+    def __init__(self, metadata: List[ChunkMetadata]):
+        builder = MetadataIndexBuilder()
+        for meta in metadata:
+            builder.add(meta)
+        self._load(builder.size, *builder.arrays())
+
+    @classmethod
+    def from_arrays(cls, size: int, postings: Dict[str, Dict[str, np.ndarray]], untagged: np.ndarray,
+                    date_ordinals: np.ndarray) -> 'MetadataIndex':
+        """Wrap postings built elsewhere, e.g. memory-mapped from an index snapshot."""
+        index = cls.__new__(cls)
+        index._load(size, postings, untagged, date_ordinals)
+        return index
+
+    def _load(self, size: int, postings: Dict[str, Dict[str, np.ndarray]], untagged: np.ndarray,
+              date_ordinals: np.ndarray):
+        self.size = size
+        self.postings = postings
+        self.untagged = untagged
+        self.date_ordinals = date_ordinals
+
+        # Dated chunks ordered oldest first, so an age cutoff can skip the
+        # old segment with one binary search instead of scanning it
+        self.undated = np.flatnonzero(self.date_ordinals == 0)
+        dated = np.flatnonzero(self.date_ordinals > 0)
+        order = np.argsort(self.date_ordinals[dated], kind='stable')
+        self.dated_by_age = dated[order]
+        self.dated_sorted_ordinals = self.date_ordinals[self.dated_by_age]
+
+    def _any_of(self, field: str, values: Iterable[str]) -> np.ndarray:
+        mask = np.zeros(self.size, dtype=bool)
+        for value in values:
+            ids = self.postings[field].get(value)
+            if ids is not None:
+                mask[ids] = True
+        return mask
+
+    def mask(self, filters: Optional[RetrievalFilters]) -> Optional[np.ndarray]:
+        """
+        Returns:
+            Boolean candidate mask, or None when no filter applies
+        """
+        if filters is None or filters.is_empty():
+            return None
+
+        mask = np.ones(self.size, dtype=bool)
+        if filters.sources:
+            mask &= self._any_of('source', filters.sources)
+        if filters.filenames:
+            mask &= self._any_of('filename', filters.filenames)
+        if filters.residents:
+            mask &= self._any_of('resident', filters.residents)
+        if filters.room:
+            room = self._any_of('room', [filters.room])
+            room[self.untagged] = True
+            mask &= room
+        if filters.date_from or filters.date_to:
+            dated = self.date_ordinals > 0
+            if filters.date_from:
+                dated &= self.date_ordinals >= filters.date_from.toordinal()
+            if filters.date_to:
+                dated &= self.date_ordinals <= filters.date_to.toordinal()
+            mask &= dated
+        return mask
+
+    def candidates(self, filters: Optional[RetrievalFilters] = None,
+                   recency: Optional[RecencyPolicy] = None,
+                   today: Optional[date] = None) -> Optional[np.ndarray]:
+        """
+        Chunk indices to score after the metadata filters and the age cutoff.
+
+        Returns:
+            Sorted index array, or None when every chunk is a candidate
+        """
+        cutoff = recency.cutoff(today or date.today()) if recency else None
+        recent = None
+        if cutoff is not None:
+            start = np.searchsorted(self.dated_sorted_ordinals, cutoff, side='left')
+            recent = np.sort(np.concatenate([self.undated, self.dated_by_age[start:]]))
+
+        mask = self.mask(filters)
+        if mask is None:
+            return recent
+        if recent is None:
+            return np.flatnonzero(mask)
+        return recent[mask[recent]]
+
+
+def mmr_select(relevance: np.ndarray, embeddings: np.ndarray, k: int = 3,
+               lambda_mult: float = DEFAULT_MMR_LAMBDA) -> np.ndarray:
+    """
+    Pick k diverse rows by maximal marginal relevance.
+
+    Args:
+        relevance: (K,) query relevance of each candidate
+        embeddings: (K, dim) candidate embeddings, compared by cosine similarity
+        k (int): Number of rows to pick
+        lambda_mult (float): 1 ranks by relevance only, 0 by diversity only
+
+    Returns:
+        np.ndarray: Positions into the candidate rows, in pick order
+    """
+    k = min(k, len(relevance))
+    if k == 0:
+        return np.array([], dtype=int)
+    vectors = np.asarray(embeddings, dtype=np.float32)
+    # Dividing each product by the norms is cheaper than normalising a copy of the matrix
+    norms = np.maximum(np.sqrt(np.einsum('ij,ij->i', vectors, vectors)), 1e-12)
+    relevance = lambda_mult * np.asarray(relevance, dtype=np.float32)
+
+    def similarity(i: int) -> np.ndarray:
+        return (vectors @ vectors[i]) / (norms * norms[i])
+
+    picked = np.empty(k, dtype=int)
+    picked[0] = int(np.argmax(relevance))
+    # Highest similarity of every candidate to anything picked so far
+    redundancy = similarity(picked[0])
+    for step in range(1, k):
+        marginal = relevance - (1 - lambda_mult) * redundancy
+        marginal[picked[:step]] = -np.inf
+        picked[step] = int(np.argmax(marginal))
+        np.maximum(redundancy, similarity(picked[step]), out=redundancy)
+    return picked
+
+
+def search(query_embedding: np.ndarray, embeddings: np.ndarray, k: int = 3,
+           candidates: Optional[np.ndarray] = None, index: Optional[MetadataIndex] = None,
+           recency: Optional[RecencyPolicy] = None,
+           today: Optional[date] = None, mmr_lambda: Optional[float] = None,
+           fetch_k: int = 50) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Score only the candidate rows and return the top-k.
+
+    An empty candidate set (filters that match nothing) returns no chunks;
+    pass None to search the whole corpus.
+
+    Args:
+        query_embedding: (1, dim) question embedding
+        embeddings: (n, dim) chunk embeddings in corpus order
+        k (int): Number of chunks to return
+        candidates: Chunk indices to score, or None for all
+        index: Metadata index supplying chunk dates for the recency decay
+        recency: Time-decay applied to dated (history) chunk scores
+        today: Reference date for the decay, defaults to today
+        mmr_lambda: If set below 1, re-pick the top ``fetch_k`` by maximal marginal relevance
+        fetch_k (int): Candidates considered by the MMR step
+
+    Returns:
+        tuple: (chunk indices into the full corpus, their scores), best first; when
+        ``mmr_lambda`` is set, in MMR pick order instead, so the scores need not be sorted
+    """
+    if candidates is None:
+        scores = cosine_similarity(query_embedding, embeddings).flatten()
+    elif not len(candidates):
+        return np.array([], dtype=np.int64), np.array([], dtype=np.float32)
+    else:
+        scores = cosine_similarity(query_embedding, embeddings[candidates]).flatten()
+
+    if recency is not None and index is not None:
+        ordinals = index.date_ordinals if candidates is None else index.date_ordinals[candidates]
+        scores = scores * recency.weights(ordinals, today or date.today())
+
+    pool = max(k, fetch_k) if mmr_lambda is not None and mmr_lambda < 1 else k
+    pool = min(pool, len(scores))
+    top = np.argpartition(-scores, pool - 1)[:pool] if pool else np.array([], dtype=int)
+    top = top[np.argsort(-scores[top])]
+    if len(top) > k:
+        rows = candidates[top] if candidates is not None else top
+        top = top[mmr_select(scores[top], embeddings[rows], k, mmr_lambda)]
+
+    indices = candidates[top] if candidates is not None else top
+    return indices, scores[top]
+
+
+def benchmark_mmr(sizes: Iterable[int] = (50, 200, 1000), k: int = 3, dimension: int = 384,
+                  repeats: int = 200, lambda_mult: float = DEFAULT_MMR_LAMBDA, seed: int = 0) -> Dict[int, Dict[str, float]]:
+    """
+    Time ``mmr_select`` over random candidate matrices of each size.
+
+    Returns:
+        dict: Per K, mean and p95 selection time in microseconds
+    """
+    rng = np.random.default_rng(seed)
+    report = {}
+    for size in sizes:
+        embeddings = rng.standard_normal((size, dimension)).astype(np.float32)
+        relevance = rng.random(size).astype(np.float32)
+        timings = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            mmr_select(relevance, embeddings, k, lambda_mult)
+            timings.append((time.perf_counter() - start) * 1e6)
+        report[size] = {'mean_us': round(float(np.mean(timings)), 1),
+                        'p95_us': round(float(np.percentile(timings, 95)), 1)}
+    return report
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Benchmark retrieval helpers")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    bench_parser = subparsers.add_parser('benchmark-mmr', help="Time MMR selection at several candidate counts")
+    bench_parser.add_argument('--sizes', default='50,200,1000')
+    bench_parser.add_argument('--k', type=int, default=3)
+    bench_parser.add_argument('--dimension', type=int, default=384)
+    bench_parser.add_argument('--lambda', dest='lambda_mult', type=float, default=DEFAULT_MMR_LAMBDA)
+    args = parser.parse_args(argv)
+
+    sizes = [int(size) for size in args.sizes.split(',')]
+    report = benchmark_mmr(sizes, args.k, args.dimension, lambda_mult=args.lambda_mult)
+    print(f"MMR selection of {args.k} from K candidates ({args.dimension}d, lambda {args.lambda_mult})")
+    print(f"{'K':>6}{'mean us':>12}{'p95 us':>12}")
+    for size, row in report.items():
+        print(f"{size:>6}{row['mean_us']:>12}{row['p95_us']:>12}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,121 @@
+"""
+Session-scoped cache kept in ``st.session_state``.
+
+Streamlit reruns the whole script on every widget interaction. Anything
+computed for the current resident is lost unless it is parked in the
+session state. ``SessionCache`` holds, per session:
+
+- the most recent answers per resident, with the retrieval results
+  (sources and chunk scores) and routing metadata that came with them;
+- the resident's conversation history as read from the logs.
+
+History is derived from the log files, so it is dropped whenever the
+process-wide ``LogGeneration`` moves on. That counter is bumped by every log
+write in any session. Answers are only ever appended, so they stay valid.
+"""
+import threading
+from typing import Callable, Dict, List, MutableMapping, Optional
+
+NAMESPACE = 'house_session_cache'
+
+
+class LogGeneration:
+    """Process-wide counter bumped whenever new log records are written."""
+
+    def __init__(self):
+        self._value = 0
+        self._lock = threading.Lock()
+
+    @property
+    def value(self) -> int:
+        return self._value
+
+    def bump(self) -> int:
+        with self._lock:
+            self._value += 1
+            return self._value
+
+
+class SessionCache:
+    def __init__(self, state: MutableMapping, generation: LogGeneration,
+                 max_answers: int = 5, enabled: bool = True,
+                 on_lookup: Optional[Callable[[str], None]] = None):
+        """
+        Args:
+            state: Per-session mapping, normally ``st.session_state``
+            generation: Shared log generation used to invalidate history
+            max_answers (int): Recent answers kept per resident
+            enabled (bool): If False nothing is cached (for measuring rerun cost)
+            on_lookup: Called with 'hit' or 'miss' on each history lookup, e.g. to count them
+        """
+        self.generation = generation
+        self.max_answers = max_answers
+        self.enabled = enabled
+        self.on_lookup = on_lookup
+        if NAMESPACE not in state:
+            state[NAMESPACE] = {
+                'generation': generation.value,
+                'answers': {},
+                'history': {},
+                'stats': {'hits': 0, 'misses': 0, 'invalidations': 0},
+            }
+        self._store = state[NAMESPACE]
+        self._sync()
+
+    def _sync(self):
+        if self._store['generation'] != self.generation.value:
+            self.invalidate('history')
+            self._store['generation'] = self.generation.value
+
+    def invalidate(self, kind: Optional[str] = None):
+        """Drop one kind of entry ('answers' or 'history'), or everything."""
+        for name in ([kind] if kind else ['answers', 'history']):
+            if self._store[name]:
+                self._store[name].clear()
+                self._store['stats']['invalidations'] += 1
+
+    def remember_answer(self, resident: str, answer: Dict):
+        """
+        Keep an answer so later reruns can show it without asking again.
+
+        Args:
+            answer (dict): room, question, response, unique_files, chunk_info and any log metadata
+        """
+        if not self.enabled:
+            return
+        answers = self._store['answers'].setdefault(resident, [])
+        answers.append(answer)
+        del answers[:-self.max_answers]
+
+    def recent_answers(self, resident: str) -> List[Dict]:
+        """Cached answers for the resident, oldest first."""
+        return list(self._store['answers'].get(resident, []))
+
+    def last_answer(self, resident: str) -> Optional[Dict]:
+        answers = self._store['answers'].get(resident)
+        return answers[-1] if answers else None
+
+    def history(self, resident: str, load: Callable[[], List[Dict]]) -> List[Dict]:
+        """Return the resident's log history, calling ``load`` only on a miss."""
+        if not self.enabled:
+            return load()
+        self._sync()
+        cached = self._store['history'].get(resident)
+        if cached is not None:
+            self._store['stats']['hits'] += 1
+            if self.on_lookup:
+                self.on_lookup('hit')
+            return cached
+        self._store['stats']['misses'] += 1
+        if self.on_lookup:
+            self.on_lookup('miss')
+        history = self._store['history'][resident] = load()
+        return history
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            **self._store['stats'],
+            'residents': len(self._store['answers']),
+            'answers': sum(len(answers) for answers in self._store['answers'].values()),
+            'history_entries': sum(len(history) for history in self._store['history'].values()),
+        }
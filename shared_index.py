@@ -0,0 +1,201 @@
+"""
+One index shared by every worker process on a host.
+
+A single loader process publishes index snapshots (see ``index_snapshot.py``)
+into a shared directory as numbered generations. Workers memory-map the
+current one read-only. Every worker maps the same file, so the chunk texts
+and embeddings live once in the OS page cache however many workers run.
+
+    index/shared/
+        gen-000007.snap
+        gen-000008.snap
+        CURRENT              {"generation": 8, "file": "gen-000008.snap", ...}
+
+A new generation is written completely before ``CURRENT`` is swapped with an
+atomic rename. Workers therefore see either the old or the new index, never
+a partial one. Each worker re-reads ``CURRENT`` at most every few seconds and
+remaps when the generation has moved on. Old generations are kept for a
+while, because a request still running on one holds its own mapping.
+
+    python shared_index.py publish          # build from documents/ and history/
+    python shared_index.py watch --interval 300
+    python shared_index.py status
+"""
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import threading
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+import ingestion
+from index_snapshot import IndexSnapshot, build_snapshot, snapshot_fingerprint
+from near_duplicates import DEFAULT_THRESHOLD, dedupe
+
+logger = logging.getLogger(__name__)
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+default_shared_dir = os.path.join(script_dir, 'index', 'shared')
+
+CURRENT_FILE = 'CURRENT'
+GENERATION_FILE = 'gen-{:06d}.snap'
+
+
+def read_current(shared_dir: str) -> Optional[Dict]:
+    """The published generation record, or None if nothing is published yet."""
+    try:
+        with open(os.path.join(shared_dir, CURRENT_FILE), 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, json.JSONDecodeError):
+        return None
+
+
+class SharedIndexPublisher:
+    """Loader side: writes new generations and swaps ``CURRENT``."""
+
+    def __init__(self, shared_dir: str = default_shared_dir, keep: int = 3,
+                 dedup_threshold: float = DEFAULT_THRESHOLD):
+        """
+        Args:
+            shared_dir (str): Directory shared with the workers
+            keep (int): Generations kept on disk, including the current one
+            dedup_threshold (float): Near-duplicate similarity threshold; 0 keeps every chunk
+        """
+        self.shared_dir = shared_dir
+        self.keep = keep
+        self.dedup_threshold = dedup_threshold
+        os.makedirs(shared_dir, exist_ok=True)
+
+    def publish(self, backend: str = 'torch', base_dir: str = script_dir) -> Dict:
+        """Build a snapshot of the knowledge base as the next generation and make it current."""
+        current = read_current(self.shared_dir)
+        generation = (current['generation'] if current else 0) + 1
+        filename = GENERATION_FILE.format(generation)
+        header = build_snapshot(os.path.join(self.shared_dir, filename), base_dir, backend,
+                                dedup_threshold=self.dedup_threshold)
+
+        record = {
+            'generation': generation,
+            'file': filename,
+            'fingerprint': header['fingerprint'],
+            'chunks': header['chunks'],
+            'model_name': header['model_name'],
+            'backend': header['backend'],
+            'published': datetime.now().isoformat(timespec='seconds'),
+        }
+        tmp_path = os.path.join(self.shared_dir, CURRENT_FILE + '.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(record, f, indent=2)
+        os.replace(tmp_path, os.path.join(self.shared_dir, CURRENT_FILE))
+        self._prune(generation)
+        return record
+
+    def _prune(self, generation: int):
+        for name in os.listdir(self.shared_dir):
+            if name.startswith('gen-') and name.endswith('.snap'):
+                try:
+                    number = int(name[4:-5])
+                except ValueError:
+                    continue
+                if number <= generation - self.keep:
+                    # Workers still mapping it keep their pages until they remap
+                    os.remove(os.path.join(self.shared_dir, name))
+
+    def is_stale(self, base_dir: str = script_dir) -> bool:
+        """True if the knowledge base no longer matches the current generation."""
+        current = read_current(self.shared_dir)
+        if current is None:
+            return True
+        chunks = dedupe(ingestion.iter_chunks(base_dir, ingestion.DEFAULT_DIRECTORIES), threshold=self.dedup_threshold)
+        texts = (text for text, _ in chunks)
+        return snapshot_fingerprint(texts, current['model_name'], current['backend']) != current['fingerprint']
+
+
+class SharedIndex:
+    """Worker side: read-only view of the current generation, remapped when it changes."""
+
+    def __init__(self, shared_dir: str = default_shared_dir, check_interval: float = 2.0,
+                 validate: Optional[Callable[[IndexSnapshot], None]] = None):
+        """
+        Args:
+            check_interval (float): Seconds between checks of ``CURRENT``
+            validate: Called on each newly mapped snapshot; if it raises, the
+                previous generation stays in use (or the error propagates if there is none)
+        """
+        self.shared_dir = shared_dir
+        self.check_interval = check_interval
+        self.validate = validate
+        self.generation = 0
+        self._snapshot: Optional[IndexSnapshot] = None
+        self._rejected = 0
+        self._checked = 0.0
+        self._lock = threading.Lock()
+
+    def get(self) -> Optional[IndexSnapshot]:
+        """
+        Returns:
+            IndexSnapshot for the newest valid generation, or None if none is published
+        """
+        now = time.monotonic()
+        if self._snapshot is not None and now - self._checked < self.check_interval:
+            return self._snapshot
+
+        with self._lock:
+            self._checked = now
+            current = read_current(self.shared_dir)
+            if current is None or current['generation'] in (self.generation, self._rejected):
+                return self._snapshot
+            try:
+                snapshot = IndexSnapshot(os.path.join(self.shared_dir, current['file']))
+                if self.validate is not None:
+                    self.validate(snapshot)
+            except Exception as e:
+                if self._snapshot is None:
+                    raise
+                self._rejected = current['generation']
+                logger.warning("Keeping index generation %s; generation %s was rejected: %s",
+                               self.generation, current['generation'], e)
+                return self._snapshot
+            # A single reference swap; requests holding the old snapshot finish on it
+            self._snapshot = snapshot
+            self.generation = current['generation']
+            return snapshot
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Publish the retrieval index for worker processes to share")
+    parser.add_argument('--shared-dir', default=os.getenv('SHARED_INDEX_DIR') or default_shared_dir)
+    parser.add_argument('--backend', default=os.getenv('EMBEDDING_BACKEND', 'torch'))
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('publish', help="Build and publish a new generation")
+    watch_parser = subparsers.add_parser('watch', help="Republish whenever documents or history change")
+    watch_parser.add_argument('--interval', type=float, default=300.0)
+    subparsers.add_parser('status', help="Show the current generation")
+    args = parser.parse_args(argv)
+
+    publisher = SharedIndexPublisher(args.shared_dir,
+                                     dedup_threshold=float(os.getenv('DEDUP_THRESHOLD', DEFAULT_THRESHOLD)))
+    if args.command == 'status':
+        current = read_current(args.shared_dir)
+        if current is None:
+            print(f"Nothing published in {args.shared_dir}")
+            return 1
+        print(json.dumps(current, indent=2))
+        return 0
+
+    while True:
+        if args.command == 'publish' or publisher.is_stale():
+            start = time.perf_counter()
+            record = publisher.publish(args.backend)
+            print(f"Published generation {record['generation']} ({record['chunks']} chunks) "
+                  f"in {time.perf_counter() - start:.1f}s")
+        if args.command == 'publish':
+            return 0
+        time.sleep(args.interval)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
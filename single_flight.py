@@ -0,0 +1,106 @@
+"""
+Single-flight coalescing of identical in-flight streamed requests.
+
+The first request for a key starts the upstream generator on a background
+thread. Every concurrent request for the same key, including the first,
+reads the same updates from a shared buffer. A request that joins
+mid-stream is first given the buffered prefix and then follows the live
+stream. Once the upstream finishes, the flight is dropped, so later
+requests start a fresh one (nothing is cached past completion).
+
+Answers are personalised with the resident's name, habits and memory, so a
+flight is keyed by resident as well as by room and question
+(``request_key``). Only the same resident's repeated question (a double
+submit, a second tab) shares an upstream.
+"""
+import threading
+from typing import Callable, Dict, Hashable, Iterator, List, Optional, Tuple
+
+# How long a waiting subscriber blocks before re-checking the upstream thread
+POLL_SECONDS = 1.0
+
+
+def request_key(resident_name: str, room: str, question: str) -> Tuple[str, str, str]:
+    """Flight key for a question, ignoring case and spacing in the question."""
+    return resident_name.strip(), room, ' '.join(question.lower().split())
+
+
+class _Flight:
+    def __init__(self):
+        self.updates: List[dict] = []
+        self.done = False
+        self.condition = threading.Condition()
+
+
+class SingleFlight:
+    def __init__(self, error_update: Optional[Callable[[Exception], dict]] = None):
+        """
+        Args:
+            error_update: Builds the final update sent to every subscriber if
+                the upstream generator raises
+        """
+        self._lock = threading.Lock()
+        self._flights: Dict[Hashable, _Flight] = {}
+        self.error_update = error_update or (lambda e: {'error': str(e), 'done': True})
+        self.started = 0
+        self.joined = 0
+
+    def in_flight(self) -> int:
+        with self._lock:
+            return len(self._flights)
+
+    def stream(self, key: Hashable, producer: Callable[[], Iterator[dict]]) -> Iterator[dict]:
+        """
+        Yield the updates of the upstream stream for ``key``, starting it if needed.
+
+        Args:
+            key: Identity of the request; equal keys share one upstream
+            producer: Creates the upstream generator; only called by the first request
+
+        Yields:
+            dict: The upstream updates, in order, from the very first one
+        """
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+                self.started += 1
+            else:
+                self.joined += 1
+
+        if leader:
+            thread = threading.Thread(target=self._run, args=(key, flight, producer), daemon=True)
+            thread.start()
+
+        position = 0
+        while True:
+            with flight.condition:
+                while position >= len(flight.updates) and not flight.done:
+                    flight.condition.wait(POLL_SECONDS)
+                pending = flight.updates[position:]
+                finished = flight.done
+            for update in pending:
+                yield update
+            position += len(pending)
+            if finished and position >= len(flight.updates):
+                return
+
+    def _run(self, key: Hashable, flight: _Flight, producer: Callable[[], Iterator[dict]]):
+        try:
+            for update in producer():
+                with flight.condition:
+                    flight.updates.append(update)
+                    flight.condition.notify_all()
+        except Exception as e:
+            with flight.condition:
+                flight.updates.append(self.error_update(e))
+                flight.condition.notify_all()
+        finally:
+            # Stop accepting joiners before marking done so nobody attaches to a dead flight
+            with self._lock:
+                if self._flights.get(key) is flight:
+                    del self._flights[key]
+            with flight.condition:
+                flight.done = True
+                flight.condition.notify_all()
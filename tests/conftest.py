@@ -0,0 +1,31 @@
+import zlib
+
+import numpy as np
+import pytest
+
+
+class FakeEncoder:
+    """Deterministic stand-in for the sentence encoders: one random unit vector per text."""
+
+    model_name = 'fake'
+    backend = 'fake'
+
+    def __init__(self, dimension: int = 8):
+        self.dimension = dimension
+        self.batches = []
+
+    def encode(self, texts, batch_size: int = 32, show_progress_bar: bool = False):
+        self.batches.append(list(texts))
+        if not texts:
+            return np.zeros((0, self.dimension), dtype=np.float32)
+        vectors = np.stack([np.random.default_rng(zlib.crc32(text.encode('utf-8'))).standard_normal(self.dimension)
+                            for text in texts]).astype(np.float32)
+        return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+    def count_tokens(self, texts):
+        return [len(text.split()) + 2 for text in texts]
+
+
+@pytest.fixture
+def encoder():
+    return FakeEncoder()
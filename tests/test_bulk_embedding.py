@@ -0,0 +1,62 @@
+import numpy as np
+
+from bulk_embedding import MAX_BATCH_SIZE, embed_corpus, embed_stream, plan_batches
+
+
+def test_plan_batches_buckets_by_length_and_keeps_every_index():
+    lengths = [5, 300, 6, 40, 7, 600]
+    batches = plan_batches(lengths, boundaries=(32, 64), tokens_per_batch=1000)
+    assert sorted(i for batch in batches for i in batch) == list(range(len(lengths)))
+    # Short chunks share a batch; long ones are not padded to each other beyond the budget
+    assert batches[0] == [0, 2, 4]
+    assert [3] in batches
+
+
+def test_plan_batches_respects_token_budget_and_batch_cap():
+    lengths = [100] * 10
+    batches = plan_batches(lengths, boundaries=(128,), tokens_per_batch=300)
+    assert all(len(batch) * 100 <= 300 for batch in batches)
+    assert len(plan_batches([1] * (MAX_BATCH_SIZE + 1), tokens_per_batch=10 ** 6)) == 2
+
+
+def test_embed_corpus_keeps_corpus_order(encoder, tmp_path):
+    texts = ['one two three ' * n for n in (20, 1, 5, 1, 50)]
+    matrix, stats = embed_corpus(encoder, texts, str(tmp_path), boundaries=(8, 32), tokens_per_batch=200)
+    assert np.allclose(matrix, encoder.encode(texts))
+    assert stats['embedded'] == len(texts)
+
+
+def test_embed_corpus_resumes_after_interruption(encoder, tmp_path):
+    texts = [f"chunk {i} " + 'word ' * (i * 7) for i in range(12)]
+
+    class Interrupt(Exception):
+        pass
+
+    def stop_after_first(done, total, rate):
+        raise Interrupt
+
+    try:
+        embed_corpus(encoder, texts, str(tmp_path), boundaries=(8, 32), tokens_per_batch=64,
+                     on_batch=stop_after_first)
+    except Interrupt:
+        pass
+    first_batch = len(encoder.batches[-1])
+
+    matrix, stats = embed_corpus(encoder, texts, str(tmp_path), boundaries=(8, 32), tokens_per_batch=64)
+    assert stats['resumed_batches'] == 1
+    assert stats['embedded'] == len(texts) - first_batch
+    assert np.allclose(matrix, encoder.encode(texts))
+
+
+def test_embed_corpus_starts_over_when_the_corpus_changes(encoder, tmp_path):
+    embed_corpus(encoder, ['a b', 'c d'], str(tmp_path))
+    matrix, stats = embed_corpus(encoder, ['a b', 'c d', 'e f'], str(tmp_path))
+    assert stats['resumed_batches'] == 0
+    assert matrix.shape[0] == 3
+
+
+def test_embed_stream_yields_in_input_order(encoder):
+    chunks = [('long ' * 40, 'a.md'), ('short', 'b.md'), ('mid ' * 10, 'c.md')]
+    out = list(embed_stream(encoder, chunks, window=2))
+    assert [chunk for chunk, _ in out] == chunks
+    assert np.allclose(np.stack([vector for _, vector in out]), encoder.encode([t for t, _ in chunks]))
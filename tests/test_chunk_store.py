@@ -0,0 +1,40 @@
+import numpy as np
+import pytest
+
+from chunk_store import ChunkStore, benchmark
+
+CHUNKS = [("Knead the dough, café style.", 'recipes.md'), ("Bleed the radiators.", 'boiler.md'),
+          ("Sow the beans.", 'recipes.md')]
+
+
+def test_store_behaves_like_the_tuple_list():
+    store = ChunkStore.from_chunks(CHUNKS)
+    assert len(store) == 3
+    assert [tuple(chunk) for chunk in store] == CHUNKS
+    text, filename = store[-1]
+    assert (text, filename) == CHUNKS[-1]
+    assert store[0] == CHUNKS[0]
+    assert store.texts[1:] == [text for text, _ in CHUNKS[1:]]
+    assert store.filenames == ['recipes.md', 'boiler.md']
+    assert list(store.file_ids) == [0, 1, 0]
+    with pytest.raises(IndexError):
+        store[3]
+
+
+def test_store_wraps_external_arrays_without_copying():
+    built = ChunkStore.from_chunks(CHUNKS)
+    buffer = np.frombuffer(built.buffer, dtype=np.uint8)
+    view = ChunkStore(buffer, built.offsets, built.file_ids, built.filenames)
+    assert [tuple(chunk) for chunk in view] == CHUNKS
+    assert view.digest() == built.digest()
+    assert ChunkStore.from_chunks(CHUNKS[:2]).digest() != built.digest()
+
+
+def test_empty_store():
+    store = ChunkStore.from_chunks([])
+    assert len(store) == 0 and list(store) == []
+
+
+def test_benchmark_store_is_smaller_than_tuples():
+    result = benchmark(2000)
+    assert result['store_bytes_per_chunk'] < result['tuples_bytes_per_chunk']
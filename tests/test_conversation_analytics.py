@@ -0,0 +1,92 @@
+import csv
+import json
+import multiprocessing
+from datetime import date
+
+import pytest
+
+from conversation_analytics import ConversationAnalytics, extract_topics, iter_log_records, time_period
+
+
+def record_many(logs_dir, resident, count):
+    analytics = ConversationAnalytics(logs_dir)
+    for _ in range(count):
+        analytics.record(resident, 'Kitchen', 'How do I fix the oven?', '10:00:00')
+
+
+def test_topics_and_time_periods():
+    assert extract_topics("Can we repair the solar panels?") == ['maintenance', 'energy']
+    assert time_period('08:30:00') == 'morning'
+    assert time_period('23:10:00') == 'night'
+    assert time_period('soon') is None
+
+
+def test_record_updates_resident_and_house_totals(tmp_path):
+    analytics = ConversationAnalytics(str(tmp_path))
+    analytics.record('Rob', 'Garden', 'When should I plant the tree?', '18:00:00')
+    analytics.record('Rob', 'Garden', 'Is it warm enough?', '09:00:00')
+    patterns = analytics.patterns('Rob')
+    assert patterns['total'] == 2
+    assert patterns['favorite_rooms'] == {'Garden': 2}
+    assert analytics.patterns()['total'] == 2
+    assert analytics.describe('Rob') == ("usually asks about Garden; interested in garden, comfort; "
+                                         "tends to visit in the evening")
+    assert analytics.describe('Nobody') == ''
+
+
+def test_workers_do_not_overwrite_each_other(tmp_path):
+    first = ConversationAnalytics(str(tmp_path))
+    second = ConversationAnalytics(str(tmp_path))
+    first.record('Rob', 'Kitchen', 'q', '10:00:00')
+    second.record('Ann', 'Kitchen', 'q', '10:00:00')
+    first.record('Rob', 'Kitchen', 'q', '10:00:00')
+    # Readers pick up the other worker's writes
+    assert second.patterns()['total'] == 3
+    assert ConversationAnalytics(str(tmp_path)).residents() == ['Ann', 'Rob']
+
+
+def test_concurrent_processes_lose_no_updates(tmp_path):
+    processes = [multiprocessing.Process(target=record_many, args=(str(tmp_path), f"r{n}", 25))
+                 for n in range(4)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    assert ConversationAnalytics(str(tmp_path)).patterns()['total'] == 100
+
+
+def test_rebuild_reads_json_logs_and_falls_back_to_csv(tmp_path):
+    with open(tmp_path / '01-01-2024_response_log.json', 'w', encoding='utf-8') as f:
+        json.dump([{'resident_name': 'Rob', 'room': 'Hall', 'question': 'q', 'time': '10:00:00'}], f)
+    with open(tmp_path / '02-01-2024_response_log.csv', 'w', newline='', encoding='utf-8') as f:
+        writer = csv.DictWriter(f, ['resident_name', 'room', 'question', 'time'])
+        writer.writeheader()
+        writer.writerow({'resident_name': 'Ann', 'room': 'Hall', 'question': 'q', 'time': '20:00:00'})
+
+    assert len(list(iter_log_records(str(tmp_path)))) == 2
+    analytics = ConversationAnalytics(str(tmp_path))
+    assert analytics.rebuild(str(tmp_path)) == 2
+    assert analytics.residents() == ['Ann', 'Rob']
+
+
+def test_archived_days_are_read_once_their_raw_logs_are_deleted(tmp_path):
+    pytest.importorskip('pyarrow', exc_type=ImportError)
+    from log_archive import LogArchive
+
+    logs_dir, archive_dir = tmp_path / 'logs', tmp_path / 'archive'
+    logs_dir.mkdir()
+    for day, resident in (('30-09-2024', 'Rob'), ('01-10-2024', 'Ann')):
+        with open(logs_dir / f"{day}_response_log.json", 'w', encoding='utf-8') as f:
+            json.dump([{'resident_name': resident, 'room': 'Hall', 'date': day, 'question': 'Fix the boiler?',
+                        'response': 'Yes.', 'time': '10:00:00'}], f)
+    LogArchive(str(archive_dir), str(logs_dir), str(tmp_path / 'history')).compact(today=date(2024, 10, 2))
+    (logs_dir / '30-09-2024_response_log.json').unlink()
+
+    assert [r['resident_name'] for r in iter_log_records(str(logs_dir))] == ['Ann']
+    # Archived days still present as raw logs are read from the raw files only
+    records = list(iter_log_records(str(logs_dir), str(archive_dir)))
+    assert [(r['resident_name'], r['date']) for r in records] == [('Rob', '30-09-2024'), ('Ann', '01-10-2024')]
+
+    analytics = ConversationAnalytics(str(logs_dir))
+    assert analytics.rebuild(str(logs_dir), str(archive_dir)) == 2
+    assert analytics.patterns('Rob')['common_topics'] == {'maintenance': 1}
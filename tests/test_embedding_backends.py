@@ -0,0 +1,41 @@
+import numpy as np
+import pytest
+
+from embedding_backends import cosine_agreement, load_encoder, verify_backend_agreement
+
+
+class FixedEncoder:
+    def __init__(self, vectors):
+        self.vectors = np.asarray(vectors, dtype=np.float32)
+
+    def encode(self, texts):
+        return self.vectors[:len(texts)]
+
+
+def test_cosine_agreement_ignores_scale():
+    reference = np.array([[1.0, 0.0], [0.0, 2.0]])
+    candidate = np.array([[3.0, 0.0], [1.0, 1.0]])
+    assert np.allclose(cosine_agreement(reference, candidate), [1.0, np.sqrt(0.5)])
+
+
+def test_verify_backend_agreement_reports_worst_text():
+    reference = FixedEncoder([[1, 0], [0, 1]])
+    candidate = FixedEncoder([[1, 0], [0.2, 1]])
+    result = verify_backend_agreement(reference, candidate, ['same', 'drifted'], tolerance=0.05)
+    assert result['worst_text'] == 'drifted'
+    assert result['passed']
+
+    result = verify_backend_agreement(reference, candidate, ['same', 'drifted'], tolerance=0.01)
+    assert not result['passed']
+
+
+def test_load_encoder_rejects_unknown_backend():
+    with pytest.raises(ValueError):
+        load_encoder('tensorflow')
+
+
+def test_onnx_encoder_requires_export(tmp_path):
+    pytest.importorskip('onnxruntime')
+    pytest.importorskip('tokenizers')
+    with pytest.raises(FileNotFoundError):
+        load_encoder('onnx', onnx_dir=str(tmp_path))
@@ -0,0 +1,63 @@
+import json
+from datetime import date
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from evaluate_retrieval import _files_from_record, build_query_set, evaluate, exact_retriever, resolve_retriever
+
+
+def test_files_from_record_reads_lists_strings_and_chunk_info():
+    assert _files_from_record({'unique_files': ['a.md', 'a.md', 'b.md']}) == ['a.md', 'b.md']
+    assert _files_from_record({'unique_files': 'a.md - b.md'}) == ['a.md', 'b.md']
+    assert _files_from_record({'unique_files': [], 'chunk_info': ['c.md (chunk 1, score: 0.5123)']}) == ['c.md']
+
+
+def test_build_query_set_prefers_judgments(tmp_path):
+    logs = [{'question': 'Pancakes?', 'room': 'Kitchen', 'date': '01-10-2024', 'unique_files': ['history.md']},
+            {'question': 'No sources', 'unique_files': []}]
+    with open(tmp_path / '01-10-2024_response_log.json', 'w', encoding='utf-8') as f:
+        json.dump(logs, f)
+    judgments = tmp_path / 'judgments.json'
+    judgments.write_text(json.dumps([{'question': 'pancakes?', 'relevant_files': ['Pancakes.md']}]))
+
+    queries = build_query_set(str(tmp_path))
+    assert [(q['question'], q['date'], q['relevant']) for q in queries] == [
+        ('Pancakes?', date(2024, 10, 1), {'history.md'})]
+    queries = build_query_set(str(tmp_path), str(judgments))
+    assert queries[0]['relevant'] == {'Pancakes.md'} and queries[0]['label'] == 'judged'
+
+
+def test_evaluate_reports_recall_and_mrr(encoder):
+    texts = ['pancakes', 'boiler', 'garden']
+    corpus = SimpleNamespace(encoder=encoder, filenames=['p.md', 'b.md', 'g.md'],
+                             embeddings=encoder.encode(texts), history_cutoff=lambda query_date: None)
+    queries = [{'question': 'pancakes', 'date': None, 'relevant': {'p.md'}},
+               {'question': 'garden', 'date': None, 'relevant': {'b.md'}}]
+    report = evaluate(corpus, queries, {'exact': exact_retriever}, ks=[1, 3])['exact']
+    assert report['queries'] == 2
+    assert report['recall@1'] == 0.5
+    assert report['recall@3'] == 1.0
+    assert 0.5 < report['mrr'] < 1.0
+
+
+def test_resolve_retriever():
+    assert resolve_retriever('exact') is exact_retriever
+    assert resolve_retriever('numpy:argsort') is np.argsort
+
+
+def test_build_query_set_reads_archived_days(tmp_path):
+    pytest.importorskip('pyarrow', exc_type=ImportError)
+    from log_archive import LogArchive
+
+    logs_dir = tmp_path / 'logs'
+    logs_dir.mkdir()
+    with open(logs_dir / '30-09-2024_response_log.json', 'w', encoding='utf-8') as f:
+        json.dump([{'question': 'Boiler?', 'room': 'Hall', 'time': '10:00:00', 'unique_files': ['boiler.md']}], f)
+    LogArchive(str(tmp_path / 'archive'), str(logs_dir), str(tmp_path / 'history')).compact(today=date(2024, 10, 1))
+    (logs_dir / '30-09-2024_response_log.json').unlink()
+
+    queries = build_query_set(str(logs_dir), archive_dir=str(tmp_path / 'archive'))
+    assert [(q['question'], q['date'], q['relevant']) for q in queries] == [
+        ('Boiler?', date(2024, 9, 30), {'boiler.md'})]
@@ -0,0 +1,59 @@
+import json
+import os
+
+import pytest
+
+from house_persona import DEFAULT_HOUSE_CONFIG, HouseConfigError, HousePersonaCache, compile_house_persona
+
+
+def write(path, text):
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write(text)
+
+
+@pytest.fixture
+def files(tmp_path):
+    config_path = str(tmp_path / 'house_config.json')
+    prompt_path = str(tmp_path / 'prompt.txt')
+    write(config_path, json.dumps(DEFAULT_HOUSE_CONFIG))
+    write(prompt_path, "A {style} house from {build_date}.")
+    return config_path, prompt_path
+
+
+def test_compile_falls_back_to_defaults_with_warnings():
+    persona = compile_house_persona(None, None, 'missing.json', 'missing.txt')
+    assert len(persona.warnings) == 2
+    assert DEFAULT_HOUSE_CONFIG['architectural_style'] in persona.system_prompt
+
+
+def test_compile_rejects_bad_config_and_template():
+    with pytest.raises(HouseConfigError):
+        compile_house_persona(b'{not json', b'prompt')
+    with pytest.raises(HouseConfigError):
+        compile_house_persona(json.dumps({'rooms': []}).encode(), b'prompt')
+    with pytest.raises(HouseConfigError):
+        compile_house_persona(json.dumps(DEFAULT_HOUSE_CONFIG).encode(), b'{unknown_field}')
+
+
+def test_cache_only_recompiles_on_content_change(files):
+    config_path, prompt_path = files
+    cache = HousePersonaCache(config_path, prompt_path)
+    first = cache.get()
+    assert cache.get() is first and cache.builds == 1
+
+    # Touched but unchanged: re-read and re-hashed, not recompiled
+    stat = os.stat(prompt_path)
+    os.utime(prompt_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    assert cache.get() is first and cache.builds == 1
+
+    write(prompt_path, "Changed {style} house.")
+    assert cache.get().system_prompt.startswith("Changed") and cache.builds == 2
+
+
+def test_cache_raises_on_broken_file(files):
+    config_path, prompt_path = files
+    cache = HousePersonaCache(config_path, prompt_path)
+    cache.get()
+    write(config_path, '{broken')
+    with pytest.raises(HouseConfigError):
+        cache.get()
@@ -0,0 +1,63 @@
+import shutil
+
+import numpy as np
+import pytest
+from PIL import Image, ImageDraw
+
+from image_ocr import OcrSettings, has_text_regions, ocr_image, otsu_threshold, preprocess_image
+
+
+def text_like_image(width=800, height=600):
+    """Dark 'words' in rows on white paper."""
+    image = Image.new('L', (width, height), 255)
+    draw = ImageDraw.Draw(image)
+    for top in range(20, height - 20, 30):
+        for left in range(20, width - 40, 24):
+            draw.rectangle([left, top, left + 12, top + 14], fill=20)
+    return image
+
+
+def test_otsu_threshold_separates_ink_from_paper():
+    gray = np.array([20] * 100 + [230] * 300, dtype=np.uint8)
+    assert 20 <= otsu_threshold(gray) < 230
+
+
+def test_preprocess_downsamples_greyscales_and_binarises():
+    image = Image.new('RGB', (6000, 4000), 'white')
+    image.info['dpi'] = (600, 600)
+    out = preprocess_image(image)
+    assert out.mode == 'L'
+    assert out.size == (3000, 2000)
+    assert set(np.unique(np.asarray(out))) <= {0, 255}
+
+    undated = preprocess_image(Image.new('RGB', (6600, 3300), 'white'), OcrSettings(binarize=False))
+    assert max(undated.size) == 300 * 11
+
+
+def test_preprocess_turns_photos_upright():
+    image = Image.new('RGB', (400, 200), 'white')
+    exif = image.getexif()
+    exif[0x0112] = 6  # rotated 90 degrees clockwise
+    image.info['exif'] = exif.tobytes()
+    assert preprocess_image(image).size == (200, 400)
+
+
+def test_text_detection_skips_photos_without_text(tmp_path):
+    assert has_text_regions(text_like_image())
+    gradient = Image.fromarray(np.tile(np.linspace(0, 255, 800, dtype=np.uint8), (600, 1)))
+    assert not has_text_regions(gradient)
+
+    path = str(tmp_path / 'wall.png')
+    gradient.save(path)
+    stats = {}
+    assert ocr_image(path, stats=stats) == ''
+    assert stats['skipped'] == 'no text regions'
+
+
+@pytest.mark.skipif(shutil.which('tesseract') is None, reason="tesseract is not installed")
+def test_ocr_reads_text(tmp_path):
+    image = Image.new('L', (900, 200), 255)
+    ImageDraw.Draw(image).text((20, 80), "BOILER SERVICE DUE IN MAY", fill=0)
+    path = str(tmp_path / 'note.png')
+    image.resize((2700, 600)).save(path)
+    assert 'BOILER' in ocr_image(path, OcrSettings(detect_text=False)).upper()
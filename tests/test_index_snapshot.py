@@ -0,0 +1,80 @@
+from datetime import date
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from index_snapshot import IndexSnapshot, SnapshotError, SnapshotWriter, snapshot_fingerprint, write_snapshot
+from retrieval import ChunkMetadata, MetadataIndex, RetrievalFilters
+
+CHUNKS = [("The boiler is serviced in May.", 'boiler.md'),
+          ("Knead the sourdough for ten minutes, café style.", 'recipes.md'),
+          ("Rob asked about the garden.", '01-01-2024_conversation_history.md')]
+METADATA = [ChunkMetadata('documents', 'boiler.md'),
+            ChunkMetadata('documents', 'recipes.md', rooms=('kitchen',)),
+            ChunkMetadata('history', '01-01-2024_conversation_history.md', rooms=('garden',),
+                          date=date(2024, 1, 1), resident='Rob')]
+
+
+@pytest.fixture
+def snapshot(tmp_path, encoder):
+    path = str(tmp_path / 'index' / 'house.snap')
+    embeddings = encoder.encode([text for text, _ in CHUNKS])
+    header = write_snapshot(path, CHUNKS, METADATA, embeddings, encoder.model_name, encoder.backend,
+                            extra_sections={'ann_ids': np.arange(3, dtype=np.int32)})
+    return IndexSnapshot(path), header, embeddings
+
+
+def test_round_trip_keeps_chunks_embeddings_and_metadata(snapshot):
+    snap, header, embeddings = snapshot
+    assert [tuple(chunk) for chunk in snap.chunks] == CHUNKS
+    assert np.array_equal(snap.embeddings, embeddings)
+    assert snap.embeddings.ctypes.data % 64 == 0
+    restored = snap.metadata()
+    assert [(m.source, m.filename, m.rooms, m.date, m.resident) for m in restored] == \
+        [(m.source, m.filename, m.rooms, m.date, m.resident) for m in METADATA]
+    assert list(snap.section('ann_ids')) == [0, 1, 2]
+    assert header['fingerprint'] == snapshot_fingerprint([t for t, _ in CHUNKS], 'fake', 'fake')
+    assert list(snap.metadata_index().candidates(RetrievalFilters(residents=['Rob']))) == [2]
+    assert snap.duplicate_sources() == {}
+
+
+def test_snapshot_checks_model_backend_dimension_and_chunker(snapshot, encoder):
+    snap, _, _ = snapshot
+    snap.check_compatible(encoder)
+    with pytest.raises(SnapshotError):
+        snap.check_compatible(encoder, chunk_size=1)
+    for attribute, value in (('model_name', 'other'), ('backend', 'onnx'), ('dimension', 384)):
+        mismatched = SimpleNamespace(model_name=encoder.model_name, backend=encoder.backend,
+                                     dimension=encoder.dimension)
+        setattr(mismatched, attribute, value)
+        with pytest.raises(SnapshotError):
+            snap.check_compatible(mismatched)
+
+
+def test_rejects_files_that_are_not_snapshots(tmp_path):
+    path = tmp_path / 'bogus.snap'
+    path.write_bytes(b'not a snapshot')
+    with pytest.raises(SnapshotError):
+        IndexSnapshot(str(path))
+
+
+def test_writer_rejects_mismatched_dimensions_and_cleans_up(tmp_path):
+    path = str(tmp_path / 'house.snap')
+    writer = SnapshotWriter(path, 'fake', 'fake')
+    writer.add('a', 'a.md', ChunkMetadata('documents', 'a.md'), np.ones(4))
+    with pytest.raises(SnapshotError):
+        writer.add('b', 'b.md', ChunkMetadata('documents', 'b.md'), np.ones(3))
+    writer.abort()
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_metadata_index_is_mapped_from_the_snapshot(snapshot, monkeypatch):
+    snap, _, _ = snapshot
+    monkeypatch.setattr(snap, 'metadata', lambda: pytest.fail("metadata should not be parsed"))
+    mapped = snap.metadata_index()
+    built = MetadataIndex(METADATA)
+    assert isinstance(mapped.date_ordinals, np.memmap)
+    for filters in (RetrievalFilters(room='kitchen'), RetrievalFilters(sources=['history']),
+                    RetrievalFilters(filenames=['recipes.md']), RetrievalFilters(date_from=date(2023, 1, 1))):
+        assert list(mapped.candidates(filters)) == list(built.candidates(filters))
@@ -0,0 +1,51 @@
+import os
+
+import ingestion
+from ingestion import iter_chunks, iter_pages, load_documents, write_synthetic_pdf
+
+
+def make_corpus(tmp_path, pages=3):
+    documents, history = tmp_path / 'documents', tmp_path / 'history'
+    documents.mkdir()
+    history.mkdir()
+    (documents / 'notes.md').write_text("The boiler is serviced in May.", encoding='utf-8')
+    (history / '01-01-2024_conversation_history.md').write_text("Rob asked about the garden.", encoding='utf-8')
+    (history / '02-01-2024_conversation_history.md').write_text("Still being written.", encoding='utf-8')
+    write_synthetic_pdf(str(documents / 'survey.pdf'), pages)
+    return str(tmp_path)
+
+
+def test_pdfs_are_yielded_one_page_at_a_time(tmp_path):
+    base_dir = make_corpus(tmp_path)
+    pages = [(text, filename) for text, filename in iter_pages(base_dir, skip_history_dates=['02-01-2024'])
+             if filename == 'survey.pdf']
+    assert len(pages) == 3
+    assert all('gutter' in text or 'boiler' in text for text, _ in pages)
+
+
+def test_history_for_skipped_dates_is_left_out(tmp_path):
+    base_dir = make_corpus(tmp_path)
+    filenames = {filename for _, filename in iter_chunks(base_dir, skip_history_dates=['02-01-2024'])}
+    assert filenames == {'notes.md', 'survey.pdf', '01-01-2024_conversation_history.md'}
+
+
+def test_load_documents_matches_the_stream(tmp_path, monkeypatch):
+    monkeypatch.setattr(ingestion, 'CHUNK_SIZE', 200)
+    base_dir = make_corpus(tmp_path)
+    (tmp_path / 'documents' / 'manual.txt').write_text('\n\n'.join(['Bleed the radiators. ' * 5] * 10),
+                                                       encoding='utf-8')
+    streamed = list(iter_chunks(base_dir, ['documents']))
+    assert load_documents(base_dir, ['documents']) == streamed
+    assert sum(1 for _, filename in streamed if filename == 'manual.txt') > 1
+
+
+def test_benchmark_builds_the_same_snapshot_both_ways(tmp_path):
+    from index_snapshot import IndexSnapshot
+
+    os.makedirs(tmp_path / 'documents')
+    write_synthetic_pdf(str(tmp_path / 'documents' / 'survey.pdf'), 5)
+    rows = [ingestion._benchmark_in_process(mode, str(tmp_path)) for mode in ('stream', 'load')]
+    assert [row['chunks'] for row in rows] == [5, 5]
+    assert all(row['peak_rss_mb'] >= row['baseline_rss_mb'] for row in rows)
+    streamed, loaded = IndexSnapshot(str(tmp_path / 'stream.snap')), IndexSnapshot(str(tmp_path / 'load.snap'))
+    assert streamed.header['fingerprint'] == loaded.header['fingerprint']
@@ -0,0 +1,245 @@
+import time
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from llm_resilience import (AdaptiveConcurrencyLimiter, CircuitBreaker, CircuitOpenError, ResilientLLM, RetryPolicy,
+                            rate_limit_headers, retry_after_seconds)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class APIStatusError(Exception):
+    def __init__(self, status_code, headers=None):
+        super().__init__(f"status {status_code}")
+        self.status_code = status_code
+        self.response = type('Response', (), {'headers': headers or {}})()
+
+
+class APIConnectionError(Exception):
+    pass
+
+
+class FakeStream:
+    def __init__(self, texts, fail_after=None):
+        self.texts = texts
+        self.fail_after = fail_after
+        self.closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.closed = True
+
+    @property
+    def text_stream(self):
+        for n, text in enumerate(self.texts):
+            if n == self.fail_after:
+                raise ConnectionResetError('reset')
+            yield text
+
+    def get_final_message(self):
+        return 'final'
+
+
+class FakeClient:
+    """Replays scripted outcomes: an exception to raise, or a message/stream to return."""
+
+    def __init__(self, outcomes):
+        self.outcomes = list(outcomes)
+        self.calls = 0
+        self.messages = self
+
+    def _next(self):
+        self.calls += 1
+        outcome = self.outcomes.pop(0)
+        if isinstance(outcome, BaseException):
+            raise outcome
+        return outcome
+
+    def create(self, **kwargs):
+        return self._next()
+
+    def stream(self, **kwargs):
+        return self._next()
+
+
+def make_llm(outcomes, breaker=None, **retry):
+    clock = FakeClock()
+    breaker = breaker or CircuitBreaker(failure_threshold=2, reset_timeout=10, clock=clock)
+    llm = ResilientLLM(FakeClient(outcomes), retry=RetryPolicy(**{'base_delay': 0.1, **retry}),
+                       limiter=AdaptiveConcurrencyLimiter(initial=4), breaker=breaker,
+                       sleep=clock.sleep, clock=clock)
+    return llm, clock
+
+
+def test_breaker_opens_half_opens_and_closes():
+    clock = FakeClock()
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=10, clock=clock)
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.CLOSED
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN and not breaker.allow()
+
+    clock.now = 10
+    assert breaker.admit() == CircuitBreaker.HALF_OPEN
+    assert breaker.admit() is None
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+
+    clock.now = 20
+    assert breaker.allow()
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED and breaker.allow() and breaker.allow()
+
+
+def test_retries_retryable_errors_and_honours_retry_after():
+    llm, clock = make_llm([APIStatusError(529), APIStatusError(429, {'retry-after': '2'}), 'message'])
+    assert llm.create(model='m') == 'message'
+    assert llm.retries == 2
+    assert clock.now >= 2
+    assert llm.limiter.limit < 4
+
+
+def test_does_not_retry_client_errors():
+    llm, _ = make_llm([APIStatusError(400), 'message'])
+    with pytest.raises(APIStatusError):
+        llm.create(model='m')
+    assert llm.client.calls == 1
+
+
+def test_circuit_fails_fast_once_open():
+    llm, _ = make_llm([APIConnectionError(), APIConnectionError()], max_attempts=2)
+    with pytest.raises(APIConnectionError):
+        llm.create(model='m')
+    with pytest.raises(CircuitOpenError):
+        llm.create(model='m')
+    assert llm.client.calls == 2
+
+
+@pytest.mark.parametrize('error', [ConnectionResetError('reset'), ValueError('bad'), KeyboardInterrupt()])
+def test_probe_slot_is_freed_after_an_unclassified_error(error):
+    llm, clock = make_llm([APIStatusError(503), APIStatusError(503), error, 'message'], max_attempts=2)
+    with pytest.raises(APIStatusError):
+        llm.create(model='m')
+    clock.now += 10
+    with pytest.raises(type(error)):
+        llm.create(model='m')
+    # Without a verdict the breaker stays half-open, but the next call may probe
+    assert llm.breaker.state == CircuitBreaker.HALF_OPEN
+    assert llm.create(model='m') == 'message'
+    assert llm.breaker.state == CircuitBreaker.CLOSED
+
+
+def test_probe_slot_is_freed_when_a_stream_is_abandoned_or_breaks():
+    abandoned, broken = FakeStream(['a', 'b', 'c']), FakeStream(['a', 'b'], fail_after=1)
+    llm, clock = make_llm([APIStatusError(503), APIStatusError(503), abandoned, broken, FakeStream(['ok'])],
+                          max_attempts=2)
+    with pytest.raises(APIStatusError):
+        llm.create(model='m')
+    clock.now += 10
+
+    stream = llm.stream_text(model='m')
+    assert next(stream) == 'a'
+    stream.close()
+    assert abandoned.closed and llm.limiter.in_flight == 0
+
+    with pytest.raises(ConnectionResetError):
+        list(llm.stream_text(model='m'))
+    assert broken.closed
+
+    finals = []
+    assert list(llm.stream_text(on_complete=finals.append, model='m')) == ['ok']
+    assert finals == ['final'] and llm.breaker.state == CircuitBreaker.CLOSED
+
+
+def test_limiter_is_aimd():
+    limiter = AdaptiveConcurrencyLimiter(initial=4, maximum=5)
+    limiter.on_throttle()
+    assert limiter.limit == 2
+    limiter.on_success()
+    assert limiter.limit == 2.5
+    assert limiter.acquire(timeout=0) and limiter.acquire(timeout=0) and not limiter.acquire(timeout=0)
+
+
+def test_retry_after_header_forms():
+    assert retry_after_seconds({'retry-after-ms': '1500'}) == 1.5
+    assert retry_after_seconds({'retry-after': '3'}) == 3.0
+    assert retry_after_seconds({'retry-after': 'Wed, 21 Oct 2015 07:28:00 GMT'}) == 0.0
+    assert retry_after_seconds(None) is None
+
+
+def test_rate_limit_header_parsing():
+    reset = (datetime.now(timezone.utc) + timedelta(seconds=30)).isoformat()
+    limit, remaining, reset_in = rate_limit_headers({'anthropic-ratelimit-requests-limit': '50',
+                                                     'anthropic-ratelimit-requests-remaining': '3',
+                                                     'anthropic-ratelimit-requests-reset': reset})
+    assert (limit, remaining) == (50, 3) and 29 < reset_in <= 30
+    assert rate_limit_headers({'retry-after': '1'}) is None
+    assert rate_limit_headers(None) is None
+
+
+def test_limiter_is_capped_by_remaining_requests_until_the_window_resets():
+    clock = FakeClock()
+    limiter = AdaptiveConcurrencyLimiter(initial=8, maximum=16, clock=clock)
+    limiter.on_rate_limit(50, 2, reset_in=10)
+    assert limiter.limit == 2
+    for _ in range(10):
+        limiter.on_success()
+    assert limiter.limit == 2
+
+    clock.now = 10
+    limiter.on_success()
+    assert limiter.limit == 2.5
+
+    limiter.on_rate_limit(50, 0, reset_in=5)
+    assert limiter.limit == 1 and not limiter.acquire(timeout=0)
+    clock.now = 15
+    assert limiter.acquire(timeout=0)
+
+
+def stub_llm(server, **limiter):
+    anthropic = pytest.importorskip('anthropic')
+    return ResilientLLM(anthropic.Anthropic(api_key='stub', base_url=server.base_url, max_retries=0),
+                        retry=RetryPolicy(max_attempts=1),
+                        limiter=AdaptiveConcurrencyLimiter(**{'initial': 8, **limiter}))
+
+
+def test_stub_rate_limit_headers_cap_concurrency():
+    from llm_stub_server import StubConfig, StubServer
+
+    request = dict(model='stub', max_tokens=64, messages=[{'role': 'user', 'content': 'Hello?'}])
+    with StubServer(StubConfig(ttft=0.0, tokens_per_sec=0, requests_limit=3)) as server:
+        llm = stub_llm(server)
+        assert llm.create(**request).content[0].text
+        # The stub reports limit - 1 requests left
+        assert llm.limiter.limit == 2
+
+        llm = stub_llm(server)
+        assert ''.join(llm.stream_text(**request))
+        assert llm.limiter.limit == 2
+
+
+def test_stub_429_with_no_requests_left_pauses_until_reset():
+    from llm_stub_server import StubConfig, StubServer
+
+    request = dict(model='stub', max_tokens=64, messages=[{'role': 'user', 'content': 'Hello?'}])
+    with StubServer(StubConfig(ttft=0.0, tokens_per_sec=0, fail_first=1, fail_status=429,
+                               retry_after=0.3)) as server:
+        llm = stub_llm(server)
+        with pytest.raises(Exception):
+            llm.create(**request)
+        assert not llm.limiter.acquire(timeout=0)
+        start = time.monotonic()
+        assert llm.create(**request).content[0].text
+        assert time.monotonic() - start > 0.1
@@ -0,0 +1,70 @@
+from types import SimpleNamespace
+
+from load_test import HeadlessHouse, HeadlessStreamlit, _percentile, load_questions, run_level
+
+
+def test_headless_streamlit_runs_a_script_without_a_ui():
+    st = HeadlessStreamlit()
+    calls = []
+
+    @st.cache_resource
+    def get_thing(name):
+        calls.append(name)
+        return object()
+
+    assert get_thing('a') is get_thing('a')
+    assert get_thing('a') is not get_thing('b')
+    get_thing.clear()
+    get_thing('a')
+    assert calls == ['a', 'b', 'a']
+
+    st.title("Your House Spirit")
+    with st.sidebar.expander("House Analytics"):
+        st.bar_chart({'count': {}})
+    col1, col2 = st.columns([1, 3])
+    with col1:
+        st.image("missing.jpg")
+    assert st.text_input("Your name:") == ''
+    assert st.selectbox("Room", ['Whole House', 'Kitchen']) == 'Whole House'
+    assert st.checkbox('Enable streaming responses', value=True) is True
+    assert st.button('Speak with Your House') is False
+    assert st.query_params.get('profile') is None
+
+
+def fake_app(updates):
+    return SimpleNamespace(ERROR_REPLY="Sorry: ",
+                           get_house_response_streaming=lambda resident, room, question: iter(updates))
+
+
+def test_ask_times_the_first_streamed_text():
+    house = HeadlessHouse(fake_app([{'chunk': '', 'done': False}, {'chunk': 'Hello', 'done': False},
+                                    {'chunk': '', 'done': True}]))
+    result = house.ask('Ann', 'Kitchen', 'Hi?')
+    assert result['error'] is None
+    assert 0 <= result['ttft'] <= result['latency']
+
+
+def test_ask_reports_the_apology_as_an_error():
+    house = HeadlessHouse(fake_app([{'chunk': 'Sorry: Overloaded', 'error': True, 'done': True}]))
+    result = house.ask('Ann', 'Kitchen', 'Hi?')
+    assert result == {'ttft': None, 'latency': result['latency'], 'error': 'Overloaded'}
+
+
+def test_run_level_aggregates_results():
+    class FakeHouse:
+        llm = SimpleNamespace(retries=0, limiter=SimpleNamespace(limit=4))
+
+        def ask(self, resident, room, question):
+            return {'ttft': 0.1, 'latency': 0.2, 'error': 'Overloaded' if room == 'Garden' else None}
+
+    row = run_level(FakeHouse(), [('Ann', 'Kitchen', 'Hi?'), ('Rob', 'Garden', 'Sow?')], 2, 0.05, 0.0)
+    assert row['requests'] > 0
+    assert row['ttft_p95'] == 0.1
+    assert 0 < row['error_rate'] < 1
+    assert set(row['errors']) == {'Overloaded'}
+
+
+def test_percentile_and_questions(tmp_path):
+    assert _percentile([], 95) == 0.0
+    assert _percentile([1, 2, 3, 4], 50) == 3
+    assert len(load_questions(str(tmp_path))) == 10
@@ -0,0 +1,97 @@
+import json
+from datetime import date
+
+import pytest
+
+pytest.importorskip('pyarrow', exc_type=ImportError)
+
+from log_archive import LogArchive, parse_history_markdown  # noqa: E402
+
+
+def write_day(logs_dir, history_dir, day, records):
+    with open(logs_dir / f"{day}_response_log.json", 'w', encoding='utf-8') as f:
+        json.dump(records, f)
+    with open(history_dir / f"{day}_conversation_history.md", 'w', encoding='utf-8') as f:
+        for record in records:
+            f.write(f"## Date: {day} | Time: {record['time']}\n\n"
+                    f"### Resident: {record['resident_name']} | Room: {record['room']}\n\n"
+                    f"**Question:** {record['question']}\n\n**House Spirit:** {record['response']}\n\n---\n\n")
+
+
+def record(resident, time, question='q?'):
+    return {'resident_name': resident, 'room': 'Kitchen', 'time': time, 'question': question,
+            'response': 'a.', 'unique_files': ['boiler.md'], 'chunk_info': ['boiler.md (chunk 1)']}
+
+
+@pytest.fixture
+def archive(tmp_path):
+    logs_dir, history_dir = tmp_path / 'logs', tmp_path / 'history'
+    logs_dir.mkdir()
+    history_dir.mkdir()
+    write_day(logs_dir, history_dir, '30-09-2024', [record('Rob', '09:00:00')])
+    write_day(logs_dir, history_dir, '01-10-2024', [record('Ann', '10:00:00'), record('Rob', '08:00:00')])
+    write_day(logs_dir, history_dir, '05-10-2024', [record('Rob', '11:00:00')])
+    return LogArchive(str(tmp_path / 'archive'), str(logs_dir), str(history_dir))
+
+
+def test_parse_history_markdown():
+    content = ("## Date: 01-10-2024 | Time: 10:00:00\n\n### Resident: Rob | Room: Hall\n\n"
+               "**Question:** Why?\n\n**House Spirit:** Because.\n\n---\n\n")
+    assert parse_history_markdown(content) == [{'date': '01-10-2024', 'time': '10:00:00', 'resident_name': 'Rob',
+                                                'room': 'Hall', 'question': 'Why?', 'response': 'Because.'}]
+
+
+def test_compact_round_trip_by_month(archive):
+    result = archive.compact(today=date(2024, 10, 5))
+    assert result['archived']['responses'] == ['30-09-2024', '01-10-2024']
+    # Today is still open
+    assert '05-10-2024' not in archive.archived_days()
+
+    october = archive.query(start=date(2024, 10, 1)).to_pylist()
+    assert [(row['resident_name'], row['time']) for row in october] == [('Rob', '08:00:00'), ('Ann', '10:00:00')]
+    assert october[0]['unique_files'] == ['boiler.md']
+
+    rows = archive.query('history', columns=['resident_name'], filters={'resident_name': 'Rob'}).to_pylist()
+    assert rows == [{'resident_name': 'Rob'}, {'resident_name': 'Rob'}]
+
+
+def test_compact_is_idempotent_and_retention_keeps_unarchived_days(archive):
+    archive.compact(today=date(2024, 10, 5))
+    again = archive.compact(today=date(2024, 10, 5), retention_days=3)
+    assert again['archived'] == {'responses': [], 'history': []}
+    assert again['deleted'] == ['01-10-2024_conversation_history.md', '01-10-2024_response_log.json',
+                                '30-09-2024_conversation_history.md', '30-09-2024_response_log.json']
+    assert len(archive.query()) == 3
+
+
+def test_query_empty_archive(archive):
+    assert archive.query(columns=['date', 'question']).num_rows == 0
+
+
+def test_usage_and_route_fields_round_trip(archive, tmp_path):
+    usage = {**record('Ann', '12:00:00'), 'model': 'claude-haiku-4-5', 'route_reason': 'simple question',
+             'complexity': 0.1, 'input_tokens': 120, 'output_tokens': 40, 'cost_usd': 0.00032,
+             'llm_call_id': 'abc123', 'error': False}
+    write_day(tmp_path / 'logs', tmp_path / 'history', '02-10-2024', [usage])
+    archive.compact(today=date(2024, 10, 5))
+
+    rows = archive.query(columns=['time', 'model', 'input_tokens', 'cost_usd', 'llm_call_id', 'error'],
+                         start=date(2024, 10, 2), end=date(2024, 10, 2)).to_pylist()
+    assert rows == [{'time': '12:00:00', 'model': 'claude-haiku-4-5', 'input_tokens': 120, 'cost_usd': 0.00032,
+                     'llm_call_id': 'abc123', 'error': False}]
+    # Records logged before usage accounting have nulls, not zeros
+    assert archive.query(columns=['input_tokens'], end=date(2024, 9, 30)).to_pylist() == [{'input_tokens': None}]
+
+
+def test_partitions_written_before_new_fields_stay_readable(archive, tmp_path):
+    import pyarrow.parquet as pq
+
+    archive.compact(today=date(2024, 10, 2))
+    path = tmp_path / 'archive' / 'responses' / 'month=2024-10' / 'data.parquet'
+    pq.write_table(pq.read_table(path).drop(['input_tokens', 'cost_usd']), path)
+
+    assert archive.query(columns=['resident_name', 'cost_usd']).to_pylist()[-1] == {'resident_name': 'Ann',
+                                                                                      'cost_usd': None}
+    # Appending another day to the old partition fills the missing columns with nulls
+    archive.compact(today=date(2024, 10, 6))
+    assert archive.query(columns=['input_tokens'], start=date(2024, 10, 1)).num_rows == 3
@@ -0,0 +1,119 @@
+import json
+import os
+import subprocess
+import sys
+import time
+import urllib.request
+
+import pytest
+
+from metrics import MetricsRegistry, MetricsServer, aggregate, exposition
+
+
+def write_worker(directory, registry, pid, written=None):
+    snapshot = registry.snapshot()
+    snapshot.update(pid=pid, written=written if written is not None else time.time())
+    (directory / f"{pid}.json").write_text(json.dumps(snapshot))
+
+
+def test_registration_is_get_or_create():
+    registry = MetricsRegistry()
+    counter = registry.counter('answers_total', "Answers", ['mode'])
+    assert registry.counter('answers_total', "Answers", ['mode']) is counter
+    with pytest.raises(ValueError):
+        registry.gauge('answers_total', "Answers")
+    with pytest.raises(ValueError):
+        counter.labels(room='kitchen')
+
+
+def test_workers_are_merged_by_metric_type(tmp_path):
+    first, second = MetricsRegistry(), MetricsRegistry()
+    for registry, chunks in ((first, 10), (second, 30)):
+        registry.counter('answers_total', "Answers", ['mode']).labels(mode='streaming').inc(2)
+        registry.gauge('index_chunks', "Chunks", mode='max').set(chunks)
+        registry.gauge('queue', "Queued", mode='sum').set(1)
+        registry.histogram('answer_seconds', "Latency", buckets=(1, 5)).observe(0.5)
+    second.histogram('answer_seconds', "Latency", buckets=(1, 5)).observe(7)
+    write_worker(tmp_path, first, 1)
+    write_worker(tmp_path, second, 2)
+
+    merged = {metric['name']: metric['series'] for metric in aggregate(str(tmp_path))}
+    assert merged['answers_total'] == {('streaming',): 4.0}
+    assert merged['index_chunks'] == {(): 30}
+    assert merged['queue'] == {(): 2}
+    assert merged['answer_seconds'][()] == {'counts': [2, 0, 1], 'sum': 8.0}
+
+
+def test_exited_workers_keep_counters_but_not_gauges(tmp_path):
+    registry = MetricsRegistry()
+    registry.counter('answers_total', "Answers").inc()
+    registry.gauge('index_chunks', "Chunks").set(5)
+    write_worker(tmp_path, registry, 1, written=time.time() - 3600)
+    names = {metric['name'] for metric in aggregate(str(tmp_path))}
+    assert names == {'answers_total'}
+
+
+def test_exposition_is_prometheus_text(tmp_path):
+    registry = MetricsRegistry()
+    registry.counter('answers_total', "Answers", ['mode']).labels(mode='a"b').inc()
+    registry.histogram('answer_seconds', "Latency", buckets=(1,)).observe(0.5)
+    write_worker(tmp_path, registry, 1)
+    text = exposition(aggregate(str(tmp_path)))
+    assert '# TYPE answers_total counter' in text
+    assert 'answers_total{mode="a\\"b"} 1.0' in text
+    assert 'answer_seconds_bucket{le="1.0"} 1' in text
+    assert 'answer_seconds_bucket{le="+Inf"} 1' in text
+    assert 'answer_seconds_count 1' in text
+
+
+def test_server_serves_the_merged_view(tmp_path):
+    registry = MetricsRegistry()
+    registry.counter('answers_total', "Answers").inc(3)
+    server = MetricsServer(str(tmp_path), port=0, registry=registry).start()
+    try:
+        port = server.httpd.server_address[1]
+        body = urllib.request.urlopen(f"http://127.0.0.1:{port}/metrics").read().decode('utf-8')
+        assert 'answers_total 3.0' in body
+    finally:
+        server.stop()
+
+
+def dead_pid():
+    process = subprocess.Popen([sys.executable, '-c', 'pass'])
+    process.wait()
+    return process.pid
+
+
+def test_a_restarted_worker_reusing_a_pid_gets_its_own_file(tmp_path):
+    before, after = MetricsRegistry(), MetricsRegistry()
+    before.counter('answers_total', "Answers").inc(5)
+    after.counter('answers_total', "Answers").inc(1)
+    before.write(str(tmp_path))
+    after.write(str(tmp_path))
+    assert before.instance != after.instance
+    assert before.instance.startswith(f"{os.getpid()}-")
+    merged = {metric['name']: metric['series'] for metric in aggregate(str(tmp_path))}
+    assert merged['answers_total'] == {(): 6.0}
+
+
+def test_exited_workers_are_folded_and_totals_never_go_backwards(tmp_path):
+    registry = MetricsRegistry()
+    registry.counter('answers_total', "Answers", ['mode']).labels(mode='streaming').inc(2)
+    registry.histogram('answer_seconds', "Latency", buckets=(1,)).observe(0.5)
+    registry.gauge('index_chunks', "Chunks").set(5)
+    write_worker(tmp_path, registry, dead_pid(), written=time.time() - 3600)
+    write_worker(tmp_path, registry, dead_pid(), written=time.time() - 3600)
+    old = time.time() - 3600
+    for path in tmp_path.iterdir():
+        os.utime(path, (old, old))
+    live = MetricsRegistry()
+    live.counter('answers_total', "Answers", ['mode']).labels(mode='streaming').inc(1)
+    live.write(str(tmp_path))
+
+    for _ in range(2):
+        merged = {metric['name']: metric['series'] for metric in aggregate(str(tmp_path))}
+        assert merged['answers_total'] == {('streaming',): 5.0}
+        assert merged['answer_seconds'][()] == {'counts': [2, 0], 'sum': 1.0}
+        assert 'index_chunks' not in merged
+    assert {path.name for path in tmp_path.iterdir() if path.suffix == '.json'} == {
+        '_exited.json', f"{live.instance}.json"}
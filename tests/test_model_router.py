@@ -0,0 +1,73 @@
+import random
+
+from model_router import ModelRouter, complexity_score
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def make_router(clock, probe_fraction=0.0, rng=None):
+    return ModelRouter('large', 'small', ttft_slo=2.0, sample_max_age=60.0,
+                       probe_fraction=probe_fraction, clock=clock, rng=rng)
+
+
+def test_complexity_score_orders_small_talk_below_open_questions():
+    assert complexity_score("Hello!") == 0.0
+    assert complexity_score("Why does the heating fail and how should we compare the two repair options?") > 0.3
+
+
+def test_route_by_complexity_length_and_context():
+    router = ModelRouter('large', 'small')
+    assert router.route("What needs attention?").model == 'small'
+    assert router.route("Explain why the boiler keeps failing and compare the options").model == 'large'
+    assert router.route("plain " * 61).model == 'large'
+    assert router.route("What needs attention?", context_chars=10000).model == 'large'
+    assert ModelRouter('large').route("Hello").reason == "single model configured"
+
+
+def test_slow_model_is_shifted_away_from():
+    clock = FakeClock()
+    router = make_router(clock)
+    router.record_ttft('small', 5.0)
+    decision = router.route("What needs attention?")
+    assert decision.model == 'large'
+    assert 'over 2.00s SLO' in decision.reason
+
+
+def test_stale_ttft_is_forgotten_so_traffic_returns():
+    clock = FakeClock()
+    router = make_router(clock)
+    router.record_ttft('small', 5.0)
+    assert router.route("What needs attention?").model == 'large'
+
+    clock.now = 61.0
+    assert router.observed_ttft('small') is None
+    assert router.route("What needs attention?").model == 'small'
+
+    # A fresh sample after expiry replaces the old average instead of blending with it
+    router.record_ttft('small', 0.5)
+    assert router.observed_ttft('small') == 0.5
+
+
+def test_recent_samples_blend_into_the_average():
+    clock = FakeClock()
+    router = make_router(clock)
+    router.record_ttft('small', 5.0)
+    clock.now = 10.0
+    router.record_ttft('small', 0.0)
+    assert router.observed_ttft('small') == 4.0
+
+
+def test_probe_share_still_reaches_the_slow_model():
+    clock = FakeClock()
+    router = make_router(clock, probe_fraction=0.2, rng=random.Random(7))
+    router.record_ttft('small', 5.0)
+    models = [router.route("What needs attention?").model for _ in range(500)]
+    probes = models.count('small')
+    assert 50 < probes < 150
+    assert any('probing small' in router.route("What needs attention?").reason for _ in range(100))
@@ -0,0 +1,44 @@
+import pytest
+
+from near_duplicates import DedupReport, NearDuplicateIndex, dedupe, shingles
+
+RECIPE = ("Mix two cups of flour with one cup of milk and two eggs, whisk until smooth, "
+          "rest the batter for ten minutes and fry in a hot buttered pan until golden on both sides")
+
+
+def test_shingles_ignore_case_and_punctuation():
+    assert list(shingles("One two three four five six")) == list(shingles("one, TWO three four five six!"))
+    assert len(shingles("too short")) == 1
+
+
+def test_near_duplicates_are_folded_into_the_first_copy():
+    chunks = [(RECIPE, 'recipes.md'), ("Bleed the radiators every autumn before the heating goes on", 'boiler.md'),
+              (RECIPE + ' Serve warm.', '01-01-2024_conversation_history.md'),
+              (RECIPE, '02-01-2024_conversation_history.md'),
+              (RECIPE, 'recipes.md')]
+    report = DedupReport()
+    kept = list(dedupe(chunks, report))
+    assert kept == chunks[:2]
+    assert report.sources == {0: ['01-01-2024_conversation_history.md', '02-01-2024_conversation_history.md',
+                                  'recipes.md']}
+    assert (report.total, report.kept, report.removed, report.clusters) == (5, 2, 3, 1)
+    assert report.shrinkage == pytest.approx(0.6)
+
+
+def test_threshold_zero_keeps_everything():
+    chunks = [(RECIPE, 'a.md'), (RECIPE, 'b.md')]
+    report = DedupReport()
+    assert list(dedupe(chunks, report, threshold=0)) == chunks
+    assert report.removed == 0
+
+
+def test_dissimilar_chunks_are_kept():
+    index = NearDuplicateIndex()
+    assert index.add(RECIPE) is None
+    assert index.add("The loft insulation was topped up to 270mm in 2019 by the previous owners") is None
+    assert index.add(RECIPE) == 0
+
+
+def test_bands_must_divide_the_signature():
+    with pytest.raises(ValueError):
+        NearDuplicateIndex(num_perm=64, bands=7)
@@ -0,0 +1,46 @@
+from render_scheduler import StreamRenderScheduler
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_coalesces_tokens_until_a_threshold():
+    clock = FakeClock()
+    renders = []
+    scheduler = StreamRenderScheduler(renders.append, flush_interval=0.1, flush_bytes=10, clock=clock)
+    for token in ['a', 'b', 'c']:
+        scheduler.add(token)
+    assert renders == []
+
+    clock.now = 0.2
+    scheduler.add('d')
+    assert renders == ['abcd']
+
+    scheduler.add('0123456789')
+    assert renders[-1] == 'abcd0123456789'
+
+
+def test_flush_escapes_and_sends_the_remainder_once():
+    clock = FakeClock()
+    renders = []
+    scheduler = StreamRenderScheduler(renders.append, clock=clock)
+    scheduler.add('<b>')
+    scheduler.add(' & ')
+    scheduler.flush()
+    scheduler.flush()
+    assert renders == ['&lt;b&gt; &amp; ']
+    assert scheduler.text == '<b> & '
+    assert scheduler.stats() == {'tokens': 2, 'updates_unthrottled': 2, 'updates': 1, 'characters': 6}
+
+
+def test_empty_stream_still_renders_once():
+    renders = []
+    scheduler = StreamRenderScheduler(renders.append, clock=FakeClock())
+    scheduler.add('')
+    scheduler.flush()
+    assert renders == ['']
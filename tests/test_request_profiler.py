@@ -0,0 +1,104 @@
+import cProfile
+import pstats
+import random
+import threading
+import time
+
+from request_profiler import NOT_PROFILED, RequestProfiler, active_profile, list_profiles
+from single_flight import SingleFlight
+
+
+def busy_upstream():
+    deadline = time.perf_counter() + 0.1
+    while time.perf_counter() < deadline:
+        sum(range(1000))
+    yield {'chunk': 'done', 'done': True}
+
+
+def test_unselected_requests_get_the_shared_no_op():
+    profiler = RequestProfiler(sample_percent=0)
+    assert profiler.profile('r1') is NOT_PROFILED
+    assert active_profile() is NOT_PROFILED
+    updates = iter([1, 2])
+    assert NOT_PROFILED.follow(updates) is updates
+
+    sampled = RequestProfiler(sample_percent=50, rng=random.Random(1))
+    chosen = sum(sampled.profile(str(i)) is not NOT_PROFILED for i in range(200))
+    assert 70 < chosen < 130
+
+
+def test_profile_follows_the_single_flight_upstream_thread(tmp_path):
+    profiler = RequestProfiler(str(tmp_path), interval=0.001)
+    with profiler.profile('req-1', force=True) as profile:
+        assert active_profile() is profile
+        following = active_profile()
+        updates = list(SingleFlight().stream('key', lambda: following.follow(busy_upstream())))
+    assert updates == [{'chunk': 'done', 'done': True}]
+    assert active_profile() is NOT_PROFILED
+
+    stats = pstats.Stats(str(tmp_path / 'req-1.pstats'))
+    assert any(name == 'busy_upstream' for _, _, name in stats.stats)
+    collapsed = (tmp_path / 'req-1.collapsed').read_text()
+    assert 'upstream;' in collapsed and 'busy_upstream' in collapsed
+    assert [p['request_id'] for p in list_profiles(str(tmp_path))] == ['req-1']
+
+
+def test_attach_on_the_owning_thread_is_a_no_op(tmp_path):
+    with RequestProfiler(str(tmp_path)).profile('req-2', force=True) as profile:
+        with profile.attach():
+            sum(range(10))
+    assert (tmp_path / 'req-2.pstats').exists()
+
+
+def test_exit_waits_for_attached_threads(tmp_path):
+    finished = []
+    with RequestProfiler(str(tmp_path)).profile('req-3', force=True) as profile:
+        def work():
+            with profile.attach():
+                time.sleep(0.05)
+                finished.append(True)
+        threading.Thread(target=work).start()
+        time.sleep(0.01)
+    assert finished == [True]
+
+
+class OneAtATimeProfile(cProfile.Profile):
+    """cProfile as on Python 3.12+, where only one profiler may be enabled per process."""
+
+    active = None
+
+    def enable(self, *args, **kwargs):
+        if OneAtATimeProfile.active is not None:
+            raise ValueError("Another profiling tool is already active")
+        OneAtATimeProfile.active = self
+        super().enable(*args, **kwargs)
+
+    def disable(self):
+        super().disable()
+        if OneAtATimeProfile.active is self:
+            OneAtATimeProfile.active = None
+
+
+def test_overlapping_profiles_both_answer(tmp_path, monkeypatch):
+    monkeypatch.setattr(cProfile, 'Profile', OneAtATimeProfile)
+    profiler = RequestProfiler(str(tmp_path), interval=0.001)
+    first_entered, second_done = threading.Event(), threading.Event()
+
+    def first():
+        with profiler.profile('first', force=True):
+            first_entered.set()
+            second_done.wait(5)
+
+    thread = threading.Thread(target=first)
+    thread.start()
+    first_entered.wait(5)
+    with profiler.profile('second', force=True) as second:
+        time.sleep(0.02)
+    second_done.set()
+    thread.join()
+
+    # The second request falls back to stack samples only
+    assert second.paths == [str(tmp_path / 'second.collapsed')]
+    assert (tmp_path / 'first.pstats').exists()
+    profiles = {p['request_id']: p['seconds'] for p in list_profiles(str(tmp_path))}
+    assert profiles['second'] is None and profiles['first'] is not None
@@ -0,0 +1,81 @@
+import multiprocessing
+
+from resident_memory import ResidentMemory, summarize_turn
+
+
+def record_many(memory_dir, count):
+    memory = ResidentMemory(memory_dir, recent_turns=2)
+    for n in range(count):
+        memory.record('Rob', 'Kitchen', f"Question {n}?", "Answer.")
+
+
+def test_recent_turns_are_verbatim_and_older_ones_summarised(tmp_path):
+    memory = ResidentMemory(str(tmp_path), recent_turns=2, summary_chars=1000)
+    for n in range(4):
+        memory.record('Rob', 'Kitchen', f"Question {n}?", f"Answer {n}. More detail.")
+
+    messages = memory.build_messages('Rob', 'New question')
+    assert [m['role'] for m in messages] == ['user', 'assistant', 'user', 'assistant', 'user']
+    assert messages[-1]['content'] == 'New question'
+    assert messages[0]['content'].startswith("What I remember of our earlier conversations:")
+    assert 'Question 0?' in messages[0]['content'] and 'Question 2?' in messages[0]['content']
+    assert messages[1]['content'] == 'Answer 2. More detail.'
+
+
+def test_summary_stays_within_budget(tmp_path):
+    memory = ResidentMemory(str(tmp_path), recent_turns=1, summary_chars=300)
+    for n in range(20):
+        memory.record('Rob', 'Garden', f"Question {n}?", "Answer.")
+    state = memory._load('Rob')
+    assert sum(len(line) for line in state['summary']) <= 300
+    assert state['turn_count'] == 20
+
+
+def test_memory_persists_and_is_per_resident(tmp_path):
+    ResidentMemory(str(tmp_path)).record('Rob', 'Kitchen', 'Rob asks?', 'For Rob.')
+    memory = ResidentMemory(str(tmp_path))
+    assert len(memory.build_messages('Rob', 'again')) == 3
+    assert memory.build_messages('Ann', 'hello') == [{'role': 'user', 'content': 'hello'}]
+
+
+def test_seed_backfills_new_residents_once(tmp_path):
+    calls = []
+
+    def seed(resident):
+        calls.append(resident)
+        return [{'date': '01-01-2024 10:00', 'room': 'Hall', 'question': 'Old?', 'response': 'Old answer.'}]
+
+    memory = ResidentMemory(str(tmp_path), seed=seed)
+    assert memory.build_messages('Rob', 'now')[0]['content'] == 'Old?'
+    memory.build_messages('Rob', 'again')
+    assert calls == ['Rob']
+
+
+def test_summarize_turn_keeps_the_first_sentence():
+    line = summarize_turn({'date': 'd', 'room': 'Hall', 'question': 'Why?', 'response': 'Because. And more.'})
+    assert line == 'd (Hall): asked "Why?" - I said: Because.'
+
+
+def test_workers_do_not_overwrite_each_other(tmp_path):
+    first, second = ResidentMemory(str(tmp_path)), ResidentMemory(str(tmp_path))
+    first.build_messages('Rob', 'warm the cache')
+    second.record('Rob', 'Kitchen', 'From the second worker?', 'Yes.')
+    first.record('Rob', 'Kitchen', 'From the first worker?', 'Also yes.')
+    assert [m['content'] for m in second.build_messages('Rob', 'now')][:-1] == [
+        'From the second worker?', 'Yes.', 'From the first worker?', 'Also yes.']
+
+
+def test_concurrent_processes_lose_no_turns(tmp_path):
+    processes = [multiprocessing.Process(target=record_many, args=(str(tmp_path), 10)) for _ in range(4)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    assert ResidentMemory(str(tmp_path))._load('Rob')['turn_count'] == 40
+
+
+def test_empty_responses_are_not_remembered(tmp_path):
+    memory = ResidentMemory(str(tmp_path), seed=lambda resident: [
+        {'date': 'd', 'room': 'Hall', 'question': 'Logged without an answer?', 'response': ''}])
+    memory.record('Rob', 'Kitchen', 'Interrupted?', '  ')
+    assert memory.build_messages('Rob', 'hello') == [{'role': 'user', 'content': 'hello'}]
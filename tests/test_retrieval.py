@@ -0,0 +1,138 @@
+from datetime import date
+
+import numpy as np
+import pytest
+
+from retrieval import (ChunkMetadata, MetadataIndex, RecencyPolicy, RetrievalFilters, describe_chunk,
+                       infer_rooms, mmr_select, normalize_room, search)
+
+
+def unit(rows):
+    rows = np.asarray(rows, dtype=np.float32)
+    return rows / np.linalg.norm(rows, axis=1, keepdims=True)
+
+
+@pytest.fixture
+def index():
+    return MetadataIndex([
+        ChunkMetadata('documents', 'boiler.md'),
+        ChunkMetadata('documents', 'recipes.md', rooms=('kitchen',)),
+        ChunkMetadata('history', '01-01-2024_conversation_history.md', rooms=('garden',),
+                      date=date(2024, 1, 1), resident='Rob'),
+        ChunkMetadata('history', '01-06-2024_conversation_history.md', rooms=('kitchen',),
+                      date=date(2024, 6, 1), resident='Ann'),
+    ])
+
+
+def test_normalize_room_maps_ui_names():
+    assert normalize_room('Living Room') == 'living_room'
+    assert normalize_room('bedrooms') == 'bedroom'
+    assert normalize_room('Whole House') is None
+
+
+def test_describe_chunk_reads_history_headers():
+    text = "## Date: 02-03-2024 | Time: 10:00\n\n### Resident: Rob | Room: Garden\n\nWhen to sow?"
+    meta = describe_chunk(text, '02-03-2024_conversation_history.md', 'history')
+    assert (meta.date, meta.resident) == (date(2024, 3, 2), 'Rob')
+    assert 'garden' in meta.rooms
+    assert infer_rooms("Knead the sourdough") == ('kitchen',)
+
+
+def test_filters_or_within_a_field_and_across_fields(index):
+    assert index.mask(None) is None
+    assert index.mask(RetrievalFilters()) is None
+    # A room keeps its tagged chunks and the untagged, general ones
+    assert list(index.candidates(RetrievalFilters(room='Kitchen'))) == [0, 1, 3]
+    assert list(index.candidates(RetrievalFilters(residents=['Rob', 'Ann']))) == [2, 3]
+    assert list(index.candidates(RetrievalFilters(room='kitchen', residents=['Rob', 'Ann']))) == [3]
+    assert list(index.candidates(RetrievalFilters(date_from=date(2024, 3, 1)))) == [3]
+
+
+def test_filters_matching_nothing_return_no_chunks(index):
+    embeddings = unit(np.eye(4))
+    candidates = index.candidates(RetrievalFilters(residents=['Nobody']))
+    assert len(candidates) == 0
+    indices, scores = search(embeddings[:1], embeddings, 3, candidates)
+    assert len(indices) == 0 and len(scores) == 0
+
+
+def test_search_scores_only_candidates_best_first():
+    embeddings = unit([[1, 0], [0.9, 0.1], [0, 1], [0.7, 0.7]])
+    indices, scores = search(unit([[1, 0]]), embeddings, 2)
+    assert list(indices) == [0, 1]
+    assert scores[0] >= scores[1]
+    indices, _ = search(unit([[1, 0]]), embeddings, 2, np.array([2, 3]))
+    assert list(indices) == [3, 2]
+
+
+def test_recency_weights_halve_the_decayable_part_per_half_life():
+    policy = RecencyPolicy(half_life_days=10, floor=0.5)
+    today = date(2024, 1, 21)
+    ordinals = np.array([0, today.toordinal(), today.toordinal() - 10, today.toordinal() - 10 ** 4])
+    assert np.allclose(policy.weights(ordinals, today), [1.0, 1.0, 0.75, 0.5], atol=1e-4)
+
+
+def test_recency_cutoff_drops_old_history_but_keeps_documents(index):
+    policy = RecencyPolicy(max_age_days=30)
+    today = date(2024, 6, 15)
+    assert list(index.candidates(None, policy, today)) == [0, 1, 3]
+    assert list(index.candidates(RetrievalFilters(residents=['Rob']), policy, today)) == []
+    assert RecencyPolicy().cutoff(today) is None
+
+
+def test_recency_decay_can_reorder_results(index):
+    embeddings = unit([[0, 1], [0, 1], [1, 0.05], [1, 0.1]])
+    today = date(2024, 6, 1)
+    indices, _ = search(unit([[1, 0]]), embeddings, 1)
+    assert list(indices) == [2]
+    indices, _ = search(unit([[1, 0]]), embeddings, 1, None, index, RecencyPolicy(half_life_days=30), today)
+    assert list(indices) == [3]
+
+
+def test_postings_are_sparse_index_arrays(index):
+    assert list(index.postings['room']['kitchen']) == [1, 3]
+    assert index.postings['room']['kitchen'].dtype == np.int32
+    assert list(index.untagged) == [0]
+    assert list(index.date_ordinals) == [0, 0, date(2024, 1, 1).toordinal(), date(2024, 6, 1).toordinal()]
+
+
+def naive_mmr(relevance, embeddings, k, lambda_mult):
+    vectors = unit(embeddings)
+    picked = []
+    while len(picked) < min(k, len(relevance)):
+        best, best_score = None, -np.inf
+        for i in range(len(relevance)):
+            if i in picked:
+                continue
+            redundancy = max((float(vectors[i] @ vectors[j]) for j in picked), default=0.0)
+            score = lambda_mult * relevance[i] - (1 - lambda_mult) * redundancy
+            if score > best_score:
+                best, best_score = i, score
+        picked.append(best)
+    return picked
+
+
+def test_mmr_matches_the_textbook_loop():
+    rng = np.random.default_rng(3)
+    embeddings = rng.standard_normal((40, 16))
+    relevance = rng.random(40)
+    for lambda_mult in (0.0, 0.3, 0.7, 1.0):
+        assert list(mmr_select(relevance, embeddings, 5, lambda_mult)) == \
+            naive_mmr(relevance, embeddings, 5, lambda_mult)
+    assert len(mmr_select(np.array([]), np.zeros((0, 16)), 3)) == 0
+
+
+def test_search_with_mmr_skips_overlapping_chunks():
+    # Chunks 0 and 1 are the same passage; 2 is less relevant but different
+    embeddings = unit([[1, 0.05, 0], [1, 0.06, 0], [0.7, 0, 0.7], [0, 1, 0]])
+    query = unit([[1, 0, 0.1]])
+    assert list(search(query, embeddings, 2)[0]) == [0, 1]
+    indices, scores = search(query, embeddings, 2, mmr_lambda=0.5)
+    assert list(indices) == [0, 2]
+    assert scores[0] > scores[1]
+    # Picks are reported as corpus indices when a candidate subset is searched
+    assert list(search(query, embeddings, 2, np.array([1, 2, 3]), mmr_lambda=0.5)[0]) == [1, 2]
+    # Results come in pick order: the near-duplicate is picked last although it scores higher
+    indices, scores = search(query, embeddings, 3, mmr_lambda=0.5)
+    assert list(indices) == [0, 2, 1]
+    assert scores[2] > scores[1]
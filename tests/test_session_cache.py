@@ -0,0 +1,44 @@
+from session_cache import LogGeneration, SessionCache
+
+
+def test_history_is_loaded_once_until_the_logs_change():
+    generation = LogGeneration()
+    lookups = []
+    cache = SessionCache({}, generation, on_lookup=lookups.append)
+    loads = []
+
+    def load():
+        loads.append(1)
+        return [{'question': 'hi'}]
+
+    assert cache.history('Ann', load) == [{'question': 'hi'}]
+    assert cache.history('Ann', load) == [{'question': 'hi'}]
+    assert len(loads) == 1
+    assert lookups == ['miss', 'hit']
+
+    generation.bump()
+    cache.history('Ann', load)
+    assert len(loads) == 2
+    assert cache.stats()['invalidations'] == 1
+
+
+def test_state_survives_reruns_and_answers_survive_log_writes():
+    state, generation = {}, LogGeneration()
+    SessionCache(state, generation, max_answers=2).remember_answer('Ann', {'question': 'a'})
+    generation.bump()
+    cache = SessionCache(state, generation, max_answers=2)
+    cache.remember_answer('Ann', {'question': 'b'})
+    cache.remember_answer('Ann', {'question': 'c'})
+    assert [a['question'] for a in cache.recent_answers('Ann')] == ['b', 'c']
+    assert cache.last_answer('Ann') == {'question': 'c'}
+    assert cache.last_answer('Bob') is None
+
+
+def test_disabled_cache_always_loads():
+    cache = SessionCache({}, LogGeneration(), enabled=False)
+    calls = []
+    cache.history('Ann', lambda: calls.append(1) or [])
+    cache.history('Ann', lambda: calls.append(1) or [])
+    cache.remember_answer('Ann', {'question': 'a'})
+    assert len(calls) == 2
+    assert cache.recent_answers('Ann') == []
@@ -0,0 +1,59 @@
+import json
+import os
+
+import pytest
+
+from index_snapshot import SnapshotError, write_snapshot
+from retrieval import ChunkMetadata
+from shared_index import CURRENT_FILE, GENERATION_FILE, SharedIndex, SharedIndexPublisher, read_current
+
+
+def publish(shared_dir, encoder, generation, texts):
+    filename = GENERATION_FILE.format(generation)
+    chunks = [(text, 'notes.md') for text in texts]
+    write_snapshot(os.path.join(shared_dir, filename), chunks, [ChunkMetadata('documents', 'notes.md')] * len(chunks),
+                   encoder.encode(texts), encoder.model_name, encoder.backend)
+    with open(os.path.join(shared_dir, CURRENT_FILE), 'w', encoding='utf-8') as f:
+        json.dump({'generation': generation, 'file': filename}, f)
+
+
+def test_workers_remap_when_a_new_generation_is_published(tmp_path, encoder):
+    shared_dir = str(tmp_path)
+    index = SharedIndex(shared_dir, check_interval=0)
+    assert index.get() is None
+
+    publish(shared_dir, encoder, 1, ['first'])
+    old = index.get()
+    assert index.generation == 1 and len(old.chunks) == 1
+
+    publish(shared_dir, encoder, 2, ['first', 'second'])
+    assert len(index.get().chunks) == 2
+    # A request still holding the old generation keeps a working mapping
+    assert old.chunks.text(0) == 'first'
+
+
+def test_rejected_generation_keeps_the_previous_one(tmp_path, encoder):
+    shared_dir = str(tmp_path)
+
+    def validate(snapshot):
+        if len(snapshot.chunks) > 1:
+            raise SnapshotError("wrong model")
+
+    index = SharedIndex(shared_dir, check_interval=0, validate=validate)
+    publish(shared_dir, encoder, 1, ['first'])
+    index.get()
+    publish(shared_dir, encoder, 2, ['first', 'second'])
+    assert len(index.get().chunks) == 1
+    assert index.generation == 1
+
+    fresh = SharedIndex(shared_dir, check_interval=0, validate=validate)
+    with pytest.raises(SnapshotError):
+        fresh.get()
+
+
+def test_prune_keeps_recent_generations(tmp_path):
+    for generation in range(1, 6):
+        (tmp_path / GENERATION_FILE.format(generation)).write_bytes(b'')
+    SharedIndexPublisher(str(tmp_path), keep=2)._prune(5)
+    assert sorted(os.listdir(tmp_path)) == [GENERATION_FILE.format(4), GENERATION_FILE.format(5)]
+    assert read_current(str(tmp_path)) is None
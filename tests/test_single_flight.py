@@ -0,0 +1,56 @@
+import threading
+
+from single_flight import SingleFlight, request_key
+
+
+def gated_producer(gate, calls, updates):
+    def producer():
+        calls.append(1)
+        yield updates[0]
+        gate.wait(5)
+        yield from updates[1:]
+    return producer
+
+
+def test_concurrent_requests_share_one_upstream():
+    flight = SingleFlight()
+    gate = threading.Event()
+    calls = []
+    updates = [{'chunk': 'a', 'done': False}, {'chunk': 'b', 'done': False}, {'chunk': '', 'done': True}]
+
+    leader = flight.stream('k', gated_producer(gate, calls, updates))
+    assert next(leader) == updates[0]
+    # A late joiner gets the replayed prefix, then the live tail
+    joiner = flight.stream('k', gated_producer(gate, calls, updates))
+    assert next(joiner) == updates[0]
+    gate.set()
+    assert list(leader) == updates[1:]
+    assert list(joiner) == updates[1:]
+    assert calls == [1]
+    assert (flight.started, flight.joined, flight.in_flight()) == (1, 1, 0)
+
+
+def test_finished_flights_are_not_reused():
+    flight = SingleFlight()
+    calls = []
+    for _ in range(2):
+        assert list(flight.stream('k', lambda: (calls.append(1), iter([{'done': True}]))[1])) == [{'done': True}]
+    assert len(calls) == 2
+
+
+def test_upstream_error_becomes_the_final_update():
+    flight = SingleFlight(error_update=lambda e: {'error': f"failed: {e}", 'done': True})
+
+    def producer():
+        yield {'chunk': 'a', 'done': False}
+        raise RuntimeError('boom')
+
+    assert list(flight.stream('k', producer)) == [{'chunk': 'a', 'done': False},
+                                                  {'error': 'failed: boom', 'done': True}]
+
+
+def test_request_key_never_coalesces_different_residents():
+    assert request_key('Rob', 'Kitchen', 'How do  I make PANCAKES?') == request_key('Rob ', 'Kitchen',
+                                                                                    'how do i make pancakes?')
+    assert request_key('Rob', 'Kitchen', 'Pancakes?') != request_key('Ann', 'Kitchen', 'Pancakes?')
+    assert request_key('Rob', 'Kitchen', 'Pancakes?') != request_key('Rob', 'Garden', 'Pancakes?')
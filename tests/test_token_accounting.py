@@ -0,0 +1,117 @@
+import json
+import multiprocessing
+from datetime import date
+from types import SimpleNamespace
+
+import pytest
+
+from token_accounting import PromptBudget, PromptTooLargeError, UsageLedger, usage_fields
+
+
+def usage(call_id, input_tokens=100, cost=0.001):
+    return {'input_tokens': input_tokens, 'output_tokens': 10, 'cache_read_input_tokens': 0,
+            'cache_creation_input_tokens': 0, 'cost_usd': cost, 'llm_call_id': call_id}
+
+
+def log_record(resident, call_id, day='01-10-2024', **fields):
+    return {'resident_name': resident, 'room': 'Kitchen', 'date': day, 'time': '10:00:00', 'question': 'q?',
+            'response': 'a.', 'unique_files': [], 'chunk_info': [], **usage(call_id), **fields}
+
+
+def write_log(logs_dir, day, records):
+    with open(logs_dir / f"{day}_response_log.json", 'w', encoding='utf-8') as f:
+        json.dump(records, f)
+
+
+def record_many(logs_dir, resident, count):
+    ledger = UsageLedger(logs_dir)
+    for n in range(count):
+        ledger.record(resident, 'Kitchen', '01-10-2024', usage(f"{resident}-{n}"))
+
+
+def test_usage_fields_prices_cache_tokens():
+    message = SimpleNamespace(usage=SimpleNamespace(input_tokens=1000, output_tokens=200,
+                                                    cache_read_input_tokens=10000,
+                                                    cache_creation_input_tokens=None))
+    fields = usage_fields(message, 'claude-haiku-4-5-20251001')
+    assert fields['cache_creation_input_tokens'] == 0
+    # 1000 * $1 + 10000 * $1 * 0.1 + 200 * $5, per million
+    assert fields['cost_usd'] == pytest.approx(0.003)
+    assert usage_fields(message, 'some-other-model')['cost_usd'] is None
+
+
+def test_prompt_budget_trims_the_last_chunks_or_refuses():
+    def build(chunks):
+        return [{'role': 'user', 'content': ' '.join(chunks) + ' question'}]
+
+    chunks = ['x' * 350, 'y' * 350, 'z' * 350]
+    messages, kept, estimate = PromptBudget(max_input_tokens=250).fit('', build, chunks)
+    assert kept == 2 and estimate <= 250
+    assert 'z' not in messages[0]['content']
+
+    with pytest.raises(PromptTooLargeError):
+        PromptBudget(max_input_tokens=250, overflow='refuse').fit('', build, chunks)
+    with pytest.raises(PromptTooLargeError):
+        PromptBudget(max_input_tokens=1).fit('system prompt', build, chunks)
+
+
+def test_record_groups_totals_by_resident_room_and_day(tmp_path):
+    ledger = UsageLedger(str(tmp_path))
+    ledger.record('Rob', 'Kitchen', '01-10-2024', usage('a'))
+    ledger.record('Ann', 'Hall', '01-10-2024', usage('b', input_tokens=50))
+    assert ledger.totals()['input_tokens'] == 150
+    assert ledger.totals('residents')['Ann']['requests'] == 1
+    assert ledger.totals('days')['01-10-2024']['cost_usd'] == pytest.approx(0.002)
+
+
+def test_workers_do_not_overwrite_each_other(tmp_path):
+    first = UsageLedger(str(tmp_path))
+    second = UsageLedger(str(tmp_path))
+    first.record('Rob', 'Kitchen', '01-10-2024', usage('a'))
+    second.record('Ann', 'Kitchen', '01-10-2024', usage('b'))
+    first.record('Rob', 'Kitchen', '01-10-2024', usage('c'))
+    # Readers pick up the other worker's writes
+    assert second.totals()['requests'] == 3
+    assert sorted(UsageLedger(str(tmp_path)).totals('residents')) == ['Ann', 'Rob']
+
+
+def test_concurrent_processes_lose_no_updates(tmp_path):
+    processes = [multiprocessing.Process(target=record_many, args=(str(tmp_path), f"r{n}", 25))
+                 for n in range(4)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    assert UsageLedger(str(tmp_path)).totals()['requests'] == 100
+
+
+def test_rebuild_counts_a_shared_answer_once(tmp_path):
+    write_log(tmp_path, '01-10-2024', [log_record('Rob', 'shared'), log_record('Ann', 'shared'),
+                                       log_record('Ann', 'own'),
+                                       {'resident_name': 'Old', 'room': 'Hall', 'question': 'q?'}])
+    ledger = UsageLedger(str(tmp_path))
+    assert ledger.rebuild(str(tmp_path), archive_dir=None) == 2
+    assert ledger.totals('residents')['Rob']['requests'] == 1
+    assert 'Old' not in ledger.totals('residents')
+
+
+def test_rebuild_reads_days_only_left_in_the_archive(tmp_path):
+    pytest.importorskip('pyarrow', exc_type=ImportError)
+    from log_archive import LogArchive
+
+    logs_dir = tmp_path / 'logs'
+    logs_dir.mkdir()
+    write_log(logs_dir, '30-09-2024', [log_record('Rob', 'old', day='30-09-2024')])
+    write_log(logs_dir, '01-10-2024', [log_record('Ann', 'kept', input_tokens=7)])
+    archive_dir = tmp_path / 'archive'
+    archive = LogArchive(str(archive_dir), str(logs_dir), str(tmp_path / 'history'))
+    archive.compact(today=date(2024, 10, 2))
+    # 30-09 is archived and its raw log deleted; 01-10 is archived and still raw
+    (logs_dir / '30-09-2024_response_log.json').unlink()
+
+    ledger = UsageLedger(str(logs_dir))
+    assert ledger.rebuild(str(logs_dir), str(archive_dir)) == 2
+    assert sorted(ledger.totals('days')) == ['01-10-2024', '30-09-2024']
+    assert ledger.totals('days')['30-09-2024']['input_tokens'] == 100
+    assert ledger.totals('days')['01-10-2024']['input_tokens'] == 7
+    assert ledger.totals()['requests'] == 2
@@ -0,0 +1,283 @@
+"""
+Token usage and cost accounting, plus a pre-flight prompt budget.
+
+Every Claude response carries ``usage`` (input, output and prompt-cache
+tokens). For streams it arrives with the final message, which
+``ResilientLLM.stream_text`` passes to ``on_complete``. ``usage_fields``
+turns it into log fields, with a cost from ``MODEL_PRICES``.
+``UsageLedger`` keeps running totals per resident, room and day in
+``logs/usage.json``, the way ``conversation_analytics.py`` keeps patterns:
+each record reloads and merges the file under a cross-process lock, and
+``rebuild`` recounts from the raw logs plus the Parquet archive.
+
+``PromptBudget`` estimates a prompt's input tokens before it is sent.
+Prompts over ``max_input_tokens`` either have their lowest-ranked context
+chunks dropped until they fit (``trim``) or are refused (``refuse``).
+
+    python token_accounting.py rebuild           # backfill from logs/ and archive/
+    python token_accounting.py report --by day
+"""
+import os
+import sys
+import json
+import math
+import argparse
+import threading
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+from conversation_analytics import file_lock, iter_log_records
+
+script_dir = os.path.dirname(os.path.abspath(__file__))
+default_logs_dir = os.path.join(script_dir, 'logs')
+default_archive_dir = os.path.join(script_dir, 'archive')
+USAGE_FILE = 'usage.json'
+
+# USD per million tokens (input, output), matched on the longest model name prefix
+MODEL_PRICES = {
+    'claude-opus-4-5': (5.0, 25.0),
+    'claude-opus-4': (15.0, 75.0),
+    'claude-sonnet-4': (3.0, 15.0),
+    'claude-3-7-sonnet': (3.0, 15.0),
+    'claude-3-5-sonnet': (3.0, 15.0),
+    'claude-haiku-4-5': (1.0, 5.0),
+    'claude-3-5-haiku': (0.8, 4.0),
+    'claude-3-haiku': (0.25, 1.25),
+}
+# Prompt-cache reads and writes relative to the input price
+CACHE_READ_FACTOR = 0.1
+CACHE_WRITE_FACTOR = 1.25
+# Rough English average for Claude's tokenizer; errs towards overestimating
+CHARS_PER_TOKEN = 3.5
+
+TOKEN_FIELDS = ('input_tokens', 'output_tokens', 'cache_read_input_tokens', 'cache_creation_input_tokens')
+GROUPS = ('residents', 'rooms', 'days')
+
+
+class PromptTooLargeError(ValueError):
+    """The prompt is over budget and cannot be trimmed to fit."""
+
+
+def model_price(model: str, prices: Optional[Dict[str, Tuple[float, float]]] = None) -> Optional[Tuple[float, float]]:
+    """(input, output) USD per million tokens for a model, or None if unknown."""
+    prices = prices or MODEL_PRICES
+    matches = [prefix for prefix in prices if model.startswith(prefix)]
+    return prices[max(matches, key=len)] if matches else None
+
+
+def usage_fields(message, model: str, prices: Optional[Dict[str, Tuple[float, float]]] = None) -> Dict:
+    """
+    Token counts and cost of one response, as flat log fields.
+
+    Args:
+        message: An Anthropic ``Message`` (or anything with a ``usage`` attribute)
+
+    Returns:
+        dict: input/output/cache token counts and ``cost_usd`` (None for unknown models)
+    """
+    usage = getattr(message, 'usage', None)
+    fields = {name: int(getattr(usage, name, 0) or 0) for name in TOKEN_FIELDS}
+    price = model_price(model, prices)
+    if price is None:
+        fields['cost_usd'] = None
+    else:
+        input_price, output_price = price
+        fields['cost_usd'] = round((
+            fields['input_tokens'] * input_price
+            + fields['cache_read_input_tokens'] * input_price * CACHE_READ_FACTOR
+            + fields['cache_creation_input_tokens'] * input_price * CACHE_WRITE_FACTOR
+            + fields['output_tokens'] * output_price
+        ) / 1e6, 6)
+    return fields
+
+
+def estimate_tokens(text: str) -> int:
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def estimate_prompt_tokens(system: str, messages: List[Dict]) -> int:
+    """Estimated input tokens of a request, including a few per message for framing."""
+    return estimate_tokens(system) + sum(estimate_tokens(m['content']) + 4 for m in messages)
+
+
+class PromptBudget:
+    def __init__(self, max_input_tokens: int = 20000, overflow: str = 'trim'):
+        """
+        Args:
+            max_input_tokens (int): Estimated input tokens allowed per request; 0 for no limit
+            overflow (str): 'trim' drops the lowest-ranked context chunks, 'refuse' rejects the prompt
+        """
+        if overflow not in ('trim', 'refuse'):
+            raise ValueError("overflow must be 'trim' or 'refuse'")
+        self.max_input_tokens = max_input_tokens
+        self.overflow = overflow
+
+    def fit(self, system: str, build_messages: Callable[[Sequence[str]], List[Dict]],
+            context_chunks: Sequence[str]) -> Tuple[List[Dict], int, int]:
+        """
+        Build the messages, dropping context chunks from the end until they fit.
+
+        Trimming follows the order of ``context_chunks``, not their scores: with
+        MMR retrieval the chunk dropped first is the last MMR pick, which may
+        score higher than chunks picked before it.
+
+        Args:
+            build_messages: Builds the messages from a list of context chunks
+            context_chunks: Retrieved chunks in retrieval (MMR pick) order
+
+        Returns:
+            tuple: (messages, number of chunks kept, estimated input tokens)
+
+        Raises:
+            PromptTooLargeError: If refusing, or if even no context is over budget
+        """
+        kept = len(context_chunks)
+        messages = build_messages(context_chunks)
+        estimate = estimate_prompt_tokens(system, messages)
+        if not self.max_input_tokens or estimate <= self.max_input_tokens:
+            return messages, kept, estimate
+        if self.overflow == 'refuse':
+            raise PromptTooLargeError(f"The prompt is about {estimate} tokens, over the "
+                                      f"{self.max_input_tokens} token limit")
+        while kept and estimate > self.max_input_tokens:
+            kept -= 1
+            messages = build_messages(context_chunks[:kept])
+            estimate = estimate_prompt_tokens(system, messages)
+        if estimate > self.max_input_tokens:
+            raise PromptTooLargeError(f"The prompt is about {estimate} tokens without any context, "
+                                      f"over the {self.max_input_tokens} token limit")
+        return messages, kept, estimate
+
+
+def _empty_totals() -> Dict:
+    return {'requests': 0, **{name: 0 for name in TOKEN_FIELDS}, 'cost_usd': 0.0}
+
+
+class UsageLedger:
+    def __init__(self, logs_dir: str = default_logs_dir):
+        self.path = os.path.join(logs_dir, USAGE_FILE)
+        self._lock = threading.Lock()
+        self._mtime = None
+        self._state = self._read()
+
+    def _read(self) -> Dict:
+        try:
+            self._mtime = os.stat(self.path).st_mtime_ns
+            with open(self.path, 'r', encoding='utf-8') as f:
+                state = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            state = {}
+        for group in GROUPS:
+            state.setdefault(group, {})
+        state.setdefault('house', _empty_totals())
+        return state
+
+    def _write(self):
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self._state, f, indent=4, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+        self._mtime = os.stat(self.path).st_mtime_ns
+
+    def _refresh(self):
+        """Reload the totals if another process has written them since."""
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            return
+        if mtime != self._mtime:
+            with self._lock:
+                self._state = self._read()
+
+    def _apply(self, resident_name: str, room: str, day: str, usage: Dict):
+        buckets = [self._state['house']]
+        for group, key in zip(GROUPS, (resident_name, room, day)):
+            if key:
+                buckets.append(self._state[group].setdefault(key, _empty_totals()))
+        for totals in buckets:
+            totals['requests'] += 1
+            for name in TOKEN_FIELDS:
+                totals[name] += int(usage.get(name) or 0)
+            totals['cost_usd'] = round(totals['cost_usd'] + (usage.get('cost_usd') or 0.0), 6)
+
+    def record(self, resident_name: str, room: str, day: str, usage: Dict):
+        """Add one response's usage (``usage_fields``) to the running totals and persist them."""
+        # Other workers may have written since our last read, so merge into the file's state
+        with self._lock, file_lock(self.path):
+            self._state = self._read()
+            self._apply(resident_name, room, day, usage)
+            self._write()
+
+    def totals(self, group: Optional[str] = None) -> Dict:
+        """
+        Args:
+            group (str): 'residents', 'rooms' or 'days'; the whole house if None
+
+        Returns:
+            dict: requests, token counts and cost_usd (per key when grouped)
+        """
+        self._refresh()
+        if group is None:
+            return self._state['house']
+        return self._state[group]
+
+    def rebuild(self, logs_dir: str = default_logs_dir, archive_dir: Optional[str] = default_archive_dir) -> int:
+        """
+        Recompute the totals from log records that carry usage.
+
+        Days whose raw logs have been deleted after archiving are read back
+        from the Parquet archive (when pyarrow is installed). A streamed
+        answer shared by several residents is logged once per resident but
+        billed once, so records repeating an ``llm_call_id`` are skipped.
+
+        Args:
+            archive_dir (str): The ``log_archive.py`` archive; None to read the raw logs only
+
+        Returns:
+            int: Number of responses counted
+        """
+        with self._lock, file_lock(self.path):
+            self._state = {**{group: {} for group in GROUPS}, 'house': _empty_totals()}
+            count = 0
+            seen_calls = set()
+            for record in iter_log_records(logs_dir, archive_dir):
+                if record.get('input_tokens') in (None, ''):
+                    continue
+                call_id = record.get('llm_call_id')
+                if call_id:
+                    if call_id in seen_calls:
+                        continue
+                    seen_calls.add(call_id)
+                self._apply(record.get('resident_name', ''), record.get('room', ''), record.get('date', ''), record)
+                count += 1
+            self._write()
+        return count
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(description="Token usage and cost per resident, room and day")
+    parser.add_argument('--logs-dir', default=default_logs_dir)
+    parser.add_argument('--archive-dir', default=default_archive_dir)
+    sub = parser.add_subparsers(dest='command', required=True)
+    sub.add_parser('rebuild', help="Backfill the totals from logs/ and archive/")
+    report_parser = sub.add_parser('report', help="Print the totals")
+    report_parser.add_argument('--by', choices=['resident', 'room', 'day'])
+    args = parser.parse_args(argv)
+
+    ledger = UsageLedger(args.logs_dir)
+    if args.command == 'rebuild':
+        count = ledger.rebuild(args.logs_dir, args.archive_dir)
+        print(f"Rebuilt usage totals from {count} logged responses into {ledger.path}")
+        return 0
+
+    rows = {'house': ledger.totals()} if args.by is None else ledger.totals(args.by + 's')
+    print(f"{args.by or 'scope':<24}{'requests':>10}{'input':>12}{'output':>10}{'cache read':>12}{'cost USD':>12}")
+    # Days are dd-mm-yyyy like the logs; order them by year, month, day
+    for key, totals in sorted(rows.items(), key=lambda item: item[0].split('-')[::-1]):
+        print(f"{key:<24}{totals['requests']:>10}{totals['input_tokens']:>12}{totals['output_tokens']:>10}"
+              f"{totals['cache_read_input_tokens']:>12}{totals['cost_usd']:>12.4f}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())